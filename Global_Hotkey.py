@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""全局截图热键：窗口在后台或最小化时按下热键也能直接截图
+
+    [Capture]
+    Hotkey = Ctrl+Alt+F     修饰键 Ctrl / Alt / Shift / Win 加一个字母、数字或 F1–F24，留空关闭
+
+Windows 上用 RegisterHotKey 注册（ctypes，无需额外依赖），WM_HOTKEY 由
+QAbstractNativeEventFilter 在主线程接收；其他平台需要可选依赖 pynput
+（pip install pynput），未安装时不注册热键，只输出提示。
+"""
+
+import sys
+import itertools
+
+from PyQt5.QtCore import QObject, QAbstractNativeEventFilter, QCoreApplication, pyqtSignal
+
+DEFAULT_HOTKEY = 'Ctrl+Alt+F'
+
+MODIFIERS = ('ctrl', 'alt', 'shift', 'win')
+_MODIFIER_ALIASES = {'control': 'ctrl', 'meta': 'win', 'super': 'win', 'cmd': 'win'}
+
+# Windows RegisterHotKey 的修饰键标志；MOD_NOREPEAT：按住不放时不重复触发
+_WIN_MODIFIERS = {'alt': 0x0001, 'ctrl': 0x0002, 'shift': 0x0004, 'win': 0x0008}
+_MOD_NOREPEAT = 0x4000
+_WM_HOTKEY = 0x0312
+
+_ids = itertools.count(1)
+
+
+def parse_hotkey(text):
+    """'Ctrl+Alt+F' → (('ctrl', 'alt'), 'f')；格式不对时抛出 ValueError"""
+    parts = [p.strip().lower() for p in text.split('+') if p.strip()]
+    if not parts:
+        raise ValueError("热键为空")
+    *mods, key = parts
+    mods = [_MODIFIER_ALIASES.get(m, m) for m in mods]
+    unknown = [m for m in mods if m not in MODIFIERS]
+    if unknown:
+        raise ValueError(f"未知的修饰键: {'+'.join(unknown)}")
+    if not mods:
+        raise ValueError("全局热键至少需要一个修饰键")
+    if not (len(key) == 1 and key.isalnum() or _function_key(key)):
+        raise ValueError(f"不支持的按键: {key}")
+    return tuple(m for m in MODIFIERS if m in mods), key
+
+
+def _function_key(key):
+    return key.startswith('f') and key[1:].isdigit() and 1 <= int(key[1:]) <= 24
+
+
+def windows_key(mods, key):
+    """RegisterHotKey 的 (修饰键标志, 虚拟键码)"""
+    flags = _MOD_NOREPEAT
+    for m in mods:
+        flags |= _WIN_MODIFIERS[m]
+    vk = 0x6F + int(key[1:]) if _function_key(key) else ord(key.upper())  # VK_F1 = 0x70
+    return flags, vk
+
+
+def pynput_hotkey(mods, key):
+    """pynput.keyboard.GlobalHotKeys 的热键写法，如 '<ctrl>+<alt>+f'"""
+    names = {'win': 'cmd'}
+    keys = [f"<{names.get(m, m)}>" for m in mods]
+    keys.append(f"<{key}>" if _function_key(key) else key)
+    return '+'.join(keys)
+
+
+class _WindowsHotkeyFilter(QAbstractNativeEventFilter):
+    """把主线程消息队列中的 WM_HOTKEY 转给对应的 GlobalHotkey"""
+
+    def __init__(self, hotkey):
+        super().__init__()
+        self._hotkey = hotkey
+
+    def nativeEventFilter(self, event_type, message):
+        if event_type == b'windows_generic_MSG':
+            from ctypes import wintypes
+            msg = wintypes.MSG.from_address(int(message))
+            if msg.message == _WM_HOTKEY and msg.wParam == self._hotkey.id:
+                self._hotkey.activated.emit()
+                return True, 0
+        return False, 0
+
+
+class GlobalHotkey(QObject):
+    """全局热键，按下时在主线程发出 activated"""
+
+    activated = pyqtSignal()
+    _pressed = pyqtSignal()  # pynput 监听线程 → 主线程
+
+    def __init__(self, sequence, parent=None):
+        super().__init__(parent)
+        self.sequence = sequence
+        self.mods, self.key = parse_hotkey(sequence)
+        self.id = next(_ids)
+        self._filter = None
+        self._listener = None
+        self._pressed.connect(self.activated)
+
+    def register(self):
+        """注册热键，成功返回 True（热键被其他程序占用或平台不支持时返回 False）"""
+        if sys.platform == 'win32':
+            return self._register_windows()
+        return self._register_pynput()
+
+    def _register_windows(self):
+        import ctypes
+        flags, vk = windows_key(self.mods, self.key)
+        if not ctypes.windll.user32.RegisterHotKey(None, self.id, flags, vk):
+            print(f"全局热键 {self.sequence} 注册失败（可能已被其他程序占用）")
+            return False
+        self._filter = _WindowsHotkeyFilter(self)
+        QCoreApplication.instance().installNativeEventFilter(self._filter)
+        return True
+
+    def _register_pynput(self):
+        try:
+            from pynput import keyboard
+        except ImportError:
+            print(f"未安装 pynput（pip install pynput），全局热键 {self.sequence} 不可用")
+            return False
+        self._listener = keyboard.GlobalHotKeys({pynput_hotkey(self.mods, self.key): self._pressed.emit})
+        self._listener.daemon = True
+        self._listener.start()
+        return True
+
+    def unregister(self):
+        if self._filter is not None:
+            import ctypes
+            QCoreApplication.instance().removeNativeEventFilter(self._filter)
+            ctypes.windll.user32.UnregisterHotKey(None, self.id)
+            self._filter = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+def hotkey_from_config(conf, parent=None):
+    """根据 config.ini 的 [Capture] Hotkey 创建并注册全局热键，未配置或注册失败时返回 None"""
+    sequence = conf.get('Capture', 'Hotkey', fallback=DEFAULT_HOTKEY).strip()
+    if not sequence:
+        return None
+    try:
+        hotkey = GlobalHotkey(sequence, parent)
+    except ValueError as e:
+        print(f"全局热键配置无效（{sequence}）: {e}")
+        return None
+    return hotkey if hotkey.register() else None
@@ -6,7 +6,6 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import QSize, Qt
 from PyQt5.QtGui import QFont, QIcon
-from PyQt5 import QtWebEngineWidgets
 
 
 # ============ 全局样式表 ============
@@ -166,6 +165,19 @@ QPlainTextEdit {
     selection-background-color: #dce0ff;
 }
 
+/* ---------- 识别队列列表 ---------- */
+QListWidget#job_list {
+    background-color: #fafafc;
+    color: #333344;
+    border: 1px solid #e8e8ef;
+    border-radius: 10px;
+    padding: 6px;
+}
+QListWidget#job_list::item:selected {
+    background-color: #dce0ff;
+    color: #1a1a2e;
+}
+
 /* ---------- 状态标签 ---------- */
 QLabel#status_label {
     color: #4f6ef7;
@@ -256,8 +268,11 @@ class MainWindowUI(object):
         self.plain_text_edit = None
         self.imageLabel = None
         self.latexLabel = None
+        self.latexWebView = None
+        self._latex_layout = None
         self.Copy_Status_Label = None
         self.outputLabel = None
+        self.job_list = None
         self.mainLayout = None
 
     def setup_ui(self, mainwindow):
@@ -298,6 +313,11 @@ class MainWindowUI(object):
         self.screenshotButton.setObjectName("screenshotButton")
         self.top_button_layout.addWidget(self.screenshotButton)
 
+        # 监视区域按钮：框选后内容变化时自动重新识别，监视中再次点击停止
+        self.watchButton = QtWidgets.QPushButton("  👁 监视区域", toolbar_frame)
+        self.watchButton.setToolTip("框选一块屏幕区域，内容变化时自动重新识别；再次点击停止监视")
+        self.top_button_layout.addWidget(self.watchButton)
+
         self.top_button_layout.addStretch()
 
         # 设置按钮
@@ -355,10 +375,13 @@ class MainWindowUI(object):
         latex_header.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Fixed)
         latex_layout.addWidget(latex_header)
 
-        self.latexWebView = QtWebEngineWidgets.QWebEngineView(latex_card)
-        self.latexWebView.setMinimumSize(380, 200)
-        self.latexWebView.setStyleSheet("background: #ffffff; border: none;")
-        latex_layout.addWidget(self.latexWebView, stretch=1)
+        # QWebEngineView 会启动 Chromium 进程，窗口首次绘制后再由 init_preview() 创建，先放占位标签
+        self.latexLabel = QtWidgets.QLabel("公式预览加载中…", latex_card)
+        self.latexLabel.setObjectName("latexLabel")
+        self.latexLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.latexLabel.setMinimumSize(380, 200)
+        latex_layout.addWidget(self.latexLabel, stretch=1)
+        self._latex_layout = latex_layout
 
         self.previewLayout.addWidget(latex_card, stretch=1)
 
@@ -412,7 +435,33 @@ class MainWindowUI(object):
         self.plain_text_edit.setPlainText("")
         code_layout.addWidget(self.plain_text_edit)
 
-        self.mainLayout.addWidget(code_card, stretch=2)
+        # ====== LaTeX 代码 + 识别队列：左右两栏 ======
+        resultLayout = QtWidgets.QHBoxLayout()
+        resultLayout.setSpacing(14)
+        resultLayout.addWidget(code_card, stretch=2)
+
+        # 右卡片：识别队列（每个截图 / 图片一个任务，点击查看结果）
+        queue_card = QtWidgets.QFrame(self.centralwidget)
+        queue_card.setObjectName("card")
+        queue_layout = QtWidgets.QVBoxLayout(queue_card)
+        queue_layout.setContentsMargins(6, 2, 6, 2)
+        queue_layout.setSpacing(0)
+
+        queue_header = QtWidgets.QLabel("📑 识别队列", queue_card)
+        queue_header.setObjectName("section_header")
+        queue_header.setContentsMargins(8, 2, 0, 0)
+        queue_header.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Fixed)
+        queue_layout.addWidget(queue_header)
+
+        self.job_list = QtWidgets.QListWidget(queue_card)
+        self.job_list.setObjectName("job_list")
+        self.job_list.setMinimumHeight(90)
+        self.job_list.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        queue_layout.addWidget(self.job_list)
+
+        resultLayout.addWidget(queue_card, stretch=1)
+
+        self.mainLayout.addLayout(resultLayout, stretch=2)
 
         # ====== 底部操作栏 ======
         bottom_frame = QtWidgets.QFrame(self.centralwidget)
@@ -467,3 +516,14 @@ class MainWindowUI(object):
         self.mainLayout.addWidget(bottom_frame)
 
         mainwindow.setCentralWidget(self.centralwidget)
+
+    def init_preview(self):
+        """按需导入 QtWebEngine 并创建公式预览，替换占位标签；重复调用返回同一个视图"""
+        if self.latexWebView is None:
+            from PyQt5 import QtWebEngineWidgets
+            self.latexWebView = QtWebEngineWidgets.QWebEngineView(self.latexLabel.parentWidget())
+            self.latexWebView.setMinimumSize(380, 200)
+            self.latexWebView.setStyleSheet("background: #ffffff; border: none;")
+            self._latex_layout.replaceWidget(self.latexLabel, self.latexWebView)
+            self.latexLabel.hide()
+        return self.latexWebView
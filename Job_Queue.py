@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""界面识别任务队列
+
+截图、粘贴、拖拽（可一次拖入多个文件）都作为任务加入队列，最多 max_workers 个任务
+同时识别，其余排队；各模型的调用频率仍由识别器自带的令牌桶限速器控制。
+任务状态（排队 / 识别中 / 完成 / 失败 / 已取消）与耗时变化时发出 job_updated 信号，
+界面据此刷新结果列表，识别期间不会阻塞新的截图。任务在 Worker_Pool 的常驻线程中执行。
+"""
+
+import time
+import itertools
+from collections import deque
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from Worker_Pool import worker_pool
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+STATUS_LABELS = {
+    QUEUED: '⏳ 排队中', RUNNING: '🔄 识别中', DONE: '✅ 完成', FAILED: '❌ 失败', CANCELLED: '⏹ 已取消',
+}
+
+DEFAULT_WORKERS = 2
+
+
+class RecognitionJob:
+    """队列中的一个识别任务"""
+
+    def __init__(self, job_id, img_path, section, display_name='', image=None):
+        self.id = job_id
+        self.img_path = img_path
+        self.image = image  # 内存中的图片（截图），有则直接识别，不必等 img_path 写盘
+        self.section = section
+        self.display_name = display_name or section
+        self.status = QUEUED
+        self.result = ''
+        self.partial = ''  # 流式识别已收到的文本
+        self.source = ''
+        self.error = ''
+        self.provider = ''  # 对冲 / 故障切换时实际返回结果的 section
+        self.ttft_ms = None
+        self.total_ms = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def wait_s(self):
+        """排队等待时间（秒）"""
+        return (self.started or self.finished or time.time()) - self.created
+
+    @property
+    def elapsed_s(self):
+        """从开始识别到结束（或现在）的时间（秒）"""
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def summary(self):
+        """结果列表中显示的一行文字"""
+        parts = [f"#{self.id}", STATUS_LABELS[self.status], self.display_name]
+        if self.elapsed_s is not None and self.status != QUEUED:
+            parts.append(f"{self.elapsed_s:.1f}s")
+        if self.source in ('cache', 'reused'):
+            parts.append('缓存')
+        if self.status == DONE:
+            text = self.result.replace('\n', ' ')
+            parts.append(text[:40] + ('…' if len(text) > 40 else ''))
+        elif self.status == FAILED:
+            parts.append(self.error[:40])
+        return '  '.join(parts)
+
+
+class JobQueue(QObject):
+    """识别任务队列：最多 max_workers 个任务同时在常驻线程池 pool 中执行
+
+    worker_factory(img_path, section) 返回 OcrWorker（或具有相同信号与 run_ocr /
+    cancel_token 的对象），任务带有内存中的图片时 img_path 参数传入该图片。
+    信号均在主线程发出。
+    """
+
+    job_added = pyqtSignal(int)
+    job_updated = pyqtSignal(int)
+    job_chunk = pyqtSignal(int, str)  # (任务 id, 流式识别的增量文本)
+
+    def __init__(self, worker_factory, max_workers=DEFAULT_WORKERS, pool=None, parent=None):
+        super().__init__(parent)
+        self._factory = worker_factory
+        self.max_workers = max(1, max_workers)
+        self._pool = pool or worker_pool
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._pending = deque()
+        self._workers = {}  # worker -> job
+        self._tasks = {}  # TaskFuture -> (worker, job)
+
+    def submit(self, img_path, section, display_name='', image=None):
+        """加入一个识别任务，返回 RecognitionJob"""
+        job = RecognitionJob(next(self._ids), img_path, section, display_name, image)
+        self._jobs[job.id] = job
+        self._pending.append(job)
+        self.job_added.emit(job.id)
+        self._dispatch()
+        return job
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def active_count(self):
+        return sum(1 for job in self._jobs.values() if job.active)
+
+    def running_count(self):
+        return len(self._tasks)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移出队列，识别中的中止请求"""
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        if job.status == QUEUED:
+            self._pending.remove(job)
+            self._finish(job, CANCELLED)
+            return True
+        for worker, running in self._workers.items():
+            if running is job:
+                worker.cancel_token.cancel()
+        return True
+
+    def cancel_all(self):
+        for job in list(self._jobs.values()):
+            self.cancel(job.id)
+
+    def discard_finished(self):
+        """移除已结束的任务，返回被移除的任务 id"""
+        finished = [job.id for job in self._jobs.values() if not job.active]
+        for job_id in finished:
+            del self._jobs[job_id]
+        return finished
+
+    def _dispatch(self):
+        while self._pending and len(self._tasks) < self.max_workers:
+            self._start(self._pending.popleft())
+
+    def _start(self, job):
+        # worker 留在主线程，run_ocr 在线程池中执行，发出的信号排队回到主线程
+        worker = self._factory(job.image if job.image is not None else job.img_path, job.section)
+        self._workers[worker] = job
+
+        worker.chunk.connect(self._on_chunk)
+        worker.timing.connect(self._on_timing)
+        worker.provider.connect(self._on_provider)
+        worker.success.connect(self._on_success)
+        worker.error.connect(self._on_error)
+        worker.cancelled.connect(self._on_cancelled)
+
+        job.status = RUNNING
+        job.started = time.time()
+        self.job_updated.emit(job.id)
+        task = self._pool.submit(worker.run_ocr)
+        self._tasks[task] = (worker, job)
+        task.finished.connect(self._on_task_finished)
+
+    def _finish(self, job, status):
+        if job.active:
+            job.status = status
+            job.finished = time.time()
+            self.job_updated.emit(job.id)
+
+    def _sender_job(self):
+        return self._workers.get(self.sender())
+
+    def _on_chunk(self, text):
+        job = self._sender_job()
+        if job is not None and job.status == RUNNING:
+            job.partial += text
+            self.job_chunk.emit(job.id, text)
+
+    def _on_timing(self, ttft_ms, total_ms):
+        job = self._sender_job()
+        if job is not None:
+            job.ttft_ms = ttft_ms if ttft_ms >= 0 else None
+            job.total_ms = total_ms
+
+    def _on_provider(self, section):
+        job = self._sender_job()
+        if job is not None:
+            job.provider = section
+
+    def _on_success(self, result, source):
+        job = self._sender_job()
+        if job is not None:
+            job.result = result
+            job.source = source
+            self._finish(job, DONE)
+
+    def _on_error(self, message):
+        job = self._sender_job()
+        if job is not None:
+            job.error = message
+            self._finish(job, FAILED)
+
+    def _on_cancelled(self):
+        job = self._sender_job()
+        if job is not None:
+            self._finish(job, CANCELLED)
+
+    def _on_task_finished(self):
+        task = self.sender()
+        worker, job = self._tasks.pop(task, (None, None))
+        if worker is None:
+            return
+        self._workers.pop(worker, None)
+        worker.deleteLater()
+        if job.active:
+            # run_ocr 结束但没有发出结果信号（抛出异常或在开始前被线程池取消）
+            error = None if task.cancelled() else task.exception()
+            job.error = f"识别错误: {error}" if error else '工作线程意外结束'
+            self._finish(job, FAILED)
+        self._dispatch()
@@ -0,0 +1,458 @@
+# OCR_Cache.py
+# 识别结果缓存：以「图片像素内容 + 识别器类型 + 模型名 + prompt」寻址的本地持久缓存
+# 基于 SQLite（WAL 模式），多个进程可同时读写同一个缓存文件
+# 另维护感知哈希（dHash）索引，重新截图得到的近似图片也能复用已有结果
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import itertools
+import threading
+from PIL import Image, ImageOps
+
+CACHE_FILE_NAME = 'ocr_cache.sqlite3'
+
+# dHash 网格：16x16 = 256 位
+PHASH_GRID = 16
+# 近似命中的复核缩略图尺寸（二值，每像素 1 位）
+THUMB_SIZE = (128, 32)
+# 缩略图中不同像素占笔画像素的比例上限：同一公式重新截图约 0.002，差一个字符约 0.03 以上
+THUMB_MAX_DIFF = 0.01
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key        TEXT PRIMARY KEY,
+    latex      TEXT NOT NULL,
+    recognizer TEXT NOT NULL,
+    model      TEXT NOT NULL,
+    phash      TEXT,
+    aspect     REAL,
+    thumb      BLOB,
+    size       INTEGER NOT NULL,
+    created    REAL NOT NULL,
+    accessed   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results(created);
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def _pixel_digest(rgba):
+    digest = hashlib.sha256()
+    digest.update(f"{rgba.width}x{rgba.height}".encode())
+    digest.update(rgba.tobytes())
+    return digest.hexdigest()
+
+
+def image_fingerprint(image_path):
+    """计算图片内容指纹：对解码后的 RGBA 像素求 SHA-256，与文件格式、元数据无关"""
+    with Image.open(image_path) as img:
+        return _pixel_digest(img.convert('RGBA'))
+
+
+def _content(gray):
+    """自动对比度后按内容外接框裁剪，返回 (内容灰度图, 背景亮度)
+
+    选区偏移几个像素、背景色不同的截图裁剪后内容相同。
+    """
+    gray = ImageOps.autocontrast(gray.convert('L'))
+    background = gray.getpixel((0, 0))
+    box = gray.point(lambda p: 255 if abs(p - background) > 48 else 0).getbbox()
+    if box:
+        gray = gray.crop(box)
+    return gray, background
+
+
+def _dhash(content):
+    cols = PHASH_GRID + 1
+    pixels = content.resize((cols, PHASH_GRID), Image.BOX).tobytes()
+    value = 0
+    for row in range(PHASH_GRID):
+        base = row * cols
+        for col in range(PHASH_GRID):
+            value = (value << 1) | (pixels[base + col] > pixels[base + col + 1])
+    return value
+
+
+def _thumbnail(content, background):
+    small = content.resize(THUMB_SIZE, Image.BOX)
+    return small.point(lambda p: 255 if abs(p - background) > 96 else 0).convert('1').tobytes()
+
+
+def perceptual_hash(gray):
+    """计算 dHash：裁掉四周留白后缩放到 17x16，比较横向相邻像素亮度
+
+    返回 (256 位整数哈希, 内容宽高比)。
+    """
+    content, _ = _content(gray)
+    return _dhash(content), content.width / content.height
+
+
+def content_thumbnail(gray):
+    """按内容外接框归一化的二值缩略图（THUMB_SIZE，每像素 1 位），用于复核近似命中"""
+    return _thumbnail(*_content(gray))
+
+
+def thumb_difference(a, b):
+    """两张二值缩略图中不同的像素数占笔画像素数的比例"""
+    a, b = int.from_bytes(a, 'big'), int.from_bytes(b, 'big')
+    return (a ^ b).bit_count() / max(1, a.bit_count(), b.bit_count())
+
+
+def image_signatures(image):
+    """一次解码同时计算内容指纹、感知哈希与复核用缩略图，返回 (fingerprint, phash, aspect, thumb)
+
+    image 可以是图片路径或已解码的 PIL 图片。
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as img:
+            return image_signatures(img)
+    rgba = image.convert('RGBA')
+    content, background = _content(rgba.convert('L'))
+    return (_pixel_digest(rgba), _dhash(content), content.width / content.height,
+            _thumbnail(content, background))
+
+
+def cache_scope(recognizer_type, model_name):
+    """近似索引的作用域：只复用同一识别器、同一模型的结果"""
+    return f"{recognizer_type}/{model_name or ''}"
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，半径查询只访问满足三角不等式的子树"""
+
+    def __init__(self):
+        self._root = None  # 节点: [hash, values, {distance: child}]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        self._size += 1
+        if self._root is None:
+            self._root = [key, [value], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming_distance(key, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [key, [value], {}]
+                return
+            node = child
+
+    def remove(self, key, value):
+        """删除一个值；节点本身保留（可能还有子树挂在下面），返回是否找到"""
+        node = self._root
+        while node is not None:
+            d = hamming_distance(key, node[0])
+            if d == 0:
+                if value in node[1]:
+                    node[1].remove(value)
+                    self._size -= 1
+                    return True
+                return False
+            node = node[2].get(d)
+        return False
+
+    def search(self, key, radius):
+        """返回距离不超过 radius 的所有 (distance, value)，按距离升序"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming_distance(key, node[0])
+            if d <= radius:
+                found.extend((d, v) for v in node[1])
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class PerceptualIndex:
+    """近似图片索引：按作用域（识别器 + 模型）分别建树，感知哈希 -> 条目，线程安全
+
+    条目以 key 标识（缓存条目为缓存键，外部结果自动编号），缓存淘汰时按 key 删除。
+    感知哈希只负责找候选，命中前再比较二值缩略图，差一个字符的公式不会被当作同一张图。
+    """
+
+    def __init__(self, aspect_tolerance=0.15, max_difference=THUMB_MAX_DIFF):
+        self.aspect_tolerance = aspect_tolerance
+        self.max_difference = max_difference
+        self._trees = {}    # 作用域 -> BKTree(phash -> key)
+        self._entries = {}  # key -> (latex, aspect, thumb, phash, scope)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, phash, aspect, thumb, latex, scope='', key=None):
+        with self._lock:
+            if key is None:
+                key = ('external', next(self._ids))
+            else:
+                self._discard(key)
+            self._entries[key] = (latex, aspect, thumb, phash, scope)
+            self._trees.setdefault(scope, BKTree()).add(phash, key)
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._trees[entry[4]].remove(entry[3], key)
+
+    def find(self, phash, aspect, thumb, threshold, scope=''):
+        """查找同一作用域内汉明距离 <= threshold、宽高比接近且缩略图几乎相同的最相似条目
+
+        返回 (latex, distance) 或 None；没有缩略图（无法复核）的条目不会命中。
+        """
+        if thumb is None:
+            return None
+        with self._lock:
+            tree = self._trees.get(scope)
+            candidates = tree.search(phash, threshold) if tree is not None else []
+            entries = [(distance, self._entries[key]) for distance, key in candidates]
+        for distance, (latex, other_aspect, other_thumb, _, _) in entries:
+            if abs(aspect - other_aspect) > self.aspect_tolerance * max(aspect, other_aspect):
+                continue
+            if other_thumb is None or len(other_thumb) != len(thumb):
+                continue
+            if thumb_difference(thumb, other_thumb) <= self.max_difference:
+                return latex, distance
+        return None
+
+
+def make_cache_key(fingerprint, recognizer_type, model_name, prompt):
+    """由图片指纹和识别器配置生成缓存键（任一项变化都会使缓存失效）"""
+    raw = json.dumps(
+        [fingerprint, recognizer_type, model_name or '', prompt],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """识别结果的持久缓存（数量 / 体积 / 存活时间三种淘汰策略）"""
+
+    def __init__(self, path, max_entries=5000, max_bytes=50 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, phash_threshold=4, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # 近似图片判定阈值（256 位 dHash 的汉明距离），0 表示关闭近似复用
+        self.phash_threshold = phash_threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        # 本进程内的命中统计（跨进程的累计值保存在 counters 表）
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        self._index = None  # 首次近似查询时从数据库加载
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+            if 'phash' not in columns:  # 兼容旧版本缓存文件
+                conn.execute("ALTER TABLE results ADD COLUMN phash TEXT")
+                conn.execute("ALTER TABLE results ADD COLUMN aspect REAL")
+            if 'thumb' not in columns:
+                conn.execute("ALTER TABLE results ADD COLUMN thumb BLOB")
+
+    def _connect(self):
+        """每次操作使用独立连接，避免跨线程共享 sqlite3 连接"""
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return _ClosingConnection(conn)
+
+    def _bump(self, conn, name):
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES(?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key):
+        """查询缓存，命中返回 LaTeX 字符串，未命中或已过期返回 None"""
+        now = self._clock()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT latex, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age and now - row[1] > self.max_age:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._unindex([key])
+                row = None
+
+            if row is None:
+                self._bump(conn, 'misses')
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self._bump(conn, 'hits')
+            with self._lock:
+                self.hits += 1
+            return row[0]
+
+    def put(self, key, latex, recognizer_type='', model_name='', phash=None, aspect=None, thumb=None):
+        """写入一条识别结果（可附带感知哈希与复核缩略图），并按淘汰策略清理旧条目"""
+        now = self._clock()
+        size = len(latex.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results"
+                "(key, latex, recognizer, model, phash, aspect, thumb, size, created, accessed) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, latex, recognizer_type, model_name or '',
+                 format(phash, 'x') if phash is not None else None, aspect, thumb, size, now, now)
+            )
+            evicted = self._evict(conn, now)
+        self._unindex(evicted)
+        if phash is not None and self._index is not None and key not in evicted:
+            self._index.add(phash, aspect, thumb, latex, cache_scope(recognizer_type, model_name), key)
+
+    def add_similar(self, phash, aspect, thumb, latex, scope=''):
+        """把外部结果（如 history.json 中的记录）加入近似索引；scope 见 cache_scope()"""
+        self._load_index().add(phash, aspect, thumb, latex, scope)
+
+    def find_similar(self, phash, aspect, thumb, scope=''):
+        """在 scope 内按感知哈希查找近似图片并用缩略图复核，返回 (latex, distance) 或 None"""
+        if not self.phash_threshold:
+            return None
+        found = self._load_index().find(phash, aspect, thumb, self.phash_threshold, scope)
+        if found is not None:
+            with self._lock:
+                self.reused += 1
+            with self._connect() as conn:
+                self._bump(conn, 'reused')
+        return found
+
+    def _load_index(self):
+        with self._lock:
+            if self._index is None:
+                index = PerceptualIndex()
+                with self._connect() as conn:
+                    rows = conn.execute(
+                        "SELECT key, phash, aspect, thumb, latex, recognizer, model FROM results "
+                        "WHERE phash IS NOT NULL"
+                    ).fetchall()
+                for key, phash, aspect, thumb, latex, recognizer_type, model_name in rows:
+                    index.add(int(phash, 16), aspect, thumb, latex, cache_scope(recognizer_type, model_name), key)
+                self._index = index
+            return self._index
+
+    def _unindex(self, keys):
+        """已删除的缓存条目同时移出近似索引"""
+        if self._index is not None:
+            for key in keys:
+                self._index.remove(key)
+
+    def _evict(self, conn, now):
+        """淘汰过期条目，再按最近访问时间淘汰超出数量 / 体积上限的条目，返回被删除的键"""
+        doomed = []
+        if self.max_age:
+            doomed += [row[0] for row in conn.execute(
+                "SELECT key FROM results WHERE created < ?", (now - self.max_age,))]
+
+        if self.max_entries:
+            doomed += [row[0] for row in conn.execute(
+                "SELECT key FROM results WHERE created >= ? ORDER BY accessed DESC LIMIT -1 OFFSET ?",
+                (now - self.max_age if self.max_age else float('-inf'), self.max_entries))]
+
+        if self.max_bytes:
+            gone = set(doomed)
+            rows = [row for row in conn.execute("SELECT key, size FROM results ORDER BY accessed ASC")
+                    if row[0] not in gone]
+            total = sum(size for _, size in rows)
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append(key)
+                total -= size
+
+        conn.executemany("DELETE FROM results WHERE key = ?", [(key,) for key in doomed])
+        return doomed
+
+    def clear(self):
+        """清空缓存条目（保留累计统计），缓存条目同时移出近似索引"""
+        with self._connect() as conn:
+            keys = [row[0] for row in conn.execute("SELECT key FROM results")]
+            conn.execute("DELETE FROM results")
+        self._unindex(keys)
+
+    def stats(self):
+        """返回缓存统计：本进程命中/未命中、累计命中/未命中、条目数与体积"""
+        with self._connect() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        with self._lock:
+            hits, misses, reused = self.hits, self.misses, self.reused
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'reused': reused,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'total_hits': counters.get('hits', 0),
+            'total_misses': counters.get('misses', 0),
+            'total_reused': counters.get('reused', 0),
+            'entries': entries,
+            'bytes': total,
+        }
+
+
+class _ClosingConnection:
+    """sqlite3 连接的上下文管理器：退出时关闭连接（内置的 with 只提交不关闭）"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.close()
+        return False
+
+
+def cache_from_config(conf, base_dir):
+    """根据 config.ini 的 [Cache] 节创建缓存，Enabled = false 时返回 None"""
+    section = 'Cache'
+    if not conf.getboolean(section, 'Enabled', fallback=True):
+        return None
+    path = conf.get(section, 'Path', fallback='') or os.path.join(base_dir, CACHE_FILE_NAME)
+    try:
+        return ResultCache(
+            path,
+            max_entries=conf.getint(section, 'MaxEntries', fallback=5000),
+            max_bytes=int(conf.getfloat(section, 'MaxSizeMB', fallback=50) * 1024 * 1024),
+            max_age=conf.getfloat(section, 'MaxAgeDays', fallback=30) * 24 * 3600,
+            phash_threshold=conf.getint(section, 'PHashThreshold', fallback=4),
+        )
+    except (sqlite3.Error, OSError) as e:
+        print(f"识别缓存不可用，已禁用: {e}")
+        return None
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""可取消的识别：取消令牌 + 后台常驻事件循环
+
+界面工作线程通过 run_cancellable() 把识别交给后台事件循环中的异步识别器执行，
+自己只等待结果。取消令牌被触发时，对应的 asyncio 任务立即被取消：
+正在进行的 HTTP 请求被中断，重试 / 限速等待随之结束，迟到的结果不会返回。
+后台事件循环常驻，异步连接池在多次识别之间复用。
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+
+
+class RecognitionCancelled(Exception):
+    """识别已被取消（用户取消或被新的截图取代）"""
+
+
+class CancelToken:
+    """线程安全的取消令牌；cancel() 可从任意线程调用，已注册的回调立即执行"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """注册取消回调；令牌已取消时立即调用"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise RecognitionCancelled("识别已取消")
+
+
+class BackgroundLoop:
+    """后台常驻事件循环：同步调用方借此驱动异步识别，异步连接池可跨次复用"""
+
+    def __init__(self, name='ocr-loop'):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=self._name, daemon=True).start()
+            return self._loop
+
+    def run(self, coro, token=None):
+        """在后台循环中执行 coro 并等待结果；token 取消时立即抛出 RecognitionCancelled"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop())
+        if token is not None:
+            # 取消 concurrent Future 会通过 call_soon_threadsafe 取消后台任务
+            token.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise RecognitionCancelled("识别已取消") from None
+
+
+# 进程级后台事件循环，界面识别与对冲识别共用
+background = BackgroundLoop()
+
+
+def run_cancellable(recognizer, image, on_chunk=None, token=None):
+    """同步接口：用 recognizer.arecognize_formula 识别，可被 token 随时取消
+
+    on_chunk 在后台事件循环线程中调用；取消后不再转发迟到的文本块。
+    """
+    if token is not None:
+        token.raise_if_cancelled()
+        if on_chunk is not None:
+            forward = on_chunk
+
+            def on_chunk(text):
+                if not token.cancelled:
+                    forward(text)
+    return background.run(recognizer.arecognize_formula(image, on_chunk=on_chunk), token)
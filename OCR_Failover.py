@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""按 section 的熔断器与故障切换链
+
+每个模型 section 一个熔断器（关闭 → 打开 → 半开）：
+- 关闭：正常请求；连续失败达到 FailureThreshold 次后打开；
+- 打开：在 Cooldown 秒内直接跳过该模型，不再消耗重试时间；
+- 半开：冷却结束后放行一次试探请求，成功则关闭，失败则重新打开。
+
+开启故障切换后，识别按「当前选择的模型 → Chain 中的其余模型」依次尝试，
+跳过熔断中的模型，第一个成功的结果返回。只有连接、超时与可重试的状态码计入熔断
+并切换下一个模型；图片内容、鉴权与配置错误直接抛出：
+
+    [Failover]
+    Enabled = true
+    Chain = API_GLM, API_QWen, API_Gemini
+    FailureThreshold = 3    连续失败多少次后熔断（模型 section 中可单独覆盖）
+    Cooldown = 60           熔断持续秒数（模型 section 中可单独覆盖）
+"""
+
+import time
+import threading
+
+from OCR_Preprocess import ImagePayload
+from OCR_Retry import is_retryable
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_NAMES = {CLOSED: '正常', OPEN: '熔断', HALF_OPEN: '试探'}
+
+
+class CircuitBreaker:
+    """单个 section 的熔断器，线程安全"""
+
+    def __init__(self, name, failure_threshold=3, cooldown=60.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state):
+        if state != self._state:
+            print(f"({self.name}) 熔断器 {STATE_NAMES[self._state]} → {STATE_NAMES[state]}"
+                  + (f"，{self.cooldown:g}s 内跳过该模型（累计熔断 {self.trips} 次）" if state == OPEN else ""))
+            self._state = state
+
+    def allow(self):
+        """是否可以向该模型发请求；半开状态同一时间只放行一个试探请求"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self.trips += 1
+                self._opened_at = self._clock()
+                self._transition(OPEN)
+
+    def release(self):
+        """请求被取消（既非成功也非失败）时归还试探名额"""
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(0.0, self.cooldown - (self._clock() - self._opened_at)) if state == OPEN else 0.0
+            return {'state': state, 'failures': self._failures, 'trips': self.trips, 'retry_in': retry_in}
+
+
+class BreakerRegistry:
+    """按 section 保存熔断器；界面与命令行共用进程级实例"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, section, failure_threshold=3, cooldown=60.0):
+        """取得 section 的熔断器；阈值与冷却时间按最新配置更新，状态保留"""
+        with self._lock:
+            breaker = self._breakers.get(section)
+            if breaker is None:
+                breaker = self._breakers[section] = CircuitBreaker(
+                    section, failure_threshold, cooldown, clock=self._clock)
+            breaker.failure_threshold = failure_threshold
+            breaker.cooldown = cooldown
+            return breaker
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def format_breaker_stats(stats, only_tripped=False):
+    """熔断器状态摘要；only_tripped 时只列出非正常或熔断过的模型"""
+    lines = []
+    for section, s in stats.items():
+        if only_tripped and s['state'] == CLOSED and not s['trips']:
+            continue
+        text = f"{section} {STATE_NAMES[s['state']]}"
+        if s['state'] == OPEN:
+            text += f"（{s['retry_in']:.0f}s 后重试）"
+        lines.append(f"{text}，熔断 {s['trips']} 次")
+    if only_tripped:
+        return '；'.join(lines)
+    return '熔断器：\n' + '\n'.join('  ' + line for line in lines) if lines else '熔断器：暂无'
+
+
+# 进程级默认熔断器
+breakers = BreakerRegistry()
+
+
+def is_provider_failure(error):
+    """连接、超时或可重试的状态码（429 / 5xx 等）才算模型故障；识别器包装过的异常沿 __cause__ 查找"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TimeoutError) or is_retryable(error):
+            return True
+        error = error.__cause__
+    return False
+
+
+class FailoverRecognizer:
+    """按顺序尝试多个 section 的识别器，跳过熔断中的模型，接口与普通识别器相同
+
+    chain 为 [(section, breaker)]，识别器由 get_recognizer(section) 按需取得，
+    未轮到的模型不会创建连接。
+    """
+
+    def __init__(self, chain, get_recognizer):
+        self.chain = chain
+        self._get_recognizer = get_recognizer
+        self._recognizers = {}
+        self.stream = True
+
+    def get_recognizer(self, section):
+        recognizer = self._recognizers.get(section)
+        if recognizer is None:
+            recognizer = self._recognizers[section] = self._get_recognizer(section)
+        return recognizer
+
+    @property
+    def sections(self):
+        return [section for section, _ in self.chain]
+
+    @property
+    def primary(self):
+        return self.get_recognizer(self.chain[0][0])
+
+    @property
+    def model_name(self):
+        return self.primary.model_name
+
+    @property
+    def rate_limiter(self):
+        return self.primary.rate_limiter
+
+    def _candidates(self, errors):
+        for section, breaker in self.chain:
+            if not breaker.allow():
+                print(f"({section}) 熔断中，跳过")
+                errors.append(f"{section}: 熔断中")
+                continue
+            yield section, breaker
+
+    @staticmethod
+    def _tag(result, section):
+        if not getattr(result, 'winner', None):
+            try:
+                result.winner = section
+            except AttributeError:
+                pass
+        return result
+
+    def recognize_formula(self, image, on_chunk=None):
+        payload = ImagePayload.coerce(image)
+        errors = []
+        for section, breaker in self._candidates(errors):
+            try:
+                recognizer = self.get_recognizer(section)
+                chunk_cb = on_chunk if getattr(recognizer, 'stream', False) else None
+                result = recognizer.recognize_formula(payload, on_chunk=chunk_cb)
+            except Exception as e:
+                if not is_provider_failure(e):
+                    # 图片内容、鉴权或配置错误：换模型也无济于事，不计入熔断
+                    breaker.release()
+                    raise
+                breaker.record_failure()
+                errors.append(f"{section}: {e}")
+                print(f"({section}) 识别失败，切换下一个模型: {str(e)[:80]}")
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return self._tag(result, section)
+        raise RuntimeError("所有模型均不可用：" + '；'.join(errors))
+
+    async def arecognize_formula(self, image, on_chunk=None):
+        payload = ImagePayload.coerce(image)
+        errors = []
+        for section, breaker in self._candidates(errors):
+            try:
+                recognizer = self.get_recognizer(section)
+                chunk_cb = on_chunk if getattr(recognizer, 'stream', False) else None
+                result = await recognizer.arecognize_formula(payload, on_chunk=chunk_cb)
+            except Exception as e:
+                if not is_provider_failure(e):
+                    # 图片内容、鉴权或配置错误：换模型也无济于事，不计入熔断
+                    breaker.release()
+                    raise
+                breaker.record_failure()
+                errors.append(f"{section}: {e}")
+                print(f"({section}) 识别失败，切换下一个模型: {str(e)[:80]}")
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return self._tag(result, section)
+        raise RuntimeError("所有模型均不可用：" + '；'.join(errors))
+
+    async def aclose(self):
+        """只关闭实际用到过的识别器"""
+        for recognizer in list(self._recognizers.values()):
+            await recognizer.aclose()
+
+
+def _parse_chain(text):
+    return [s.strip() for s in text.replace('→', ',').split(',') if s.strip()]
+
+
+def failover_from_config(conf, section, get_recognizer, registry=None):
+    """根据 [Failover] 节构造从 section 开始的故障切换识别器；未启用时返回 None
+
+    Chain 中未配置 API Key 的模型会被忽略；Chain 为空时只对 section 本身熔断。
+    """
+    if conf is None or not conf.getboolean('Failover', 'Enabled', fallback=False):
+        return None
+    registry = registry or breakers
+    sections = [section] + [
+        s for s in _parse_chain(conf.get('Failover', 'Chain', fallback=''))
+        if s != section and conf.has_section(s) and conf.get(s, 'APIKey', fallback='')
+    ]
+
+    def setting(s, key, default):
+        source = s if conf.has_option(s, key) else 'Failover'
+        return conf.getfloat(source, key, fallback=default)
+
+    chain = [(s, registry.get(s, int(setting(s, 'FailureThreshold', 3)), setting(s, 'Cooldown', 60.0)))
+             for s in sections]
+    return FailoverRecognizer(chain, get_recognizer)
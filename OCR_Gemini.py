@@ -1,17 +1,19 @@
 # OCR_Gemini.py
-from google import genai
-from google.genai import types as genai_types
 import os
 import time
 import hmac
 import hashlib
+import asyncio
 import httpx
 import base64
 import json
-from openai import OpenAI
-from PIL import Image, ImageFilter
-from io import BytesIO
-from ratelimit import limits, sleep_and_retry
+import threading
+import configparser
+from OCR_Cache import image_signatures, make_cache_key, cache_scope
+from OCR_Preprocess import ImagePayload, PreprocessOptions, options_from_config
+from OCR_RateLimit import (RateLimiter, is_rate_limited, retry_after_from_error,
+                           rate_limiter_from_config)
+from OCR_Retry import RetryPolicy, policy_from_config
 
 # 统一的公式识别 prompt
 FORMULA_RECOGNITION_PROMPT = """请严格按以下要求执行：
@@ -26,28 +28,444 @@ E &= mc^2 \\\\
 F &= ma
 \\end{align}"""
 
+# 模型不支持 temperature / max_tokens 时的报错关键字
+UNSUPPORTED_PARAM_KEYWORDS = ['unsupported_parameter', 'unsupported param', 'not supported']
 
-def encode_image_to_base64(image_path):
-    """将图片编码为 Base64 字符串"""
-    with Image.open(image_path) as img:
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
+def _genai():
+    """按需导入 google-genai（约 0.6s），只在创建 Gemini 识别器时加载，返回 (genai, types)"""
+    from google import genai
+    from google.genai import types
+    return genai, types
 
-class GeminiFormulaRecognizer:
-    def __init__(self, api_key=None, model_name=None):
+
+def _openai():
+    """按需导入 openai SDK（约 0.7s），只在创建 OpenAI 兼容 / GLM 识别器时加载"""
+    import openai
+    return openai
+
+
+# 各识别器类型未配置 ModelName 时使用的模型
+DEFAULT_MODELS = {'gemini': 'gemini-2.0-flash', 'openai': 'gpt-4o-mini', 'glm': 'glm-4.6v-flash'}
+
+# 请求传输方式：sdk 为官方 SDK；raw 为 OCR_Transport 中直接基于 httpx 的轻量实现（不导入 SDK）
+TRANSPORTS = ('sdk', 'raw')
+
+
+def _check_transport(transport):
+    transport = (transport or 'sdk').lower()
+    if transport not in TRANSPORTS:
+        raise ValueError(f"未知的传输方式: {transport}（可选 {' / '.join(TRANSPORTS)}）")
+    return transport
+
+
+# 连接池参数：保持少量长连接，避免每次识别都重新 TCP + TLS 握手
+# 客户端默认超时；实际请求按 RetryPolicy 为每次尝试单独设置（受总时限约束）
+HTTP_TIMEOUT = RetryPolicy().http_timeout()
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300)
+
+
+class PoolStats:
+    """连接池复用统计：借助 httpx 的 trace 扩展记录请求数、新建 TCP 连接数与 TLS 握手数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def _record(self, event):
+        with self._lock:
+            if event == 'connection.connect_tcp.complete':
+                self.connections += 1
+            elif event == 'connection.start_tls.complete':
+                self.tls_handshakes += 1
+
+    def _trace(self, event, info):
+        self._record(event)
+
+    async def _atrace(self, event, info):
+        self._record(event)
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._trace
+
+    async def aon_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._atrace
+
+    def snapshot(self):
+        with self._lock:
+            requests, connections, tls = self.requests, self.connections, self.tls_handshakes
+        return {
+            'requests': requests,
+            'connections': connections,
+            'tls_handshakes': tls,
+            'reuse_rate': 1 - connections / requests if requests else 0.0,
+        }
+
+
+def _http2_enabled(http2):
+    """HTTP/2 需要可选依赖 h2，未安装时回退 HTTP/1.1"""
+    if not http2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("未安装 h2（pip install httpx[http2]），HTTP/2 已回退为 HTTP/1.1")
+        return False
+
+
+def make_http_client(stats=None, http2=False):
+    """创建带 keep-alive 连接池的同步 httpx 客户端"""
+    hooks = {'request': [stats.on_request]} if stats else {}
+    return httpx.Client(timeout=HTTP_TIMEOUT, limits=POOL_LIMITS,
+                        http2=_http2_enabled(http2), event_hooks=hooks)
+
+
+def make_async_http_client(stats=None, http2=False):
+    """创建带 keep-alive 连接池的异步 httpx 客户端（与创建时的事件循环绑定）"""
+    hooks = {'request': [stats.aon_request]} if stats else {}
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=POOL_LIMITS,
+                             http2=_http2_enabled(http2), event_hooks=hooks)
+
+
+class RecognitionResult(str):
+    """识别结果字符串，source 标记来源：'api' 实际调用 / 'cache' 缓存命中 / 'reused' 复用近似图片的结果
+
+    ttft_ms 为流式识别的首个文本块耗时（非流式为 None），total_ms 为本次识别总耗时。
+    """
+
+    def __new__(cls, text, source='api', ttft_ms=None, total_ms=None):
+        obj = super().__new__(cls, text)
+        obj.source = source
+        obj.ttft_ms = ttft_ms
+        obj.total_ms = total_ms
+        return obj
+
+
+class FormulaRecognizerBase:
+    """识别器公共基类：在真正调用 API 前先查询结果缓存（cache 为 OCR_Cache.ResultCache）
+
+    同步接口 recognize_formula 与异步接口 arecognize_formula 共用缓存逻辑，
+    子类分别实现 _recognize / _arecognize。
+    """
+
+    recognizer_type = ''
+
+    def __init__(self):
+        self.cache = None
+        # 令牌桶限速器（OCR_RateLimit.RateLimiter），None 表示不限速
+        self.rate_limiter = None
+        # 上传前的图片预处理参数（OCR_Preprocess）
+        self.preprocess = PreprocessOptions.for_provider(self.recognizer_type)
+        # 界面识别时是否使用流式接口（recognize_formula 传入 on_chunk 时生效）
+        self.stream = True
+        # 重试 / 超时策略（OCR_Retry），通过 recognizer_from_config 创建时按 config.ini 覆盖
+        self.retry_policy = RetryPolicy()
+        self.pool_stats = PoolStats()
+        # 异步 HTTP 客户端与事件循环绑定，换了事件循环需要重建
+        self._async_http = None
+        self._async_loop = None
+
+    def _async_http_client(self):
+        """返回当前事件循环专用的异步 HTTP 客户端，返回 (client, 是否新建)"""
+        loop = asyncio.get_running_loop()
+        if self._async_http is None or self._async_loop is not loop:
+            self._async_http = self._new_async_http_client()
+            self._async_loop = loop
+            return self._async_http, True
+        return self._async_http, False
+
+    def _new_async_http_client(self):
+        return make_async_http_client(self.pool_stats, getattr(self, '_http2', False))
+
+    def close(self):
+        """关闭连接池；异步连接池所属的事件循环仍在（其他线程中）运行时交给它关闭，已结束则直接丢弃"""
+        loop, async_http = self._async_loop, self._async_http
+        self._async_http = None
+        self._async_loop = None
+        if async_http is not None and loop is not None and loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                asyncio.run_coroutine_threadsafe(async_http.aclose(), loop)
+
+    async def aclose(self):
+        """在当前事件循环中关闭异步连接池"""
+        if self._async_http is not None and self._async_loop is asyncio.get_running_loop():
+            await self._async_http.aclose()
+        self._async_http = None
+        self._async_loop = None
+
+    def _prepare_image(self, payload):
+        """按 self.preprocess 预处理图片，返回不可变的 PreparedImage（同一 payload 只编码一次）"""
+        prepared = payload.prepare(self.preprocess)
+        print(f"({self.model_name}) 图片预处理: {prepared.report}")
+        return prepared
+
+    @staticmethod
+    def _limit_timeout(state):
+        """限速等待的上限：本次识别剩余的总时限（未设置总时限时不限）"""
+        remaining = state.remaining()
+        return None if remaining == float('inf') else max(0.0, remaining)
+
+    def _throttle(self, state):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self._limit_timeout(state))
+
+    async def _athrottle(self, state):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(self._limit_timeout(state))
+
+    def _record_success(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_success()
+
+    async def _arecord_success(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.arecord_success()
+
+    def _note_rate_limit(self, error, retry_after):
+        """遇到 429 时通知限速器降速；服务端给出等待时间时返回 True（由限速器负责等待）"""
+        if self.rate_limiter is None or not is_rate_limited(error):
+            return False
+        self.rate_limiter.penalize(retry_after)
+        return retry_after is not None
+
+    def _retry_delay(self, error, state):
+        """请求失败后按 state（RetryState）决定是否重试：可重试返回等待秒数，否则返回 None"""
+        retry_after = retry_after_from_error(error)
+        honored = self._note_rate_limit(error, retry_after)
+        wait = state.next_delay(error, retry_after)
+        if wait is not None:
+            if honored:
+                wait = 0  # 限速器会等到 Retry-After 之后再放行
+            print(f"({self.model_name}) 请求失败，{wait:.1f}s 后重试 "
+                  f"({state.attempt}/{self.retry_policy.retries}): {str(error)[:80]}")
+        return wait
+
+    def _request_error(self, error):
+        """不再重试时抛出的异常，原始异常保留为 __cause__"""
+        return RuntimeError(f"({self.model_name}) 识别错误: {error}")
+
+    def _retrying(self, attempt):
+        """同步重试循环，_recognize 与 _stream 共用：逐段产出 attempt(state) 生成的文本
+
+        attempt(state) 为生成器函数，发起一次请求（超时取自 RetryState），非流式请求只产出一次完整结果。
+        每次尝试前限速，成功后通知限速器恢复速率；失败时按 retry_policy 等待后重试，
+        已经产出文本、不可重试或时限用完时抛出 _request_error()。
+        """
+        state = self.retry_policy.start()
+        while True:
+            started = False
+            pieces = None
+            try:
+                self._throttle(state)
+                pieces = attempt(state)
+                for piece in pieces:
+                    started = True
+                    yield piece
+                self._record_success()
+                return
+            except Exception as e:
+                # 已经输出了部分文本就不能再重试
+                wait = None if started else self._retry_delay(e, state)
+                if wait is None:
+                    raise self._request_error(e) from e
+                self.retry_policy.sleep(wait)
+            finally:
+                if pieces is not None:
+                    pieces.close()
+
+    async def _aretrying(self, attempt):
+        """_retrying 的异步版本：attempt(state) 为异步生成器函数，等待时不占用线程"""
+        state = self.retry_policy.start()
+        while True:
+            started = False
+            pieces = None
+            try:
+                await self._athrottle(state)
+                pieces = attempt(state)
+                async for piece in pieces:
+                    started = True
+                    yield piece
+                await self._arecord_success()
+                return
+            except Exception as e:
+                wait = None if started else self._retry_delay(e, state)
+                if wait is None:
+                    raise self._request_error(e) from e
+                await self.retry_policy.asleep(wait)
+            finally:
+                if pieces is not None:
+                    await pieces.aclose()
+
+    def _finalize(self, text):
+        """流式识别结束后整理完整文本（子类可做清洗与校验）"""
+        return text
+
+    def _timed_result(self, text, start, ttft_ms=None):
+        total_ms = (time.perf_counter() - start) * 1000
+        if ttft_ms is not None:
+            print(f"({self.model_name}) 首个文本块 {ttft_ms:.0f}ms，总耗时 {total_ms:.0f}ms")
+        return RecognitionResult(text, ttft_ms=ttft_ms, total_ms=total_ms)
+
+    def _run(self, payload, on_chunk, start):
+        if on_chunk is None:
+            return self._timed_result(self._recognize(payload), start)
+        pieces, ttft_ms = [], None
+        for piece in self._stream(payload):
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+            pieces.append(piece)
+            on_chunk(piece)
+        return self._timed_result(self._finalize(''.join(pieces)), start, ttft_ms)
+
+    async def _arun(self, payload, on_chunk, start):
+        if on_chunk is None:
+            return self._timed_result(await self._arecognize(payload), start)
+        pieces, ttft_ms = [], None
+        async for piece in self._astream(payload):
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+            pieces.append(piece)
+            on_chunk(piece)
+        return self._timed_result(self._finalize(''.join(pieces)), start, ttft_ms)
+
+    def recognize_formula(self, image, on_chunk=None):
+        """识别图片中的公式；缓存命中时直接返回，不发起网络请求
+
+        image 可以是图片路径、图片字节、PIL 图片或 ImagePayload；
+        传入同一个 ImagePayload 时，多个识别器共用同一份预处理结果。
+        传入 on_chunk 时使用流式接口，每收到一段文本就调用 on_chunk(text)。
+        """
+        start = time.perf_counter()
+        payload = ImagePayload.coerce(image)
+        lookup = None
+        if self.cache is not None:
+            lookup = self._cache_lookup(payload)
+            if isinstance(lookup, RecognitionResult):
+                if on_chunk is not None:
+                    on_chunk(str(lookup))
+                return lookup
+        result = self._run(payload, on_chunk, start)
+        if lookup is not None:
+            self._cache_store(lookup, result)
+        return result
+
+    async def arecognize_formula(self, image, on_chunk=None):
+        """异步识别图片中的公式；多个请求可在同一事件循环中并发执行"""
+        start = time.perf_counter()
+        payload = ImagePayload.coerce(image)
+        lookup = None
+        if self.cache is not None:
+            # 图片解码与 SQLite 查询放到线程中，避免阻塞事件循环
+            lookup = await asyncio.to_thread(self._cache_lookup, payload)
+            if isinstance(lookup, RecognitionResult):
+                if on_chunk is not None:
+                    on_chunk(str(lookup))
+                return lookup
+        result = await self._arun(payload, on_chunk, start)
+        if lookup is not None:
+            await asyncio.to_thread(self._cache_store, lookup, result)
+        return result
+
+    def _cache_lookup(self, payload):
+        """查询精确缓存与近似图片索引：命中返回 RecognitionResult，否则返回写缓存所需的 (key, phash, aspect, thumb)"""
+        fingerprint, phash, aspect, thumb = image_signatures(payload.image())
+        key = make_cache_key(
+            fingerprint, self.recognizer_type,
+            self.model_name, FORMULA_RECOGNITION_PROMPT
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"({self.model_name}) 命中识别缓存")
+            return RecognitionResult(cached, source='cache')
+
+        # 像素不完全相同，但可能是同一模型识别过的同一公式的重新截图（选区偏移、背景不同）；
+        # 近似结果不写回精确键，万一误判也不会固化下来
+        similar = self.cache.find_similar(phash, aspect, thumb, cache_scope(self.recognizer_type, self.model_name))
+        if similar is not None:
+            latex, distance = similar
+            print(f"({self.model_name}) 复用近似图片的识别结果（汉明距离 {distance}）")
+            return RecognitionResult(latex, source='reused')
+        return key, phash, aspect, thumb
+
+    def _cache_store(self, lookup, result):
+        key, phash, aspect, thumb = lookup
+        # 只缓存有效结果，避免把空响应 / 非公式提示固化下来
+        if result and result.strip() and not result.startswith('ERROR'):
+            self.cache.put(key, str(result), self.recognizer_type, self.model_name, phash, aspect, thumb)
+
+    def _recognize(self, payload):
+        """子类实现：实际调用 API 识别公式（payload 为 ImagePayload）"""
+        raise NotImplementedError
+
+    async def _arecognize(self, payload):
+        """子类实现：异步调用 API 识别公式"""
+        raise NotImplementedError
+
+    def _stream(self, payload):
+        """子类实现：流式调用 API，逐段产出文本（首段产出前失败可重试）"""
+        raise NotImplementedError
+
+    async def _astream(self, payload):
+        """子类实现：_stream 的异步生成器版本"""
+        raise NotImplementedError
+        yield
+
+
+class GeminiFormulaRecognizer(FormulaRecognizerBase):
+    recognizer_type = 'gemini'
+
+    SAFETY_CATEGORIES = [
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+    ]
+
+    def __init__(self, api_key=None, model_name=None, http2=False, transport='sdk'):
+        super().__init__()
         self.api_key = api_key
-        self.model_name = model_name or 'gemini-2.0-flash'
+        self.model_name = model_name or DEFAULT_MODELS['gemini']
+        self._http2 = http2
+        self.transport = _check_transport(transport)
+        self._http_client = make_http_client(self.pool_stats, http2)
+        # 默认 10 次 / 分钟；通过 recognizer_from_config 创建时按 config.ini 覆盖
+        self.rate_limiter = RateLimiter('gemini', 10, 60)
         self.client = None
         if self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
+            self.client = self._new_client()
+        self._aclient = None
+
+    def _new_client(self):
+        if self.transport == 'raw':
+            from OCR_Transport import RawGeminiClient
+            return RawGeminiClient(self.api_key, http_client=self._http_client)
+        genai, genai_types = _genai()
+        return genai.Client(
+            api_key=self.api_key,
+            http_options=genai_types.HttpOptions(httpx_client=self._http_client),
+        )
+
+    def close(self):
+        super().close()
+        self._aclient = None
+        self._http_client.close()
 
     def test_connection(self):
         """测试 API 连接是否正常"""
         try:
             if not self.client:
-                self.client = genai.Client(api_key=self.api_key)
+                self.client = self._new_client()
             response = self.client.models.generate_content(
                 model=self.model_name,
                 contents="Hello",
@@ -58,78 +476,143 @@ class GeminiFormulaRecognizer:
         except Exception as e:
             raise RuntimeError(f"连接测试失败: {str(e)}")
 
-    @sleep_and_retry
-    @limits(calls=10, period=60)
-    def recognize_formula(self, image_path):
-        """Perform formula recognition with image preprocessing (auto-retry 2x)"""
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                if not self.client:
-                    self.client = genai.Client(api_key=self.api_key)
-
-                # Preprocess image
-                print("preparing picture...")
-                with Image.open(image_path) as img:
-                    img = img.convert('L')  # Convert to grayscale
-                    img = img.filter(ImageFilter.SHARPEN)
-
-                    buffered = BytesIO()
-                    img.save(buffered, format="PNG", optimize=True)
-                    image_bytes = buffered.getvalue()
-
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=[
-                        FORMULA_RECOGNITION_PROMPT,
-                        genai_types.Part.from_bytes(data=image_bytes, mime_type="image/png"),
-                    ],
-                    config=genai_types.GenerateContentConfig(
-                        safety_settings=[
-                            genai_types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
-                            genai_types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
-                            genai_types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
-                            genai_types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
-                        ],
-                    ),
+    def _async_client(self):
+        async_http, created = self._async_http_client()
+        if self._aclient is None or created:
+            if self.transport == 'raw':
+                from OCR_Transport import RawGeminiClient
+                self._aclient = RawGeminiClient(self.api_key, async_http_client=async_http)
+            else:
+                genai, genai_types = _genai()
+                self._aclient = genai.Client(
+                    api_key=self.api_key,
+                    http_options=genai_types.HttpOptions(httpx_async_client=async_http),
                 )
-                return self._process_response(response)
+        return self._aclient.aio
 
-            except Exception as e:
-                err_msg = str(e)
-                retryable = any(kw in err_msg for kw in [
-                    'timeout', 'Timeout', 'timed out', 'Connection',
-                    'Network', '500', '502', '503', '504', '429',
-                    'rate_limit', 'overloaded', 'RESOURCE_EXHAUSTED',
-                ])
-                if attempt < max_retries and retryable:
-                    wait = (attempt + 1) * 3
-                    print(f"(Gemini) 请求失败，{wait}s 后重试 ({attempt+1}/{max_retries}): {err_msg[:80]}")
-                    time.sleep(wait)
-                    continue
-                raise RuntimeError(f"API request failed: {err_msg}")
+    def _request_args(self, prepared):
+        if self.transport == 'raw':
+            # generateContent 的 JSON 请求体：图片直接使用已缓存的 base64，不再经过 SDK 的类型转换
+            return dict(
+                model=self.model_name,
+                contents=[
+                    FORMULA_RECOGNITION_PROMPT,
+                    {'inlineData': {'mimeType': prepared.mime_type, 'data': prepared.base64}},
+                ],
+                config={'safetySettings': [
+                    {'category': category, 'threshold': 'BLOCK_NONE'} for category in self.SAFETY_CATEGORIES
+                ]},
+            )
+        _, genai_types = _genai()
+        return dict(
+            model=self.model_name,
+            contents=[
+                FORMULA_RECOGNITION_PROMPT,
+                genai_types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type),
+            ],
+            config=genai_types.GenerateContentConfig(
+                safety_settings=[
+                    genai_types.SafetySetting(category=category, threshold="BLOCK_NONE")
+                    for category in self.SAFETY_CATEGORIES
+                ],
+            ),
+        )
+
+    def _attempt_args(self, request_args, state):
+        """Per-attempt request args: genai takes a single timeout, min(read timeout, time left)"""
+        if self.transport == 'raw':
+            # the raw transport takes the per-phase httpx timeout directly
+            return dict(request_args, timeout=state.timeout())
+        _, genai_types = _genai()
+        config = request_args['config'].model_copy(update={
+            'http_options': genai_types.HttpOptions(timeout=int(state.timeout_seconds() * 1000)),
+        })
+        return dict(request_args, config=config)
+
+    def _request_error(self, error):
+        return RuntimeError(f"API request failed: {error}")
+
+    def _recognize(self, payload):
+        """Perform formula recognition with image preprocessing (retried per retry_policy)"""
+        # 请求参数只构造一次，所有重试复用
+        request_args = self._request_args(self._prepare_image(payload))
+
+        def attempt(state):
+            if not self.client:
+                self.client = self._new_client()
+            response = self.client.models.generate_content(**self._attempt_args(request_args, state))
+            yield self._process_response(response)
+
+        return ''.join(self._retrying(attempt))
+
+    async def _arecognize(self, payload):
+        """Async variant of _recognize, same preprocessing and retry policy"""
+        prepared = await asyncio.to_thread(self._prepare_image, payload)
+        request_args = self._request_args(prepared)
+
+        async def attempt(state):
+            response = await self._async_client().models.generate_content(**self._attempt_args(request_args, state))
+            yield self._process_response(response)
+
+        return ''.join([piece async for piece in self._aretrying(attempt)])
+
+    def _stream(self, payload):
+        """Streaming variant: yield text chunks from generate_content_stream"""
+        request_args = self._request_args(self._prepare_image(payload))
+
+        def attempt(state):
+            if not self.client:
+                self.client = self._new_client()
+            for response in self.client.models.generate_content_stream(**self._attempt_args(request_args, state)):
+                if response.text:
+                    yield response.text
+
+        yield from self._retrying(attempt)
+
+    async def _astream(self, payload):
+        """Async variant of _stream"""
+        prepared = await asyncio.to_thread(self._prepare_image, payload)
+        request_args = self._request_args(prepared)
+
+        async def attempt(state):
+            stream = await self._async_client().models.generate_content_stream(**self._attempt_args(request_args, state))
+            async for response in stream:
+                if response.text:
+                    yield response.text
+
+        async for piece in self._aretrying(attempt):
+            yield piece
 
     def _process_response(self, response):
         """Process and validate API response"""
         try:
-            cleaned = response.text.strip()
-            if '```latex' in cleaned:
-                cleaned = cleaned.replace("```latex", "").replace("```", "").strip()
-
-            # Basic LaTeX validation
-            if not any(c in cleaned for c in {'\\', '{', '}'}):
-                raise ValueError("Invalid LaTeX format")
-
-            return cleaned
+            return self._finalize(response.text)
         except AttributeError:
             raise ValueError("Invalid API response format")
 
+    def _finalize(self, text):
+        """Strip code fences and validate the LaTeX text"""
+        cleaned = text.strip()
+        if '```latex' in cleaned:
+            cleaned = cleaned.replace("```latex", "").replace("```", "").strip()
 
-class OpenAICompatibleRecognizer:
+        # Basic LaTeX validation
+        if not any(c in cleaned for c in {'\\', '{', '}'}):
+            raise ValueError("Invalid LaTeX format")
+
+        return cleaned
+
+
+class OpenAICompatibleRecognizer(FormulaRecognizerBase):
     """OpenAI 兼容接口的公式识别器基类，供 DeepSeek / GPT / Qwen 等复用"""
 
-    def __init__(self, api_key, base_url=None, model_name=None, default_model='gpt-4o-mini'):
+    recognizer_type = 'openai'
+
+    def __init__(self, api_key, base_url=None, model_name=None, default_model='gpt-4o-mini', http2=False,
+                 transport='sdk'):
+        super().__init__()
         self.api_key = api_key
+        self.transport = _check_transport(transport)
         self.model_name = model_name or default_model
         # 自动去掉 base_url 末尾的 /chat/completions（用户常误带此路径）
         clean_url = base_url.rstrip('/') if base_url else None
@@ -138,12 +621,45 @@ class OpenAICompatibleRecognizer:
         # 保存清理后的 base_url，供子类（如 GLM）重建 client 时使用
         self.base_url = clean_url
 
-        self.client = OpenAI(
+        # 长连接池在识别器生命周期内复用（GLM 刷新 token 时也不重建）
+        self._http2 = http2
+        self._http_client = make_http_client(self.pool_stats, http2)
+        self.client = self._new_client()
+        # 异步客户端按需创建
+        self._aclient = None
+
+    def _new_client(self):
+        if self.transport == 'raw':
+            from OCR_Transport import RawOpenAIClient
+            return RawOpenAIClient(self.api_key, self.base_url, self._http_client)
+        # 重试由 retry_policy 统一负责，关闭 SDK 自带的重试
+        return _openai().OpenAI(
             api_key=self.api_key,
             base_url=self.base_url,
-            http_client=httpx.Client(timeout=60.0)
+            http_client=self._http_client,
+            max_retries=0
         )
 
+    def _async_client(self):
+        async_http, created = self._async_http_client()
+        if self._aclient is None or created:
+            if self.transport == 'raw':
+                from OCR_Transport import AsyncRawOpenAIClient
+                self._aclient = AsyncRawOpenAIClient(self.api_key, self.base_url, async_http)
+            else:
+                self._aclient = _openai().AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=async_http,
+                    max_retries=0
+                )
+        return self._aclient
+
+    def close(self):
+        super().close()
+        self._aclient = None
+        self._http_client.close()
+
     def test_connection(self):
         """测试 API 连接是否正常"""
         try:
@@ -165,91 +681,160 @@ class OpenAICompatibleRecognizer:
                 )
             raise RuntimeError(f"连接测试失败: {err_msg}")
 
-    def recognize_formula(self, image_path):
-        """识别图片中的公式并转换为 LaTeX（自动重试 2 次，参数不兼容时降级）"""
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                base64_image = encode_image_to_base64(image_path)
-
-                kwargs = dict(
-                    model=self.model_name,
-                    messages=[
+    def _chat_kwargs(self, prepared):
+        """构造 chat.completions 请求参数"""
+        kwargs = dict(
+            model=self.model_name,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": FORMULA_RECOGNITION_PROMPT},
                         {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": FORMULA_RECOGNITION_PROMPT},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                                }
-                            ]
+                            "type": "image_url",
+                            "image_url": {"url": prepared.data_url}
                         }
-                    ],
-                    stream=False
-                )
-                # 部分模型不支持 temperature/max_tokens，首次尝试带参数，失败后降级
-                if not getattr(self, '_skip_extra_params', False):
-                    kwargs['temperature'] = 0.2
-                    kwargs['max_tokens'] = 1024
-
-                try:
-                    response = self.client.chat.completions.create(**kwargs)
-                except Exception as param_err:
-                    err_lower = str(param_err).lower()
-                    if any(kw in err_lower for kw in ['unsupported_parameter', 'unsupported param', 'not supported']):
-                        # 参数不兼容，降级为不带 temperature/max_tokens 重试
-                        self._skip_extra_params = True
-                        kwargs.pop('temperature', None)
-                        kwargs.pop('max_tokens', None)
-                        response = self.client.chat.completions.create(**kwargs)
-                    else:
-                        raise
-
-                result = response.choices[0].message.content
-                return result
+                    ]
+                }
+            ],
+            stream=False
+        )
+        # 部分模型不支持 temperature/max_tokens，首次尝试带参数，失败后降级
+        if not getattr(self, '_skip_extra_params', False):
+            kwargs['temperature'] = 0.2
+            kwargs['max_tokens'] = 1024
+        return kwargs
+
+    def _downgrade_params(self, param_err, kwargs):
+        """参数不兼容时去掉 temperature/max_tokens 并记住，返回是否已降级"""
+        err_lower = str(param_err).lower()
+        if not any(kw in err_lower for kw in UNSUPPORTED_PARAM_KEYWORDS):
+            return False
+        self._skip_extra_params = True
+        kwargs.pop('temperature', None)
+        kwargs.pop('max_tokens', None)
+        return True
+
+    def _create(self, kwargs):
+        """chat.completions.create；参数不兼容时降级为不带 temperature/max_tokens 再试一次"""
+        try:
+            return self.client.chat.completions.create(**kwargs)
+        except Exception as param_err:
+            if not self._downgrade_params(param_err, kwargs):
+                raise
+            return self.client.chat.completions.create(**kwargs)
+
+    async def _acreate(self, kwargs):
+        """_create 的异步版本"""
+        client = self._async_client()
+        try:
+            return await client.chat.completions.create(**kwargs)
+        except Exception as param_err:
+            if not self._downgrade_params(param_err, kwargs):
+                raise
+            return await client.chat.completions.create(**kwargs)
+
+    def _recognize(self, payload):
+        """识别图片中的公式并转换为 LaTeX（按 retry_policy 重试，参数不兼容时降级）"""
+        # 图片只编码一次；降级时去掉的参数对后续重试同样生效
+        kwargs = self._chat_kwargs(self._prepare_image(payload))
+
+        def attempt(state):
+            kwargs['timeout'] = state.timeout()
+            yield self._create(kwargs).choices[0].message.content
+
+        return ''.join(self._retrying(attempt))
+
+    async def _arecognize(self, payload):
+        """_recognize 的异步版本：重试与参数降级逻辑相同，等待时不占用线程"""
+        prepared = await asyncio.to_thread(self._prepare_image, payload)
+        kwargs = self._chat_kwargs(prepared)
+
+        async def attempt(state):
+            kwargs['timeout'] = state.timeout()
+            response = await self._acreate(kwargs)
+            yield response.choices[0].message.content
+
+        return ''.join([piece async for piece in self._aretrying(attempt)])
+
+    @staticmethod
+    def _chunk_text(chunk):
+        """取出流式响应块中的增量文本（部分服务商会发送不含 choices 的用量块）"""
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            return chunk.choices[0].delta.content
+        return ''
+
+    def _stream(self, payload):
+        """流式识别：chat.completions.create(stream=True)，逐段产出文本"""
+        kwargs = self._chat_kwargs(self._prepare_image(payload))
+        kwargs['stream'] = True
+
+        def attempt(state):
+            kwargs['timeout'] = state.timeout()
+            stream = self._create(kwargs)
+            try:
+                for chunk in stream:
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield text
+            finally:
+                stream.close()
+
+        yield from self._retrying(attempt)
+
+    async def _astream(self, payload):
+        """_stream 的异步版本"""
+        prepared = await asyncio.to_thread(self._prepare_image, payload)
+        kwargs = self._chat_kwargs(prepared)
+        kwargs['stream'] = True
+
+        async def attempt(state):
+            kwargs['timeout'] = state.timeout()
+            stream = await self._acreate(kwargs)
+            try:
+                async for chunk in stream:
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield text
+            finally:
+                await stream.close()
 
-            except Exception as e:
-                err_msg = str(e)
-                # 不可重试的错误（鉴权、参数等），直接抛出
-                retryable = any(kw in err_msg for kw in [
-                    'timeout', 'Timeout', 'timed out', 'Connection',
-                    'Network', '500', '502', '503', '504', '429',
-                    'rate_limit', 'overloaded',
-                ])
-                if attempt < max_retries and retryable:
-                    wait = (attempt + 1) * 3
-                    print(f"({self.model_name}) 请求失败，{wait}s 后重试 ({attempt+1}/{max_retries}): {err_msg[:80]}")
-                    time.sleep(wait)
-                    continue
-                raise RuntimeError(f"({self.model_name}) 识别错误: {err_msg}")
+        async for piece in self._aretrying(attempt):
+            yield piece
 
 
 class OpenAIVisionRecognizer(OpenAICompatibleRecognizer):
     """OpenAI 兼容视觉模型识别器（GPT / DeepSeek / Qwen / AIHubMix 等通用）"""
 
-    def __init__(self, api_key, base_url=None, model_name=None):
+    def __init__(self, api_key, base_url=None, model_name=None, http2=False, transport='sdk'):
         super().__init__(
             api_key=api_key,
             base_url=base_url,
             model_name=model_name,
-            default_model='gpt-4o-mini'
+            default_model=DEFAULT_MODELS['openai'],
+            http2=http2,
+            transport=transport
         )
 
 
 class GLMFormulaRecognizer(OpenAICompatibleRecognizer):
     """智谱 GLM-4.6V 视觉模型公式识别器（JWT 鉴权 + OpenAI 兼容接口）"""
 
-    def __init__(self, api_key, base_url=None, model_name=None):
+    recognizer_type = 'glm'
+
+    def __init__(self, api_key, base_url=None, model_name=None, http2=False, transport='sdk'):
         self._api_key_raw = api_key
         self._token_cache = {'token': None, 'exp': 0}
+        self._token_lock = threading.Lock()
         # 先用 JWT token 初始化基类
         jwt_token = self._generate_token()
         super().__init__(
             api_key=jwt_token,
             base_url=base_url or 'https://open.bigmodel.cn/api/paas/v4',
             model_name=model_name,
-            default_model='glm-4.6v-flash'
+            default_model=DEFAULT_MODELS['glm'],
+            http2=http2,
+            transport=transport
         )
 
     def _generate_token(self):
@@ -290,19 +875,102 @@ class GLMFormulaRecognizer(OpenAICompatibleRecognizer):
             return self._api_key_raw
 
     def _ensure_token(self):
-        """确保 token 未过期，过期则重新生成并重建 client"""
-        if self._token_cache['exp'] - int(time.time()) < 60:
-            new_token = self._generate_token()
-            self.client = OpenAI(
-                api_key=new_token,
-                base_url=self.base_url,
-                http_client=httpx.Client(timeout=60.0)
-            )
+        """确保 token 未过期，过期则重新生成并重建 client（沿用原有连接池，不重新握手）"""
+        with self._token_lock:
+            if self._token_cache['exp'] - int(time.time()) < 60:
+                new_token = self._generate_token()
+                self.api_key = new_token
+                self.client = self._new_client()
+                # 异步客户端下次使用时以新 token 重建
+                self._aclient = None
 
     def test_connection(self):
         self._ensure_token()
         return super().test_connection()
 
-    def recognize_formula(self, image_path):
+    def _recognize(self, payload):
+        self._ensure_token()
+        return super()._recognize(payload)
+
+    async def _arecognize(self, payload):
+        self._ensure_token()
+        return await super()._arecognize(payload)
+
+    def _stream(self, payload):
+        self._ensure_token()
+        return super()._stream(payload)
+
+    def _astream(self, payload):
         self._ensure_token()
-        return super().recognize_formula(image_path)
+        return super()._astream(payload)
+
+
+def create_recognizer(recognizer_type, api_key, api_base=None, model_name=None, cache=None, http2=False,
+                      transport='sdk'):
+    """工厂方法：根据识别器类型创建对应的识别器实例（cache 为可选的识别结果缓存）"""
+    recognizer_type = recognizer_type.lower()
+    if recognizer_type == 'gemini':
+        recognizer = GeminiFormulaRecognizer(api_key, model_name=model_name, http2=http2, transport=transport)
+    elif recognizer_type in ('openai', 'gpt'):
+        recognizer = OpenAIVisionRecognizer(api_key, api_base, model_name=model_name, http2=http2,
+                                            transport=transport)
+    elif recognizer_type == 'ifly':
+        raise NotImplementedError("讯飞API识别尚未实现")
+    elif recognizer_type == 'glm':
+        recognizer = GLMFormulaRecognizer(api_key, api_base, model_name=model_name, http2=http2,
+                                          transport=transport)
+    else:
+        raise ValueError(f"未知的识别器类型: {recognizer_type}")
+    recognizer.cache = cache
+    return recognizer
+
+
+def load_config(path):
+    """读取 config.ini（optionxform=str 保持键名大小写，utf-8-sig 兼容带 BOM 的文件）"""
+    conf = configparser.ConfigParser()
+    conf.optionxform = str
+    conf.read(path, encoding="utf-8-sig")
+    return conf
+
+
+def cache_scope_from_config(conf, section):
+    """模型 section 对应的近似索引作用域，与 recognizer_from_config 创建的识别器一致（历史记录用）"""
+    recognizer_type = conf.get(section, 'Recognizer', fallback='openai').lower()
+    if recognizer_type == 'gpt':
+        recognizer_type = 'openai'
+    model_name = conf.get(section, 'ModelName', fallback='') or DEFAULT_MODELS.get(recognizer_type, '')
+    return cache_scope(recognizer_type, model_name)
+
+
+def preprocess_from_config(conf, section):
+    """模型 section 的上传预处理参数，与 recognizer_from_config 创建的识别器一致（截图时用于预编码）"""
+    recognizer_type = conf.get(section, 'Recognizer', fallback='openai').lower()
+    if recognizer_type == 'gpt':
+        recognizer_type = 'openai'
+    return options_from_config(conf, section, recognizer_type)
+
+
+def recognizer_from_config(conf, section, cache=None, limiter_store=None):
+    """根据 config.ini 中某个 API_ section 创建识别器
+
+    limiter_store 为令牌桶状态存储（OCR_RateLimit），传入共享存储时多个进程共用同一额度。
+    """
+    recognizer_type = conf.get(section, 'Recognizer', fallback='openai')
+    api_key = conf.get(section, 'APIKey', fallback='')
+    api_base = conf.get(section, 'APIBase', fallback='')
+    model_name = conf.get(section, 'ModelName', fallback='')
+    display_name = conf.get(section, 'DisplayName', fallback=section)
+
+    if not api_key:
+        raise ValueError(f"请先配置 {display_name} 的 API Key")
+
+    http2 = conf.getboolean(section, 'HTTP2', fallback=False)
+    transport = conf.get(section, 'Transport', fallback='sdk')
+    recognizer = create_recognizer(recognizer_type, api_key, api_base, model_name, cache=cache, http2=http2,
+                                   transport=transport)
+    recognizer.rate_limiter = rate_limiter_from_config(conf, section, store=limiter_store)
+    recognizer.preprocess = options_from_config(conf, section, recognizer.recognizer_type)
+    # 界面默认使用流式识别，逐段显示结果
+    recognizer.stream = conf.getboolean(section, 'Stream', fallback=True)
+    recognizer.retry_policy = policy_from_config(conf, section)
+    return recognizer
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""对冲请求：主模型迟迟不返回时，把同一份图片再发给备用模型，先返回有效结果者胜
+
+主模型先发出；若在对冲延迟内没有返回（或已失败），再向备用 section 发送同一个
+ImagePayload。第一个通过校验的结果胜出，其余请求立即取消。对冲延迟可以是固定秒数，
+也可以取主模型最近成功请求的 p95 延迟（样本不足时使用默认值）。
+
+各模型的胜出次数、被取消（浪费）的请求数会被统计，用于调整对冲延迟：
+
+    [Hedge]
+    Enabled = true
+    Secondary = API_GLM     备用模型 section
+    Delay = p95             对冲延迟：秒数，或 p95 表示按主模型滚动 p95 自动调整
+    DefaultDelay = 8        p95 样本不足时的延迟（秒）
+    MinDelay = 1            自动延迟的下限（秒）
+"""
+
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+
+from OCR_Gemini import RecognitionResult
+from OCR_Preprocess import ImagePayload
+from OCR_Cancel import background
+
+# 计算滚动 p95 所用的最近样本数，以及开始使用 p95 的最少样本数
+LATENCY_WINDOW = 50
+MIN_SAMPLES = 5
+
+
+def is_valid_result(text):
+    """对冲时判定结果是否可用：非空且不是模型的拒识提示"""
+    return bool(text and text.strip()) and not text.strip().startswith('ERROR')
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class HedgeStats:
+    """各 section 的滚动延迟与对冲胜负统计，线程安全"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latencies = {}
+        self._counters = {}
+
+    def _counter(self, section):
+        return self._counters.setdefault(
+            section, {'started': 0, 'wins': 0, 'wasted': 0, 'errors': 0, 'hedged': 0})
+
+    def record_latency(self, section, seconds):
+        with self._lock:
+            self._latencies.setdefault(section, deque(maxlen=self._window)).append(seconds)
+
+    def p95(self, section):
+        """最近成功请求的 p95 延迟（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = list(self._latencies.get(section, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return _percentile(samples, 95)
+
+    def count(self, section, name):
+        with self._lock:
+            self._counter(section)[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for section, counter in self._counters.items():
+                started = counter['started']
+                result[section] = dict(counter, win_rate=counter['wins'] / started if started else 0.0)
+            return result
+
+
+def format_hedge_stats(stats):
+    lines = []
+    for section, c in stats.items():
+        lines.append(
+            f"  {section}: 发出 {c['started']} 次，胜出 {c['wins']} 次（{c['win_rate']:.0%}），"
+            f"被取消 {c['wasted']} 次，失败 {c['errors']} 次，触发对冲 {c['hedged']} 次"
+        )
+    return '对冲统计：\n' + '\n'.join(lines) if lines else '对冲统计：暂无'
+
+
+# 进程级默认统计，界面与命令行共用
+hedge_stats = HedgeStats()
+
+
+class HedgedRecognizer:
+    """把主 / 备两个识别器组合成一个对冲识别器，接口与普通识别器相同（不支持流式）"""
+
+    def __init__(self, primary, secondary, primary_name, secondary_name, delay='p95',
+                 default_delay=8.0, min_delay=1.0, stats=None, clock=time.perf_counter):
+        self.primary = primary
+        self.secondary = secondary
+        self.names = (primary_name, secondary_name)
+        self.delay = delay
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.stats = stats or hedge_stats
+        self.stream = False
+        self._clock = clock
+
+    @property
+    def model_name(self):
+        return self.primary.model_name
+
+    @property
+    def rate_limiter(self):
+        return self.primary.rate_limiter
+
+    def hedge_delay(self):
+        """本次对冲延迟（秒）：固定值，或主模型滚动 p95（不低于 min_delay）"""
+        if self.delay != 'p95':
+            return float(self.delay)
+        p95 = self.stats.p95(self.names[0])
+        if p95 is None:
+            return self.default_delay
+        return max(self.min_delay, p95)
+
+    async def _attempt(self, recognizer, name, payload):
+        self.stats.count(name, 'started')
+        start = self._clock()
+        try:
+            result = await recognizer.arecognize_formula(payload)
+        except asyncio.CancelledError:
+            self.stats.count(name, 'wasted')
+            raise
+        except Exception:
+            self.stats.count(name, 'errors')
+            raise
+        if getattr(result, 'source', 'api') == 'api':
+            self.stats.record_latency(name, self._clock() - start)
+        return result
+
+    async def arecognize_formula(self, image, on_chunk=None):
+        """先发主模型，超过对冲延迟仍未返回（或已失败）再发备用模型，取第一个有效结果"""
+        payload = ImagePayload.coerce(image)
+        recognizers = ((self.primary, self.names[0]), (self.secondary, self.names[1]))
+        pending = {}
+        errors = []
+
+        def launch(index):
+            recognizer, name = recognizers[index]
+            task = asyncio.ensure_future(self._attempt(recognizer, name, payload))
+            pending[task] = index
+
+        launch(0)
+        delay = self.hedge_delay()
+        deadline = self._clock() + delay
+        hedged = False
+        try:
+            while pending:
+                timeout = None if hedged else max(0.0, deadline - self._clock())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主模型超过对冲延迟仍未返回，同时请求备用模型
+                    hedged = True
+                    self.stats.count(self.names[0], 'hedged')
+                    print(f"({self.names[0]}) 超过 {delay:.1f}s 未返回，同时请求 {self.names[1]}")
+                    launch(1)
+                    continue
+                winner = None
+                for task in done:
+                    index = pending.pop(task)
+                    name = recognizers[index][1]
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        errors.append(f"{name}: {e}")
+                        continue
+                    if winner is None and is_valid_result(result):
+                        winner = RecognitionResult(result, source=getattr(result, 'source', 'api'),
+                                                   ttft_ms=getattr(result, 'ttft_ms', None),
+                                                   total_ms=getattr(result, 'total_ms', None))
+                        winner.winner = name
+                        self.stats.count(name, 'wins')
+                    elif winner is not None:
+                        # 同时完成但未被采用
+                        self.stats.count(name, 'wasted')
+                    else:
+                        errors.append(f"{name}: 无效结果 {str(result)[:40]!r}")
+                if winner is not None:
+                    return winner
+                if not hedged:
+                    # 主模型在对冲延迟内就失败了：立即改用备用模型
+                    hedged = True
+                    launch(1)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise RuntimeError("对冲识别均失败：" + '；'.join(errors))
+
+    def recognize_formula(self, image, on_chunk=None):
+        """同步接口：在后台常驻事件循环中执行对冲识别"""
+        return background.run(self.arecognize_formula(image))
+
+    def close(self):
+        """主 / 备识别器的同步连接池归创建者（通常是 OCR_Registry）所有，这里不关闭"""
+
+    async def aclose(self):
+        """关闭主 / 备识别器在当前事件循环中的异步连接池"""
+        await self.primary.aclose()
+        await self.secondary.aclose()
+
+
+def hedge_from_config(conf, section, get_recognizer, stats=None):
+    """根据 [Hedge] 节为 section 构造对冲识别器；未启用、未配置或备用就是自身时返回 None
+
+    get_recognizer(section) 返回该 section 的识别器（通常来自 OCR_Registry）。
+    """
+    if conf is None or not conf.getboolean('Hedge', 'Enabled', fallback=False):
+        return None
+    secondary = conf.get('Hedge', 'Secondary', fallback='')
+    if not secondary or secondary == section or not conf.has_section(secondary):
+        return None
+    if not conf.get(secondary, 'APIKey', fallback=''):
+        return None
+    delay = conf.get('Hedge', 'Delay', fallback='p95').strip().lower()
+    if delay != 'p95':
+        delay = float(delay)
+    return HedgedRecognizer(
+        get_recognizer(section), get_recognizer(secondary), section, secondary,
+        delay=delay,
+        default_delay=conf.getfloat('Hedge', 'DefaultDelay', fallback=8.0),
+        min_delay=conf.getfloat('Hedge', 'MinDelay', fallback=1.0),
+        stats=stats,
+    )
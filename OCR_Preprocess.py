@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""上传前的图片预处理：裁边、限制尺寸、二值化 / 调色板压缩、补边距
+
+多显示器 4K 截图的选区往往带有大片留白，原样上传会拖慢上传、增加视觉 token
+和模型延迟。所有识别器共用这里的预处理流程，各步骤可在 config.ini 中按模型调整：
+
+    [Preprocess]        全局默认值
+    Enabled = true
+    Trim = true         裁掉四周颜色一致的边框
+    MaxSide = 0         最长边上限（像素），0 表示使用各识别器的默认值
+    Threshold = false   自适应阈值二值化，输出 1 位 PNG
+    Colors = 0          灰度调色板颜色数（如 16 输出 4 位调色板 PNG，有损），0 表示保留 8 位灰度
+    Margin = 8          裁边后四周补充的留白（像素）
+
+模型 section 中的同名键会覆盖全局值。
+"""
+
+import os
+import time
+import base64
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+# 各识别器的默认参数（最长边上限参考各家视觉模型内部缩放的上限）
+PROVIDER_DEFAULTS = {
+    'gemini': {'max_side': 3072, 'sharpen': True},
+    'openai': {'max_side': 2048},
+    'glm': {'max_side': 2048},
+}
+
+# 与背景亮度相差超过该值的像素视为内容（用于裁边）
+TRIM_TOLERANCE = 24
+# 自适应阈值的邻域半径与偏移量
+THRESHOLD_RADIUS = 12
+THRESHOLD_OFFSET = 10
+
+
+class PreprocessOptions:
+    """预处理参数（启用时统一转为灰度）；enabled 为 False 时只做 PNG 编码"""
+
+    def __init__(self, enabled=True, trim=True, max_side=2048, sharpen=False,
+                 threshold=False, colors=0, margin=8):
+        self.enabled = enabled
+        self.trim = trim
+        self.max_side = max_side
+        self.sharpen = sharpen
+        self.threshold = threshold
+        self.colors = colors
+        self.margin = margin
+
+    @classmethod
+    def for_provider(cls, recognizer_type):
+        return cls(**PROVIDER_DEFAULTS.get(recognizer_type, {}))
+
+    def __repr__(self):
+        fields = ', '.join(f"{k}={v!r}" for k, v in vars(self).items())
+        return f"PreprocessOptions({fields})"
+
+
+class PreprocessReport:
+    """一次预处理的统计：尺寸、字节数与耗时"""
+
+    def __init__(self, size_before, size_after, bytes_before, bytes_after, elapsed_ms):
+        self.size_before = size_before
+        self.size_after = size_after
+        self.bytes_before = bytes_before
+        self.bytes_after = bytes_after
+        self.elapsed_ms = elapsed_ms
+
+    def __str__(self):
+        (w0, h0), (w1, h1) = self.size_before, self.size_after
+        # 内存中的截图不为报告额外编码一次原图，bytes_before 为 None
+        before = '内存图片' if self.bytes_before is None else f"{self.bytes_before / 1024:.1f}KB"
+        return (f"{w0}x{h0} → {w1}x{h1}，{before} → "
+                f"{self.bytes_after / 1024:.1f}KB，耗时 {self.elapsed_ms:.0f}ms")
+
+
+def _background(gray):
+    """取四个角中出现最多的亮度作为背景色"""
+    w, h = gray.size
+    corners = [gray.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    return max(set(corners), key=corners.count)
+
+
+def trim_borders(gray, background, tolerance=TRIM_TOLERANCE):
+    """裁掉四周与背景色一致的边框；整张图都是背景时原样返回"""
+    diff = ImageChops.difference(gray, Image.new('L', gray.size, background))
+    box = diff.point(lambda p: 255 if p > tolerance else 0).getbbox()
+    return gray.crop(box) if box else gray
+
+
+def cap_size(img, max_side):
+    """等比缩小，使最长边不超过 max_side"""
+    if max_side and max(img.size) > max_side:
+        scale = max_side / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def adaptive_threshold(gray, background=255):
+    """局部均值自适应阈值：比邻域平均暗 THRESHOLD_OFFSET 以上的像素为墨迹，输出 1 位图
+
+    先在四周补一圈背景色再求局部均值，避免裁边后贴边的细线被当作背景。
+    """
+    r = THRESHOLD_RADIUS
+    padded = ImageOps.expand(gray, border=r, fill=background)
+    local_mean = padded.filter(ImageFilter.BoxBlur(r))
+    ink = ImageChops.subtract(local_mean, padded)
+    binary = ink.point(lambda p: 0 if p > THRESHOLD_OFFSET else 255).convert('1')
+    return binary.crop((r, r, r + gray.width, r + gray.height))
+
+
+def _source_image(source):
+    """source 可以是文件路径、PNG/JPEG 字节或 PIL 图片，返回 (图片, 原始字节数)"""
+    if isinstance(source, Image.Image):
+        return source, None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(BytesIO(source)), len(source)
+    return Image.open(source), os.path.getsize(source)
+
+
+def _encode_png(img):
+    buffered = BytesIO()
+    img.save(buffered, format='PNG', optimize=True)
+    return buffered.getvalue()
+
+
+def preprocess_image(source, options=None):
+    """按 options 预处理图片并编码为 PNG，返回 (png_bytes, PreprocessReport)"""
+    start = time.perf_counter()
+    img, bytes_before = _source_image(source)
+    try:
+        data, size_after = _encode_prepared(img, options or PreprocessOptions())
+    finally:
+        if not isinstance(source, Image.Image):
+            img.close()
+    if bytes_before is None:
+        # PIL 图片没有原始文件，以未处理时的 PNG 体积作为对比基准
+        bytes_before = len(_encode_png(source))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return data, PreprocessReport(img.size, size_after, bytes_before, len(data), elapsed_ms)
+
+
+def _encode_prepared(img, options):
+    if not options.enabled:
+        result = img.convert('RGBA') if img.mode not in ('RGB', 'RGBA', 'L') else img
+    else:
+        result = _pipeline(img, options)
+    return _encode_png(result), result.size
+
+
+class PreparedImage:
+    """预处理并编码完成的上传数据，创建后不可修改；Base64 / data URL 首次使用时生成并缓存"""
+
+    __slots__ = ('data', 'mime_type', 'report', '_base64')
+
+    def __init__(self, data, report, mime_type='image/png'):
+        object.__setattr__(self, 'data', bytes(data))
+        object.__setattr__(self, 'mime_type', mime_type)
+        object.__setattr__(self, 'report', report)
+        object.__setattr__(self, '_base64', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"PreparedImage is immutable (cannot set {name!r})")
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            object.__setattr__(self, '_base64', base64.b64encode(self.data).decode('ascii'))
+        return self._base64
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+class ImagePayload:
+    """一次识别的输入图片（文件路径、图片字节或 PIL 图片）
+
+    源图只解码一次；按预处理参数缓存 PreparedImage，同一次识别的所有重试、
+    参数降级以及备用模型都复用同一份编码结果。线程安全。
+    name 为日志中显示的名称；measure_source=False 时不为预处理报告把 PIL 源图
+    额外编码一次 PNG（截图直接在内存中识别时，省去请求前的这次编码）。
+    """
+
+    def __init__(self, source, name=None, measure_source=True):
+        if isinstance(source, (bytearray, memoryview)):
+            source = bytes(source)
+        self.source = source
+        self._name = name
+        self._measure_source = measure_source
+        self._lock = threading.Lock()
+        self._image = None
+        self._bytes_before = None
+        self._prepared = {}
+
+    @classmethod
+    def coerce(cls, source):
+        return source if isinstance(source, cls) else cls(source)
+
+    @property
+    def name(self):
+        """用于日志与结果记录的名称"""
+        if self._name:
+            return self._name
+        return self.source if isinstance(self.source, str) else f"<{type(self.source).__name__}>"
+
+    def image(self):
+        """解码后的源图（只解码一次）"""
+        with self._lock:
+            return self._decoded()
+
+    def _decoded(self):
+        if self._image is None:
+            img, self._bytes_before = _source_image(self.source)
+            if img is not self.source:
+                img.load()
+            self._image = img
+        return self._image
+
+    def prepare(self, options):
+        """按 options 预处理并编码；相同参数只计算一次"""
+        key = repr(options)
+        with self._lock:
+            prepared = self._prepared.get(key)
+            if prepared is None:
+                start = time.perf_counter()
+                img = self._decoded()
+                data, size_after = _encode_prepared(img, options)
+                if self._bytes_before is None and self._measure_source:
+                    self._bytes_before = len(_encode_png(img))
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                report = PreprocessReport(img.size, size_after, self._bytes_before, len(data), elapsed_ms)
+                prepared = self._prepared[key] = PreparedImage(data, report)
+            return prepared
+
+
+def _pipeline(img, options):
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # 透明区域按白色背景处理
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, 'white')
+        img.paste(rgba, mask=rgba.getchannel('A'))
+    gray = img.convert('L')
+    background = _background(gray)
+    if options.trim:
+        gray = trim_borders(gray, background)
+    if options.threshold and background < 128:
+        # 深色背景（暗色主题截图）先反相，统一为白底黑字
+        gray = ImageOps.invert(gray)
+        background = 255 - background
+    gray = cap_size(gray, options.max_side)
+    if options.sharpen:
+        gray = gray.filter(ImageFilter.SHARPEN)
+
+    if options.threshold:
+        result = adaptive_threshold(gray, background)
+        fill = 1
+    else:
+        result = gray
+        fill = background
+    if options.margin:
+        result = ImageOps.expand(result, border=options.margin, fill=fill)
+    if not options.threshold and options.colors:
+        # 灰度调色板：16 色时 PNG 以 4 位深度保存
+        result = result.quantize(colors=options.colors, dither=0)
+    return result
+
+
+def options_from_config(conf, section, recognizer_type):
+    """读取 [Preprocess] 全局设置，并以模型 section 中的同名键覆盖"""
+    defaults = PreprocessOptions.for_provider(recognizer_type)
+
+    def lookup(key):
+        if conf.has_option(section, key):
+            return section
+        return 'Preprocess'
+
+    def get_bool(key, default):
+        return conf.getboolean(lookup(key), key, fallback=default)
+
+    def get_int(key, default):
+        return conf.getint(lookup(key), key, fallback=default)
+
+    max_side = get_int('MaxSide', 0) or defaults.max_side
+    return PreprocessOptions(
+        enabled=get_bool('Enabled', defaults.enabled),
+        trim=get_bool('Trim', defaults.trim),
+        max_side=max_side,
+        sharpen=get_bool('Sharpen', defaults.sharpen),
+        threshold=get_bool('Threshold', defaults.threshold),
+        colors=get_int('Colors', defaults.colors),
+        margin=get_int('Margin', defaults.margin),
+    )
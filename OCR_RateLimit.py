@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""按模型 section + API Key 区分的令牌桶限速
+
+- 每个 (section, API Key) 一个令牌桶，速率来自 config.ini 的 RateLimit = 次数/秒数；
+- 收到 429 时根据 Retry-After（或 Gemini 的 retryDelay）暂停发放令牌，
+  并把速率减半，之后每次成功逐步恢复（AIMD）；
+- 令牌桶状态可保存在 SQLite 文件中，多个进程（GUI、命令行批量识别）共享同一额度；
+- acquire() 供同步调用，aacquire() 供异步调用，等待期间不占用事件循环；
+  传入 timeout（一次识别剩余的总时限）时，等不到令牌就立即抛出 DeadlineExceeded。
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+
+from OCR_Retry import DeadlineExceeded, status_code
+
+RATE_LIMIT_FILE_NAME = 'ratelimit.sqlite3'
+
+# 429 后速率缩放系数的下限，以及每次成功后恢复的步长
+MIN_SCALE = 0.1
+RECOVER_STEP = 0.1
+
+# 未在 config.ini 中配置 RateLimit 时的默认速率
+DEFAULT_RATE_LIMITS = {'gemini': '10/60'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key           TEXT PRIMARY KEY,
+    tokens        REAL NOT NULL,
+    updated       REAL NOT NULL,
+    scale         REAL NOT NULL,
+    blocked_until REAL NOT NULL
+);
+"""
+
+
+# 速率限制的写法：正整数次数 / 正数秒数
+_RATE_PATTERN = re.compile(r'(\d+)\s*/\s*(\d+(?:\.\d*)?|\.\d+)')
+
+
+def parse_rate(text, setting='RateLimit'):
+    """解析速率限制 '次数/秒数'，例如 '10/60'；空字符串表示不限速
+
+    格式错误或次数、秒数不为正时抛出 ValueError，信息中带上配置项名称 setting。
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    match = _RATE_PATTERN.fullmatch(text)
+    if match is None or int(match.group(1)) <= 0 or float(match.group(2)) <= 0:
+        raise ValueError(f"{setting} = {text} 无效，应为「次数/秒数」且均为正数，例如 10/60")
+    return int(match.group(1)), float(match.group(2))
+
+
+def limiter_key(section, api_key):
+    """令牌桶键：section 名 + API Key 摘要（不把明文 Key 写入状态文件）"""
+    digest = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+    return f"{section}:{digest}"
+
+
+def is_rate_limited(error):
+    """判断异常是否为限流：HTTP 429；没有状态码时看 gRPC 状态 RESOURCE_EXHAUSTED"""
+    status = status_code(error)
+    if status is not None:
+        return status == 429
+    return 'RESOURCE_EXHAUSTED' in str(error)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_reset(value, now=None):
+    """解析 x-ratelimit-reset 类响应头，返回距现在的秒数；无法解析时返回 None
+
+    支持 OpenAI 风格的时长（"1s"、"6m0s"、"250ms"）、秒数，以及 Unix 时间戳。
+    """
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts or ''.join(n + u for n, u in parts) != value:
+            return None
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    if number > 1e9:
+        # Unix 时间戳
+        return max(0.0, number - (time.time() if now is None else now))
+    return max(0.0, number)
+
+
+def retry_after_from_error(error, now=None):
+    """从异常中提取服务端建议的等待秒数，没有时返回 None
+
+    依次查看响应头 retry-after-ms / retry-after（秒数或 HTTP 日期）、
+    限流时的 x-ratelimit-reset*，以及 Gemini 错误详情中的 retryDelay（如 "17s"）。
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                moment = parsedate_to_datetime(value).timestamp()
+                return max(0.0, moment - (time.time() if now is None else now))
+            except (TypeError, ValueError):
+                pass
+    if is_rate_limited(error):
+        # 同时给出请求数与 token 数的重置时间时，取较晚的一个
+        resets = [parse_reset(headers[name], now) for name in
+                  ('x-ratelimit-reset', 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+                  if headers.get(name)]
+        resets = [r for r in resets if r is not None]
+        if resets:
+            return max(resets)
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶状态"""
+
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def update(self, key, fn, initial):
+        """原子地读取 → fn(state) 计算新状态 → 写回，返回 fn 的第二个返回值"""
+        with self._lock:
+            state, result = fn(self._states.get(key, initial))
+            self._states[key] = state
+            return result
+
+
+class SQLiteBucketStore:
+    """保存在 SQLite 文件中的令牌桶状态，多个进程共享（BEGIN IMMEDIATE 保证原子更新）"""
+
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def update(self, key, fn, initial):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT tokens, updated, scale, blocked_until FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            state, result = fn(tuple(row) if row else initial)
+            conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated, scale, blocked_until) '
+                'VALUES (?, ?, ?, ?, ?)', (key, *state)
+            )
+            conn.execute('COMMIT')
+            return result
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+
+class RateLimiter:
+    """自适应令牌桶：calls / period 为配置速率，burst 为桶容量（默认等于 calls）
+
+    calls 为 None 时不限速，但仍会遵守 429 返回的 Retry-After。
+    令牌可被预支为负数，调用方按返回的等待时间休眠后直接发起请求，无需轮询。
+    """
+
+    def __init__(self, key='default', calls=None, period=60.0, burst=None, store=None,
+                 clock=time.time, sleep=time.sleep, asleep=asyncio.sleep):
+        self.key = key
+        self.rate = calls / period if calls else None
+        self.burst = float(burst or calls or 1)
+        self.store = store or MemoryBucketStore()
+        self._clock = clock
+        self._sleep = sleep
+        self._asleep = asleep
+
+    def _initial(self):
+        # (tokens, updated, scale, blocked_until)
+        return self.burst, self._clock(), 1.0, 0.0
+
+    def reserve(self, max_wait=None):
+        """预订一个令牌，返回需要等待的秒数（0 表示可立即发起请求）
+
+        需要等待超过 max_wait 秒时不预订（令牌留给其他请求），返回 None。
+        """
+        now = self._clock()
+
+        def take(state):
+            tokens, updated, scale, blocked_until = state
+            wait = max(0.0, blocked_until - now)
+            if self.rate:
+                rate = self.rate * scale
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * rate) - 1
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+            if max_wait is not None and wait > max_wait:
+                return state, None
+            return (tokens, now, scale, blocked_until), wait
+
+        return self.store.update(self.key, take, self._initial())
+
+    @staticmethod
+    def _check_wait(wait, timeout):
+        if wait is None:
+            raise DeadlineExceeded(f"等待限速令牌会超过剩余时限 {timeout:.1f}s")
+        return wait
+
+    def acquire(self, timeout=None):
+        """同步等待一个令牌，返回实际等待秒数；timeout 秒内等不到令牌时抛出 DeadlineExceeded"""
+        wait = self._check_wait(self.reserve(timeout), timeout)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    async def aacquire(self, timeout=None):
+        """异步等待一个令牌；SQLite 状态的读写放到线程中，休眠期间不占用线程"""
+        if self.store.blocking:
+            wait = await asyncio.to_thread(self.reserve, timeout)
+        else:
+            wait = self.reserve(timeout)
+        wait = self._check_wait(wait, timeout)
+        if wait > 0:
+            await self._asleep(wait)
+        return wait
+
+    def penalize(self, retry_after=None):
+        """收到 429：速率减半，清空令牌；有 Retry-After 时在该时间之前不再发放令牌"""
+        now = self._clock()
+
+        def backoff(state):
+            tokens, updated, scale, blocked_until = state
+            scale = max(MIN_SCALE, scale / 2)
+            if retry_after is not None:
+                blocked_until = max(blocked_until, now + retry_after)
+            return (min(tokens, 0.0), now, scale, blocked_until), scale
+
+        return self.store.update(self.key, backoff, self._initial())
+
+    def record_success(self):
+        """请求成功后逐步恢复速率"""
+        def recover(state):
+            tokens, updated, scale, blocked_until = state
+            return (tokens, updated, min(1.0, scale + RECOVER_STEP), blocked_until), None
+
+        self.store.update(self.key, recover, self._initial())
+
+    async def arecord_success(self):
+        if self.store.blocking:
+            await asyncio.to_thread(self.record_success)
+        else:
+            self.record_success()
+
+    def snapshot(self):
+        """当前速率缩放系数与剩余暂停时间（用于日志 / 调试）"""
+        now = self._clock()
+        state = self.store.update(self.key, lambda s: (s, s), self._initial())
+        return {'scale': state[2], 'blocked_for': max(0.0, state[3] - now)}
+
+
+def store_from_config(conf, base_dir):
+    """根据 config.ini 的 [RateLimit] 节创建令牌桶状态存储（默认多进程共享）"""
+    if not conf.getboolean('RateLimit', 'Shared', fallback=True):
+        return MemoryBucketStore()
+    path = conf.get('RateLimit', 'Path', fallback='') or os.path.join(base_dir, RATE_LIMIT_FILE_NAME)
+    try:
+        return SQLiteBucketStore(path)
+    except sqlite3.Error as e:
+        print(f"限速状态文件不可用，改为进程内限速: {e}")
+        return MemoryBucketStore()
+
+
+def rate_limiter_from_config(conf, section, store=None, rate=None):
+    """根据模型 section 的 RateLimit / RateBurst 创建限速器；rate 可覆盖配置（如命令行 --rate）"""
+    recognizer_type = conf.get(section, 'Recognizer', fallback='openai').lower()
+    if rate is not None:
+        text, setting = rate, '--rate'
+    else:
+        text = conf.get(section, 'RateLimit', fallback=DEFAULT_RATE_LIMITS.get(recognizer_type, ''))
+        setting = f'[{section}] RateLimit'
+    calls, period = parse_rate(text, setting) or (None, 60.0)
+    burst = conf.getint(section, 'RateBurst', fallback=0) or None
+    return RateLimiter(
+        limiter_key(section, conf.get(section, 'APIKey', fallback='')),
+        calls, period, burst, store=store,
+    )
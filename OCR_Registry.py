@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""长生命周期的识别器注册表
+
+每个模型 section 只保留一个识别器实例，其 HTTP 连接池（keep-alive 长连接）
+在多次识别之间复用；配置改变时关闭旧实例，程序退出时统一关闭。
+"""
+
+import atexit
+import threading
+
+from OCR_Gemini import recognizer_from_config
+
+# 这些配置项改变后需要重建识别器（及其连接池）
+SIGNATURE_KEYS = ('Recognizer', 'APIKey', 'APIBase', 'ModelName', 'HTTP2', 'Transport',
+                  'RateLimit', 'RateBurst', 'Trim', 'MaxSide', 'Sharpen', 'Threshold', 'Colors', 'Margin',
+                  'Retries', 'BackoffBase', 'BackoffMax', 'Deadline',
+                  'ConnectTimeout', 'ReadTimeout', 'WriteTimeout')
+
+# 这些全局节的设置同样影响识别器
+GLOBAL_SECTIONS = ('Preprocess', 'Retry')
+
+
+def _signature(conf, section):
+    keys = tuple(conf.get(section, key, fallback='') for key in SIGNATURE_KEYS)
+    shared = tuple(tuple(conf.items(name)) if conf.has_section(name) else () for name in GLOBAL_SECTIONS)
+    return keys + shared
+
+
+class RecognizerRegistry:
+    """按 section 缓存识别器实例，线程安全"""
+
+    def __init__(self, factory=recognizer_from_config):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._entries = {}  # section -> (signature, recognizer)
+        self._created = 0
+        self._reused = 0
+
+    def get(self, conf, section, cache=None, limiter_store=None):
+        """取得 section 对应的识别器；配置改变时关闭旧实例并重建"""
+        signature = _signature(conf, section)
+        with self._lock:
+            entry = self._entries.get(section)
+            if entry and entry[0] == signature:
+                self._reused += 1
+                recognizer = entry[1]
+                recognizer.cache = cache
+                return recognizer
+            recognizer = self._factory(conf, section, cache=cache, limiter_store=limiter_store)
+            self._entries[section] = (signature, recognizer)
+            self._created += 1
+        if entry:
+            entry[1].close()
+        return recognizer
+
+    def invalidate(self, conf):
+        """设置保存后调用：关闭配置已改变或已删除的 section 的识别器"""
+        with self._lock:
+            stale = [
+                section for section, (signature, _) in self._entries.items()
+                if not conf.has_section(section) or _signature(conf, section) != signature
+            ]
+            closed = [self._entries.pop(section)[1] for section in stale]
+        for recognizer in closed:
+            recognizer.close()
+        return stale
+
+    def close_all(self):
+        with self._lock:
+            closed = [recognizer for _, recognizer in self._entries.values()]
+            self._entries.clear()
+        for recognizer in closed:
+            recognizer.close()
+
+    def stats(self):
+        """识别器复用次数与各 section 连接池的复用统计"""
+        with self._lock:
+            pools = {section: recognizer.pool_stats.snapshot()
+                     for section, (_, recognizer) in self._entries.items()}
+            return {'created': self._created, 'reused': self._reused, 'pools': pools}
+
+
+def format_pool_stats(stats):
+    lines = [f"识别器：新建 {stats['created']} 次，复用 {stats['reused']} 次"]
+    for section, pool in stats['pools'].items():
+        lines.append(
+            f"  {section}: 请求 {pool['requests']} 次，新建连接 {pool['connections']} 次，"
+            f"TLS 握手 {pool['tls_handshakes']} 次，连接复用率 {pool['reuse_rate']:.0%}"
+        )
+    return '\n'.join(lines)
+
+
+# 进程级默认注册表，退出时关闭所有连接池
+registry = RecognizerRegistry()
+atexit.register(registry.close_all)
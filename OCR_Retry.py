@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""结构化重试策略：按异常类型与 HTTP 状态码判定、指数退避（full jitter）、总截止时间
+
+- 是否重试只看异常类型（超时、连接错误）与状态码（408 / 425 / 429 / 5xx），
+  不再对错误信息做子串匹配；
+- 等待时间优先使用服务端的 Retry-After / x-ratelimit-reset，否则按
+  random(0, min(BackoffMax, BackoffBase × 2^attempt)) 退避；
+- 一次识别的所有尝试共享总截止时间 Deadline，每次尝试的超时取
+  min(各阶段超时, 剩余时间)，连接 / 读取 / 写入超时分别设置。
+
+config.ini 的 [Retry] 节为全局默认值，模型 section 中的同名键可覆盖：
+
+    [Retry]
+    Retries = 2             最多重试次数
+    BackoffBase = 1         退避基数（秒）
+    BackoffMax = 20         单次退避上限（秒）
+    Deadline = 90           一次识别（含全部重试）的总时限（秒）
+    ConnectTimeout = 10
+    ReadTimeout = 60
+    WriteTimeout = 30
+"""
+
+import sys
+import time
+import random
+import asyncio
+
+import httpx
+
+# 可重试的 HTTP 状态码：请求超时、过早、限流与服务端错误
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# 视为网络层临时故障的异常类型
+TRANSIENT_ERRORS = (
+    httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError,
+    ConnectionError, TimeoutError,
+)
+
+
+def _transient_errors():
+    """openai SDK 按需导入：只有已加载时才可能抛出 openai.APIConnectionError"""
+    openai = sys.modules.get('openai')
+    if openai is None:
+        return TRANSIENT_ERRORS
+    return TRANSIENT_ERRORS + (openai.APIConnectionError,)
+
+
+class DeadlineExceeded(TimeoutError):
+    """一次识别的总时限已用完"""
+
+
+def status_code(error):
+    """取出异常对应的 HTTP 状态码（openai.APIStatusError / genai APIError / httpx），没有时返回 None"""
+    for value in (getattr(error, 'status_code', None), getattr(error, 'code', None),
+                  getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def is_retryable(error):
+    """按异常类型与状态码判断是否值得重试"""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, _transient_errors())
+
+
+class RetryPolicy:
+    """一个模型 section 的重试参数；start() 为每次识别创建独立的 RetryState
+
+    clock / rand / sleep / asleep 可替换，便于用假时钟测试。
+    """
+
+    def __init__(self, retries=2, backoff_base=1.0, backoff_max=20.0, deadline=90.0,
+                 connect_timeout=10.0, read_timeout=60.0, write_timeout=30.0,
+                 clock=time.monotonic, rand=random.random, sleep=time.sleep, asleep=asyncio.sleep):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.clock = clock
+        self.rand = rand
+        self.sleep = sleep
+        self.asleep = asleep
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的退避时间（full jitter）"""
+        return self.rand() * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+
+    def http_timeout(self):
+        """httpx 客户端的默认超时（未经 RetryState 限制时使用）"""
+        return httpx.Timeout(connect=self.connect_timeout, read=self.read_timeout,
+                             write=self.write_timeout, pool=self.connect_timeout)
+
+    def start(self):
+        return RetryState(self)
+
+
+class RetryState:
+    """一次识别的重试进度与剩余时间"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempt = 0
+        self.deadline_at = policy.clock() + policy.deadline if policy.deadline else None
+
+    def remaining(self):
+        if self.deadline_at is None:
+            return float('inf')
+        return self.deadline_at - self.policy.clock()
+
+    def _check(self):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"超过总时限 {self.policy.deadline:g}s")
+        return remaining
+
+    def timeout(self):
+        """本次尝试的 httpx 超时：各阶段超时均不超过剩余时间；时限已到时抛出 DeadlineExceeded"""
+        remaining = self._check()
+        p = self.policy
+        return httpx.Timeout(connect=min(p.connect_timeout, remaining), read=min(p.read_timeout, remaining),
+                             write=min(p.write_timeout, remaining), pool=min(p.connect_timeout, remaining))
+
+    def timeout_seconds(self):
+        """只支持单一超时值的 SDK（genai）使用：min(读取超时, 剩余时间)"""
+        return min(self.policy.read_timeout, self._check())
+
+    def next_delay(self, error, retry_after=None):
+        """失败后的等待秒数；不可重试、次数用完或等待会超出总时限时返回 None"""
+        if not is_retryable(error) or self.attempt >= self.policy.retries:
+            return None
+        wait = retry_after if retry_after is not None else self.policy.backoff(self.attempt)
+        if wait >= self.remaining():
+            return None
+        self.attempt += 1
+        return wait
+
+
+def policy_from_config(conf, section):
+    """读取 [Retry] 全局设置，并以模型 section 中的同名键覆盖"""
+    def get(key, default):
+        source = section if conf.has_option(section, key) else 'Retry'
+        return conf.getfloat(source, key, fallback=default)
+
+    defaults = RetryPolicy()
+    return RetryPolicy(
+        retries=int(get('Retries', defaults.retries)),
+        backoff_base=get('BackoffBase', defaults.backoff_base),
+        backoff_max=get('BackoffMax', defaults.backoff_max),
+        deadline=get('Deadline', defaults.deadline),
+        connect_timeout=get('ConnectTimeout', defaults.connect_timeout),
+        read_timeout=get('ReadTimeout', defaults.read_timeout),
+        write_timeout=get('WriteTimeout', defaults.write_timeout),
+    )
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""轻量 HTTP 传输：直接用连接池化的 httpx 客户端调用 chat/completions 与 generateContent
+
+识别只是「一段 prompt + 一张图片 → 文本」，不必经过 openai / google-genai SDK
+（导入各约 0.6s，每次调用还要构造、校验 pydantic 模型）。模型 section 中设置
+Transport = raw 即可切换，识别器类以及重试、限速、流式、缓存逻辑都不变：
+
+- RawOpenAIClient / AsyncRawOpenAIClient 提供与 SDK 相同的 client.chat.completions.create()；
+- RawGeminiClient 提供 client.models.generate_content() / generate_content_stream()，
+  client.aio.models 为异步版本。
+
+HTTP 错误抛出 APIStatusError（带 status_code 与 response，错误信息含响应体），
+重试与限流判定沿用 OCR_Retry / OCR_RateLimit；网络错误直接抛出 httpx 异常。
+"""
+
+import json
+from types import SimpleNamespace
+
+import httpx
+
+OPENAI_BASE_URL = 'https://api.openai.com/v1'
+GEMINI_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta'
+
+
+class APIStatusError(Exception):
+    """服务端返回 4xx / 5xx"""
+
+    def __init__(self, response, body=''):
+        self.response = response
+        self.status_code = response.status_code
+        self.body = body
+        super().__init__(f"Error code: {response.status_code} - {body[:1000]}")
+
+
+def _timeout_kwargs(timeout):
+    # 未指定时使用客户端默认超时（显式传 None 会关闭超时）
+    return {} if timeout is None else {'timeout': timeout}
+
+
+def _send(http, url, headers, body, timeout, stream=False):
+    request = http.build_request('POST', url, headers=headers, json=body, **_timeout_kwargs(timeout))
+    response = http.send(request, stream=stream)
+    if response.status_code >= 400:
+        if stream:
+            response.read()
+            response.close()
+        raise APIStatusError(response, response.text)
+    return response
+
+
+async def _asend(http, url, headers, body, timeout, stream=False):
+    request = http.build_request('POST', url, headers=headers, json=body, **_timeout_kwargs(timeout))
+    response = await http.send(request, stream=stream)
+    if response.status_code >= 400:
+        if stream:
+            await response.aread()
+            await response.aclose()
+        raise APIStatusError(response, response.text)
+    return response
+
+
+def _sse_data(line):
+    """SSE 的一行：返回解析后的 data 事件；非 data 行返回 None，结束标记 [DONE] 返回 False"""
+    if not line.startswith('data:'):
+        return None
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return False
+    event = json.loads(data) if data else None
+    if isinstance(event, dict) and 'error' in event:
+        raise RuntimeError(f"流式响应错误: {event['error']}")
+    return event
+
+
+# ====== chat/completions ======
+
+def _completion(data):
+    """只保留识别用到的字段：response.choices[i].message.content"""
+    return SimpleNamespace(choices=[
+        SimpleNamespace(message=SimpleNamespace(content=(choice.get('message') or {}).get('content')))
+        for choice in data.get('choices') or []
+    ])
+
+
+def _completion_chunk(data):
+    """流式块：chunk.choices[i].delta.content"""
+    return SimpleNamespace(choices=[
+        SimpleNamespace(delta=SimpleNamespace(content=(choice.get('delta') or {}).get('content')))
+        for choice in data.get('choices') or []
+    ])
+
+
+class _ChatStream:
+    """流式响应：逐个产出块，close() 释放连接"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def __iter__(self):
+        for line in self._response.iter_lines():
+            event = _sse_data(line)
+            if event is False:
+                return
+            if event is not None:
+                yield _completion_chunk(event)
+
+    def close(self):
+        self._response.close()
+
+
+class _AsyncChatStream:
+    def __init__(self, response):
+        self._response = response
+
+    async def __aiter__(self):
+        async for line in self._response.aiter_lines():
+            event = _sse_data(line)
+            if event is False:
+                return
+            if event is not None:
+                yield _completion_chunk(event)
+
+    async def close(self):
+        await self._response.aclose()
+
+
+class RawOpenAIClient:
+    """chat/completions 同步客户端，client.chat.completions.create() 与 openai.OpenAI 用法相同"""
+
+    def __init__(self, api_key, base_url=None, http_client=None):
+        self.api_key = api_key
+        self.base_url = (base_url or OPENAI_BASE_URL).rstrip('/')
+        self._http = http_client or httpx.Client()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _headers(self):
+        return {'Authorization': f"Bearer {self.api_key}"}
+
+    @staticmethod
+    def _body(model, messages, stream, params):
+        body = dict(params, model=model, messages=messages)
+        if stream:
+            body['stream'] = True
+        return body
+
+    def _create(self, *, model, messages, stream=False, timeout=None, **params):
+        response = _send(self._http, f"{self.base_url}/chat/completions", self._headers(),
+                         self._body(model, messages, stream, params), timeout, stream)
+        if stream:
+            return _ChatStream(response)
+        return _completion(response.json())
+
+
+class AsyncRawOpenAIClient(RawOpenAIClient):
+    """RawOpenAIClient 的异步版本，http_client 为 httpx.AsyncClient"""
+
+    def __init__(self, api_key, base_url=None, http_client=None):
+        super().__init__(api_key, base_url, http_client or httpx.AsyncClient())
+
+    async def _create(self, *, model, messages, stream=False, timeout=None, **params):
+        response = await _asend(self._http, f"{self.base_url}/chat/completions", self._headers(),
+                                self._body(model, messages, stream, params), timeout, stream)
+        if stream:
+            return _AsyncChatStream(response)
+        return _completion(response.json())
+
+
+# ====== generateContent ======
+
+def _gemini_body(contents, config):
+    """contents 为字符串或 [字符串 / part 字典]，config 为 safetySettings 等顶层字段"""
+    items = [contents] if isinstance(contents, (str, dict)) else contents
+    parts = [{'text': item} if isinstance(item, str) else item for item in items]
+    body = {'contents': [{'role': 'user', 'parts': parts}]}
+    if config:
+        body.update(config)
+    return body
+
+
+def _gemini_response(data):
+    """与 SDK 相同：response.text 为第一个候选中所有文本 part 的拼接（不含思考过程），没有时为 None"""
+    candidates = data.get('candidates') or [{}]
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    texts = [part['text'] for part in parts if 'text' in part and not part.get('thought')]
+    return SimpleNamespace(text=''.join(texts) if texts else None)
+
+
+class RawGeminiClient:
+    """generateContent 客户端：client.models 为同步接口（http_client），client.aio.models 为异步接口（async_http_client）"""
+
+    def __init__(self, api_key, http_client=None, async_http_client=None, base_url=None):
+        self.api_key = api_key
+        self.base_url = (base_url or GEMINI_BASE_URL).rstrip('/')
+        self._http = http_client
+        self._async_http = async_http_client
+        self.models = SimpleNamespace(generate_content=self._generate,
+                                      generate_content_stream=self._generate_stream)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self._agenerate,
+                                                          generate_content_stream=self._agenerate_stream))
+
+    def _headers(self):
+        return {'x-goog-api-key': self.api_key}
+
+    def _url(self, model, method):
+        return f"{self.base_url}/models/{model}:{method}"
+
+    def _generate(self, *, model, contents, config=None, timeout=None):
+        response = _send(self._http, self._url(model, 'generateContent'), self._headers(),
+                         _gemini_body(contents, config), timeout)
+        return _gemini_response(response.json())
+
+    def _generate_stream(self, *, model, contents, config=None, timeout=None):
+        response = _send(self._http, self._url(model, 'streamGenerateContent?alt=sse'), self._headers(),
+                         _gemini_body(contents, config), timeout, stream=True)
+        try:
+            for line in response.iter_lines():
+                event = _sse_data(line)
+                if event:
+                    yield _gemini_response(event)
+        finally:
+            response.close()
+
+    async def _agenerate(self, *, model, contents, config=None, timeout=None):
+        response = await _asend(self._async_http, self._url(model, 'generateContent'), self._headers(),
+                                _gemini_body(contents, config), timeout)
+        return _gemini_response(response.json())
+
+    async def _agenerate_stream(self, *, model, contents, config=None, timeout=None):
+        """与 SDK 相同：await 之后得到异步迭代器"""
+        response = await _asend(self._async_http, self._url(model, 'streamGenerateContent?alt=sse'),
+                                self._headers(), _gemini_body(contents, config), timeout, stream=True)
+        return self._aiter_events(response)
+
+    @staticmethod
+    async def _aiter_events(response):
+        try:
+            async for line in response.aiter_lines():
+                event = _sse_data(line)
+                if event:
+                    yield _gemini_response(event)
+        finally:
+            await response.aclose()
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""常驻公式预览页：MathJax 只加载一次，之后通过 runJavaScript 更新公式
+
+原先每次预览都 setHtml 一个新页面，tex-svg.js（约 2MB）要重新解析、初始化，
+一次渲染需要几百毫秒。PreviewEngine 在预览视图中加载一个固定页面，MathJax 就绪后
+每个公式只替换节点内容并调用 MathJax.typesetPromise；字号通过 CSS 变量调整，不重新排版。
+
+页面通过 console.log 把就绪、渲染完成与渲染失败回报给 Python（带前缀的 JSON），
+PreviewEngine 据此发出 ready / rendered / failed 信号，并统计端到端渲染耗时。
+渲染进行中又来了新公式时页面只保留最新的一个，被跳过的计入 skipped。
+
+公式先在隐藏的暂存节点中排版，没有 TeX 错误才替换显示的内容；render(keep_on_error=True)
+（编辑框实时预览）遇到语法错误时保留上一次正确的公式，只回报错误。
+
+设置 cache（Render_Cache.SvgCache）后，排版结果的 SVG 随渲染完成消息带回并写入缓存；
+命中缓存的公式直接替换为 SVG，不经过 TeX 解析。prewarm() 让页面在空闲时预先排版。
+界面线程只查内存缓存，磁盘缓存的读写通过 submit（如 worker_pool.submit）放到后台线程。
+"""
+
+import os
+import json
+import time
+import functools
+
+from PyQt5.QtCore import QObject, QUrl, pyqtSignal
+
+MESSAGE_PREFIX = 'latex2ocr:'
+CDN_MATHJAX = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js'
+DEFAULT_FONT_SIZE = 28
+
+
+def normalize_latex(latex):
+    """预览与 SVG 缓存使用的 LaTeX：去掉首尾空白与 $ 定界符"""
+    return latex.strip().strip('$') if latex else ''
+
+
+def mathjax_source(base_dir):
+    """优先使用本地 mathjax/tex-svg.js，离线也能渲染；没有时使用 CDN"""
+    local_mathjax = os.path.join(base_dir, 'mathjax', 'tex-svg.js')
+    if os.path.isfile(local_mathjax):
+        return QUrl.fromLocalFile(local_mathjax).toString()
+    return CDN_MATHJAX
+
+
+def build_preview_page(mathjax_src, font_size=DEFAULT_FONT_SIZE):
+    """常驻预览页：公式节点 + 占位文字，window.latex2ocr 提供 render / setFontSize"""
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+  :root {{ --formula-size: {font_size}px; }}
+  body {{
+    margin: 0; padding: 20px;
+    background: #ffffff;
+    display: flex; align-items: center; justify-content: center;
+    min-height: 100vh; box-sizing: border-box;
+    font-family: "Times New Roman", serif;
+  }}
+  #formula {{
+    font-size: var(--formula-size);
+    color: #1a1a2e;
+    text-align: center;
+    padding: 10px;
+  }}
+  #staging {{
+    position: absolute; left: 0; top: 0;
+    visibility: hidden;
+  }}
+  #placeholder {{
+    color: #a0a0b8;
+    font-size: 18px;
+    font-family: sans-serif;
+  }}
+</style>
+<script>
+(function () {{
+  function report(message) {{
+    console.log('{MESSAGE_PREFIX}' + JSON.stringify(message));
+  }}
+  var busy = false, queued = null, warm = [];
+
+  function show(job) {{
+    var node = document.getElementById('formula');
+    MathJax.typesetClear([node]);
+    node.innerHTML = job.svg;
+    document.getElementById('placeholder').style.display = 'none';
+    report({{event: 'rendered', id: job.id, ms: 0, cached: true}});
+  }}
+
+  function prerender(job) {{
+    // 空闲时预先排版：结果只带回给缓存，不显示
+    var staging = document.getElementById('staging');
+    MathJax.typesetClear([staging]);
+    staging.textContent = '$' + job.latex + '$';
+    return MathJax.typesetPromise([staging]).then(function () {{
+      if (!staging.querySelector('[data-mjx-error]')) {{
+        report({{event: 'warmed', id: job.id, svg: staging.innerHTML}});
+      }}
+      MathJax.typesetClear([staging]);
+      staging.textContent = '';
+    }}, function () {{}});
+  }}
+
+  function next() {{
+    if (!queued && !warm.length) {{ busy = false; return; }}
+    busy = true;
+    if (!queued) {{
+      prerender(warm.shift()).then(next);
+      return;
+    }}
+    var job = queued;
+    queued = null;
+    if (job.svg !== undefined) {{
+      show(job);
+      next();
+      return;
+    }}
+    var start = performance.now();
+    var staging = document.getElementById('staging');
+    MathJax.typesetClear([staging]);
+    staging.textContent = job.latex ? '$' + job.latex + '$' : '';
+    MathJax.typesetPromise([staging]).then(function () {{
+      var error = staging.querySelector('[data-mjx-error]');
+      if (error && job.keep) {{
+        report({{event: 'error', id: job.id, message: error.getAttribute('data-mjx-error')}});
+        return;
+      }}
+      var node = document.getElementById('formula');
+      MathJax.typesetClear([node]);
+      node.replaceChildren.apply(node, Array.prototype.slice.call(staging.childNodes));
+      document.getElementById('placeholder').style.display = job.latex ? 'none' : '';
+      if (error) {{
+        report({{event: 'error', id: job.id, message: error.getAttribute('data-mjx-error')}});
+      }} else {{
+        report({{event: 'rendered', id: job.id, ms: performance.now() - start,
+                 svg: job.latex ? node.innerHTML : ''}});
+      }}
+    }}, function (err) {{
+      report({{event: 'error', id: job.id, message: String(err && err.message || err)}});
+    }}).then(next);
+  }}
+
+  window.latex2ocr = {{
+    render: function (id, latex, keep) {{
+      queued = {{id: id, latex: latex, keep: keep}};
+      if (!busy) next();
+    }},
+    show: function (id, svg) {{
+      queued = {{id: id, svg: svg}};
+      if (!busy) next();
+    }},
+    warm: function (id, latex) {{
+      warm.push({{id: id, latex: latex}});
+      if (!busy) next();
+    }},
+    setFontSize: function (px) {{
+      document.documentElement.style.setProperty('--formula-size', px + 'px');
+    }}
+  }};
+
+  window.MathJax = {{
+    tex: {{
+      inlineMath: [['$', '$']],
+      displayMath: [['$$', '$$']],
+      processEscapes: true
+    }},
+    // 每个 SVG 自带字形定义，缓存后可单独显示
+    svg: {{ fontCache: 'local' }},
+    startup: {{
+      typeset: false,
+      ready: function () {{
+        MathJax.startup.defaultReady();
+        MathJax.startup.promise.then(function () {{
+          // 先排版一个公式，装好输出样式并预热 TeX 解析器，之后直接显示缓存的 SVG 也能正确排列
+          var staging = document.getElementById('staging');
+          staging.textContent = '$x$';
+          return MathJax.typesetPromise([staging]).then(function () {{
+            MathJax.typesetClear([staging]);
+            staging.textContent = '';
+          }});
+        }}).then(function () {{ report({{event: 'ready'}}); }});
+      }}
+    }}
+  }};
+}})();
+</script>
+<script src="{mathjax_src}" async></script>
+</head>
+<body>
+<div id="placeholder">识别结果将在此渲染</div>
+<div id="formula"></div>
+<div id="staging"></div>
+</body>
+</html>"""
+
+
+@functools.lru_cache(maxsize=None)
+def _console_page_class():
+    """把带前缀的控制台消息转给 PreviewEngine 的 QWebEnginePage 子类（按需导入 QtWebEngine）"""
+    from PyQt5.QtWebEngineWidgets import QWebEnginePage
+
+    class ConsolePage(QWebEnginePage):
+        def __init__(self, on_message, parent=None):
+            super().__init__(parent)
+            self._on_message = on_message
+
+        def javaScriptConsoleMessage(self, level, message, line, source):
+            if not self._on_message(message):
+                super().javaScriptConsoleMessage(level, message, line, source)
+
+    return ConsolePage
+
+
+class PreviewEngine(QObject):
+    """管理常驻预览页；attach() 之前及 MathJax 就绪之前的渲染请求只保留最新的一个
+
+    clock 可替换，便于测试耗时统计。
+    """
+
+    ready = pyqtSignal()  # MathJax 初始化完成
+    rendered = pyqtSignal(int, float)  # (渲染序号, 从 render() 调用到排版完成的耗时 ms)
+    failed = pyqtSignal(int, str)  # (渲染序号, 错误信息)
+
+    def __init__(self, mathjax_src, base_url=None, font_size=DEFAULT_FONT_SIZE, cache=None,
+                 submit=None, clock=time.perf_counter, parent=None):
+        super().__init__(parent)
+        self.mathjax_src = mathjax_src
+        self.base_url = base_url or QUrl()
+        self.font_size = font_size
+        self.cache = cache
+        # submit(fn, *args) 在后台执行磁盘缓存读写，返回带 succeeded 信号的 TaskFuture；None 时直接执行
+        self._submit = submit
+        self._clock = clock
+        self._view = None
+        self._ready = False
+        self._seq = 0
+        self._latest = None  # (序号, LaTeX, 出错时是否保留上一次的公式, 是否写入缓存)，页面重新加载后重新渲染
+        self._pending = None  # 页面就绪前最新的渲染请求
+        self._sent = {}  # 序号 -> (render() 调用时间, LaTeX, 是否写入缓存)，页面回报后取出
+        self._warming = {}  # 预先排版的序号 -> LaTeX
+        self._warm_pending = []  # 页面就绪前收到的预先排版请求
+        self._load_started = None
+        self.load_ms = None  # 加载页面到 MathJax 就绪的耗时
+        self.last_ms = None
+        self._renders = 0
+        self._cached = 0
+        self._warmed = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+        self._skipped = 0
+        self._failed = 0
+        self._reloads = 0
+
+    def attach(self, view):
+        """接管 QWebEngineView：换上转发控制台消息的页面并加载常驻预览页"""
+        page = _console_page_class()(self._on_console_message, view)
+        view.setPage(page)
+        page.renderProcessTerminated.connect(self._on_render_process_terminated)
+        self._view = view
+        self._load()
+
+    def _load(self):
+        self._ready = False
+        self._pending = self._latest
+        self._load_started = self._clock()
+        self._view.setHtml(build_preview_page(self.mathjax_src, self.font_size), self.base_url)
+
+    def _on_render_process_terminated(self, status, exit_code):
+        # 渲染进程崩溃后页面空白，重新加载并渲染最后一个公式
+        print(f"公式预览渲染进程退出（{exit_code}），重新加载预览页")
+        self._reloads += 1
+        self._load()
+
+    @property
+    def is_ready(self):
+        return self._ready
+
+    def render(self, latex, keep_on_error=False, draft=False):
+        """渲染公式（空字符串显示占位文字），返回本次渲染的序号；与上一次相同时不再渲染
+
+        keep_on_error=True 时 LaTeX 有语法错误只发出 failed，预览保留上一次正确的公式。
+        编辑框实时预览（keep_on_error）与 draft=True 的中间结果（流式识别的部分文本）
+        只显示不写入缓存，避免输入到一半的公式把历史记录挤出缓存。
+        """
+        latex = normalize_latex(latex)
+        store = not (keep_on_error or draft)
+        if self._latest is not None and self._latest[1:] == (latex, keep_on_error, store):
+            return self._latest[0]
+        self._seq += 1
+        self._sent[self._seq] = (self._clock(), latex, store)
+        self._latest = (self._seq, latex, keep_on_error, store)
+        if self._ready:
+            self._push(*self._latest[:3])
+        else:
+            if self._pending is not None:
+                self._drop(self._pending[0])
+            self._pending = self._latest
+        return self._seq
+
+    def _background(self, fn, *args, then=None):
+        if self._submit is None:
+            result = fn(*args)
+            if then is not None:
+                then(result)
+            return
+        task = self._submit(fn, *args)
+        if then is not None:
+            task.succeeded.connect(then)
+
+    def _push(self, seq, latex, keep_on_error):
+        svg = None
+        if self.cache is not None and latex:
+            svg = self.cache.cached(latex)
+            if svg is None and self.cache.path:
+                # 内存未命中再到后台读磁盘缓存，界面线程不访问 SQLite
+                self._background(self.cache.load, latex,
+                                 then=lambda svg: self._on_loaded(seq, latex, keep_on_error, svg))
+                return
+        self._show(seq, latex, keep_on_error, svg)
+
+    def _on_loaded(self, seq, latex, keep_on_error, svg):
+        # 读盘期间来了新公式或页面重新加载：由之后的 _push 处理
+        if self._ready and self._latest is not None and self._latest[0] == seq:
+            self._show(seq, latex, keep_on_error, svg)
+
+    def _show(self, seq, latex, keep_on_error, svg):
+        if svg is not None:
+            self._view.page().runJavaScript(f"latex2ocr.show({seq}, {json.dumps(svg)})")
+        else:
+            self._view.page().runJavaScript(
+                f"latex2ocr.render({seq}, {json.dumps(latex)}, {json.dumps(keep_on_error)})")
+
+    def _store(self, latex, svg):
+        """写入内存缓存，磁盘写入放到后台"""
+        self.cache.remember(latex, svg)
+        if self.cache.path:
+            self._background(self.cache.write, latex, svg)
+
+    def prewarm(self, latexes):
+        """让页面在空闲时预先排版这些公式并写入缓存（不显示，不影响正常渲染的顺序）"""
+        if self.cache is None:
+            return
+        for latex in latexes:
+            latex = normalize_latex(latex)
+            if not latex:
+                continue
+            if not self._ready:
+                self._warm_pending.append(latex)
+                continue
+            self._seq += 1
+            self._warming[self._seq] = latex
+            self._view.page().runJavaScript(f"latex2ocr.warm({self._seq}, {json.dumps(latex)})")
+
+    def _drop(self, seq):
+        if self._sent.pop(seq, None) is not None:
+            self._skipped += 1
+
+    def set_font_size(self, px):
+        """通过 CSS 变量调整公式字号，SVG 随字号缩放，不需要重新排版"""
+        if px == self.font_size:
+            return
+        self.font_size = px
+        if self._ready:
+            self._view.page().runJavaScript(f"latex2ocr.setFontSize({int(px)})")
+
+    def _on_console_message(self, message):
+        """处理页面回报，返回是否为预览页自己的消息"""
+        if not message.startswith(MESSAGE_PREFIX):
+            return False
+        try:
+            data = json.loads(message[len(MESSAGE_PREFIX):])
+        except ValueError:
+            return False
+        event = data.get('event')
+        if event == 'ready':
+            self._on_ready()
+        elif event == 'rendered':
+            self._on_rendered(data['id'], data.get('svg'), data.get('cached', False))
+        elif event == 'warmed':
+            self._on_warmed(data['id'], data['svg'])
+        elif event == 'error':
+            self._finish(data['id'])
+            self._failed += 1
+            self.failed.emit(data['id'], data.get('message', ''))
+        return True
+
+    def _on_ready(self):
+        self._ready = True
+        self.load_ms = (self._clock() - self._load_started) * 1000
+        self.ready.emit()
+        if self._pending is not None:
+            self._push(*self._pending[:3])
+            self._pending = None
+        # 重新加载后页面中排队的预先排版已丢失，重新提交
+        warm, self._warm_pending = self._warm_pending + list(self._warming.values()), []
+        self._warming.clear()
+        self.prewarm(warm)
+
+    def _finish(self, seq):
+        """取出 seq 的 (发送时间, LaTeX, 是否写入缓存)；更早的请求已被页面跳过"""
+        for older in [s for s in self._sent if s < seq]:
+            self._drop(older)
+        return self._sent.pop(seq, None)
+
+    def _on_rendered(self, seq, svg=None, cached=False):
+        sent = self._finish(seq)
+        if sent is None:
+            return
+        started, latex, store = sent
+        # 直接显示的缓存 SVG 已在缓存中
+        if svg and store and not cached and self.cache is not None:
+            self._store(latex, svg)
+        elapsed = (self._clock() - started) * 1000
+        self.last_ms = elapsed
+        self._renders += 1
+        self._cached += cached
+        self._total_ms += elapsed
+        self._max_ms = max(self._max_ms, elapsed)
+        self.rendered.emit(seq, elapsed)
+
+    def _on_warmed(self, seq, svg):
+        latex = self._warming.pop(seq, None)
+        if latex is not None and self.cache is not None:
+            self._store(latex, svg)
+            self._warmed += 1
+
+    def stats(self):
+        return {
+            'load_ms': self.load_ms,
+            'renders': self._renders,
+            'cached': self._cached,
+            'warmed': self._warmed,
+            'avg_ms': self._total_ms / self._renders if self._renders else 0.0,
+            'max_ms': self._max_ms,
+            'last_ms': self.last_ms,
+            'skipped': self._skipped,
+            'failed': self._failed,
+            'reloads': self._reloads,
+        }
+
+
+def format_preview_stats(stats):
+    """公式预览统计摘要，退出时输出"""
+    load = f"{stats['load_ms']:.0f}ms" if stats['load_ms'] is not None else "未就绪"
+    return (f"公式预览：MathJax 加载 {load}，渲染 {stats['renders']} 次（直接显示缓存 {stats['cached']} 次，"
+            f"预先排版 {stats['warmed']} 个），"
+            f"平均 {stats['avg_ms']:.0f}ms / 最长 {stats['max_ms']:.0f}ms，"
+            f"跳过 {stats['skipped']}，失败 {stats['failed']}，重新加载 {stats['reloads']}")
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""监视屏幕区域：框选一块区域后定时重新抓取，内容确实变化时才重新识别
+
+    [Capture]
+    WatchInterval = 250       每隔多少毫秒检查一次（默认每秒 4 次）
+    WatchThreshold = 0.002    缩略图中变化像素所占比例超过该值才算内容变化
+
+每次检查只抓取选区这一小块（QScreen.grabWindow 的区域参数，坐标相对屏幕左上角），
+缩成最长边 THUMB_SIDE 的灰度缩略图后与之前的帧逐像素比较，灰度差超过
+PIXEL_TOLERANCE 的像素计为变化。内容变化后还要等画面稳定（与上一次检查相比
+不再变化，如翻页动画已结束）才发出 changed；与上一次发出的帧相比没有变化时不重复识别。
+"""
+
+import time
+
+from PyQt5.QtCore import Qt, QObject, QRect, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage
+from PIL import ImageChops
+
+from Screen_Capture import capture_stats, qimage_to_pil
+
+WATCH_INTERVAL_MS = 250
+WATCH_THRESHOLD = 0.002
+# 比较用缩略图的最长边（像素）
+THUMB_SIDE = 256
+# 灰度差超过该值的像素才计为变化，忽略抗锯齿与色彩抖动
+PIXEL_TOLERANCE = 32
+
+
+def frame_thumbnail(image, side=THUMB_SIDE):
+    """QImage → 最长边不超过 side 的灰度 PIL 缩略图"""
+    if max(image.width(), image.height()) > side:
+        image = image.scaled(side, side, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return qimage_to_pil(image).convert('L')
+
+
+def changed_fraction(a, b, tolerance=PIXEL_TOLERANCE):
+    """两张灰度缩略图中变化像素所占的比例（0–1）"""
+    if a.size != b.size:
+        # 分数缩放比例下两次抓取可能差一个像素
+        b = b.resize(a.size)
+    lut = [255 if v > tolerance else 0 for v in range(256)]
+    changed = ImageChops.difference(a, b).point(lut).histogram()[255]
+    return changed / (a.width * a.height)
+
+
+class RegionWatcher(QObject):
+    """每 interval_ms 抓取 screen 上的 rect（逻辑坐标，相对屏幕），内容变化且稳定后发出 changed(帧, 帧时间)
+
+    帧时间为抓取时刻的 time.time()。每次检查（抓取 + 比较）的耗时记入 stats 的 'watch' 阶段。
+    """
+
+    changed = pyqtSignal(QImage, float)
+
+    def __init__(self, screen, rect, interval_ms=WATCH_INTERVAL_MS, threshold=WATCH_THRESHOLD,
+                 stats=None, parent=None):
+        super().__init__(parent)
+        self.screen = screen
+        self.rect = QRect(rect)
+        self.interval_ms = interval_ms
+        self.threshold = threshold
+        self._stats = stats or capture_stats
+        self._previous = None  # 上一次检查的缩略图
+        self._baseline = None  # 上一次发出（已入队识别）的帧的缩略图
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.check)
+
+    @property
+    def active(self):
+        return self._timer.isActive()
+
+    def start(self, first_frame=None):
+        """开始监视；first_frame 为已经识别过的第一帧（QImage），作为比较基准"""
+        self._baseline = frame_thumbnail(first_frame) if first_frame is not None else None
+        self._previous = self._baseline
+        self._timer.start()
+
+    def pause(self):
+        """暂停检查（如截图覆盖层显示期间），基准帧保留"""
+        self._timer.stop()
+
+    def resume(self):
+        self._previous = None
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._previous = self._baseline = None
+
+    def check(self):
+        """抓取区域并与之前的帧比较，本帧发出了 changed 时返回 True"""
+        start = time.perf_counter()
+        frame_time = time.time()
+        r = self.rect
+        pixmap = self.screen.grabWindow(0, r.x(), r.y(), r.width(), r.height())
+        if pixmap.isNull():
+            return False
+        image = pixmap.toImage()
+        thumb = frame_thumbnail(image)
+        # 与上一次检查相比仍在变化（动画、滚动中）时先不识别
+        stable = self._previous is not None and changed_fraction(thumb, self._previous) <= self.threshold
+        self._previous = thumb
+        changed = stable and (self._baseline is None or changed_fraction(thumb, self._baseline) > self.threshold)
+        self._stats.record('watch', (time.perf_counter() - start) * 1000)
+        if changed:
+            self._baseline = thumb
+            self._stats.count('watch_changes')
+            self.changed.emit(image, frame_time)
+        return changed
+
+
+def watch_from_config(conf, screen, rect, parent=None):
+    """根据 config.ini 的 [Capture] WatchInterval / WatchThreshold 创建 RegionWatcher"""
+    interval = max(50, conf.getint('Capture', 'WatchInterval', fallback=WATCH_INTERVAL_MS))
+    threshold = conf.getfloat('Capture', 'WatchThreshold', fallback=WATCH_THRESHOLD)
+    return RegionWatcher(screen, rect, interval_ms=interval, threshold=threshold, parent=parent)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""公式预览的 SVG 缓存：以 LaTeX 为键保存 MathJax 排版结果
+
+SVG 以 ex 为单位，字号由预览页的 CSS 变量在显示时决定，同一公式在任何字号下共用一条缓存。
+
+内存中按 LRU 保留最近的若干条，同时写入 history.json 旁边的 svg_cache.sqlite3，
+重启后浏览历史记录也不必重新排版。命中时预览页直接显示 SVG，不经过 TeX 解析。
+界面线程只用 cached() / remember() 访问内存，load() / write() 读写磁盘，由调用方放到后台线程；
+磁盘上超出 disk_entries 的旧条目每 PRUNE_INTERVAL 次写入清理一次。
+启动时 preload() 在后台线程把最近历史记录的 SVG 从磁盘读入内存，
+磁盘上也没有的由预览页空闲时预先排版（PreviewEngine.prewarm）。
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+
+CACHE_FILE_NAME = 'svg_cache.sqlite3'
+# 每写入多少条检查一次磁盘条目数
+PRUNE_INTERVAL = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS svgs (
+    key      TEXT PRIMARY KEY,
+    svg      TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_svgs_accessed ON svgs(accessed);
+"""
+
+
+def svg_key(latex):
+    return hashlib.sha256(latex.encode('utf-8')).hexdigest()
+
+
+class SvgCache:
+    """内存 LRU + SQLite 两级缓存；path 为 None 时只用内存。可在多个线程中使用"""
+
+    def __init__(self, path=None, memory_entries=200, disk_entries=2000, clock=time.time):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.preloaded = 0
+        self._writes = 0
+        if path:
+            with self._connect() as conn:
+                conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 不在每次提交时 fsync，写入不拖慢界面
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return contextlib.closing(conn)
+
+    def _remember_key(self, key, svg):
+        with self._lock:
+            self._memory[key] = svg
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.path:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT svg FROM svgs WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE svgs SET accessed = ? WHERE key = ?", (self._clock(), key))
+        except sqlite3.Error as e:
+            print(f"读取公式 SVG 磁盘缓存失败: {e}")
+            return None
+        return row[0] if row else None
+
+    def cached(self, latex):
+        """只查内存（可在界面线程调用）；未命中返回 None，没有磁盘缓存时计为未命中"""
+        key = svg_key(latex)
+        with self._lock:
+            svg = self._memory.get(key)
+            if svg is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            elif not self.path:
+                self.misses += 1
+            return svg
+
+    def load(self, latex):
+        """从磁盘读取（在后台线程调用），命中时读入内存；未命中返回 None"""
+        key = svg_key(latex)
+        svg = self._read_disk(key)
+        with self._lock:
+            if svg is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember_key(key, svg)
+        return svg
+
+    def get(self, latex):
+        """返回缓存的 SVG 标记，未命中返回 None（内存未命中时读磁盘）"""
+        svg = self.cached(latex)
+        if svg is None and self.path:
+            svg = self.load(latex)
+        return svg
+
+    def remember(self, latex, svg):
+        """只写入内存（可在界面线程调用）"""
+        self._remember_key(svg_key(latex), svg)
+
+    def write(self, latex, svg):
+        """写入磁盘（在后台线程调用）；每 PRUNE_INTERVAL 次写入清理一次超出 disk_entries 的旧条目"""
+        if not self.path:
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self.disk_entries and self._writes % PRUNE_INTERVAL == 0
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO svgs(key, svg, accessed) VALUES(?, ?, ?)",
+                             (svg_key(latex), svg, self._clock()))
+                if prune and conn.execute("SELECT COUNT(*) FROM svgs").fetchone()[0] > self.disk_entries:
+                    conn.execute("DELETE FROM svgs WHERE key IN ("
+                                 "SELECT key FROM svgs ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                                 (self.disk_entries,))
+        except sqlite3.Error as e:
+            print(f"写入公式 SVG 磁盘缓存失败: {e}")
+
+    def put(self, latex, svg):
+        self.remember(latex, svg)
+        self.write(latex, svg)
+
+    def preload(self, latexes):
+        """把磁盘上已有的 SVG 读入内存（在后台线程调用），返回磁盘上也没有的 LaTeX 列表"""
+        missing = []
+        for latex in latexes:
+            key = svg_key(latex)
+            with self._lock:
+                if key in self._memory:
+                    continue
+            svg = self._read_disk(key)
+            if svg is None:
+                missing.append(latex)
+                continue
+            self._remember_key(key, svg)
+            with self._lock:
+                self.preloaded += 1
+        return missing
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'preloaded': self.preloaded,
+                'entries': len(self._memory),
+            }
+
+
+def format_svg_cache_stats(stats):
+    """SVG 缓存统计摘要，退出时输出"""
+    return (f"公式 SVG 缓存：命中率 {stats['hit_rate']:.0%}（内存 {stats['memory_hits']} / "
+            f"磁盘 {stats['disk_hits']} / 未命中 {stats['misses']}），"
+            f"启动预热 {stats['preloaded']} 条，内存中 {stats['entries']} 条")
+
+
+def svg_cache_from_config(conf, base_dir):
+    """根据 config.ini 的 [Preview] 节创建 SVG 缓存，Cache = false 时返回 None"""
+    section = 'Preview'
+    if not conf.getboolean(section, 'Cache', fallback=True):
+        return None
+    memory_entries = conf.getint(section, 'MemoryEntries', fallback=200)
+    disk_entries = conf.getint(section, 'DiskEntries', fallback=2000)
+    try:
+        return SvgCache(os.path.join(base_dir, CACHE_FILE_NAME), memory_entries, disk_entries)
+    except (sqlite3.Error, OSError) as e:
+        print(f"公式 SVG 磁盘缓存不可用，只使用内存缓存: {e}")
+        return SvgCache(None, memory_entries)
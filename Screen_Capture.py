@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""低延迟截图：只抓光标所在的屏幕，选区直接在内存中交给识别器
+
+原流程是最小化窗口后固定等待 200ms，再抓取所有屏幕拼成虚拟桌面，松开鼠标后
+同步写 PNG、再从磁盘读回来识别。现在：
+
+- ScreenCapture 在隐藏窗口前记下光标所在的屏幕，收到窗口的 Hide 事件后只等一帧
+  （让窗口管理器把窗口从屏幕上移除）就抓屏，只抓这一块屏幕；
+- 选区转成 CapturedImage（PIL 图片，只复制像素、不编码 PNG）直接进入识别队列，
+  历史图片由 save_in_background() 在单独的线程中写盘，不占用识别线程；
+- ScreenshotOverlay 只重画新旧选区并集所在的矩形，选区外的暗化背景预先画好一次，
+  按 devicePixelRatio 换算源图坐标，高分屏上显示与裁剪都是原始像素；
+- ScreenshotOverlay 启动后预先创建好、隐藏待命，每次截图复用同一个窗口；
+  裁剪或取消后立即释放整屏截图，两次截图之间不占内存；
+- SpeculativeEncoder 在拖动选区停顿片刻时就在后台裁剪、灰度化、缩放并编码上传数据，
+  松开鼠标时选区没有再变就直接发送这份结果；选区变化后之前的预编码作废；
+- capture_stats 记录各阶段耗时，主要指标是松开鼠标 → 请求发出（上传数据已编码好、
+  即将发送请求的时刻），另有隐藏窗口、抓屏、触发 / 热键 → 覆盖层显示、
+  松开鼠标 → 任务入队、后台写 PNG、预编码命中次数，以及截图前后的常驻内存。
+
+框选后定时重新抓取同一块区域、内容变化时才重新识别的监视模式见 Region_Watch.py。
+"""
+
+import os
+import sys
+import time
+import threading
+import concurrent.futures
+
+from PyQt5.QtCore import Qt, QObject, QEvent, QRect, QRectF, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QCursor, QGuiApplication, QImage, QPainter, QPen, QPixmap
+from PyQt5.QtWidgets import QWidget
+from PIL import Image
+
+from OCR_Preprocess import ImagePayload
+
+# 收到 Hide 事件后再等一帧（约 16ms），合成器刷新后屏幕上才不再有窗口
+HIDE_SETTLE_MS = 16
+# 迟迟收不到 Hide 事件时最长等待多久就直接抓屏
+HIDE_TIMEOUT_MS = 300
+
+# 拖动选区停顿多久后开始预编码（毫秒）
+SPECULATE_IDLE_MS = 120
+
+# 覆盖层暗化程度：未框选时轻微暗化，框选时选区外加深
+IDLE_DIM = QColor(0, 0, 0, 80)
+SELECTION_DIM = QColor(0, 0, 0, 120)
+SELECTION_PEN_WIDTH = 2
+# 选区小于该尺寸（逻辑像素）时视为取消
+MIN_SELECTION = 10
+
+STAGE_LABELS = {
+    'dispatch': '松开鼠标 → 请求发出',
+    'hide': '隐藏窗口',
+    'grab': '抓屏',
+    'overlay': '触发 → 覆盖层显示',
+    'hotkey': '热键 → 覆盖层显示',
+    'handoff': '松开鼠标 → 入队',
+    'save': '后台写 PNG',
+    'watch': '监视区域每次检查（抓取 + 比较）',
+}
+
+
+class CaptureStats:
+    """各截图阶段的耗时统计（毫秒），线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        # 预编码命中 / 未命中 / 作废，监视区域内容变化（重新识别）次数
+        self._counters = {'hits': 0, 'misses': 0, 'stale': 0, 'watch_changes': 0}
+        self._memory = None  # 最近一次截图前后的常驻内存（字节）
+
+    def count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def record_memory(self, before, after):
+        if before is None or after is None:
+            return
+        with self._lock:
+            self._memory = {'before': before, 'after': after}
+
+    def record(self, stage, ms):
+        with self._lock:
+            s = self._stages.setdefault(stage, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0})
+            s['count'] += 1
+            s['total_ms'] += ms
+            s['max_ms'] = max(s['max_ms'], ms)
+            s['last_ms'] = ms
+
+    def stats(self):
+        with self._lock:
+            return {stage: dict(s, avg_ms=s['total_ms'] / s['count']) for stage, s in self._stages.items()}
+
+    def memory(self):
+        with self._lock:
+            return dict(self._memory) if self._memory else None
+
+
+def format_capture_stats(stats, memory=None, counters=None):
+    stages = [stage for stage in STAGE_LABELS if stage in stats]
+    stages += [stage for stage in stats if stage not in STAGE_LABELS]
+    lines = [f"  {STAGE_LABELS.get(stage, stage)}: 平均 {stats[stage]['avg_ms']:.0f}ms，"
+             f"最长 {stats[stage]['max_ms']:.0f}ms，最近 {stats[stage]['last_ms']:.0f}ms（{stats[stage]['count']} 次）"
+             for stage in stages]
+    if counters and (counters['hits'] or counters['misses'] or counters['stale']):
+        lines.append(f"  预编码: 命中 {counters['hits']} 次，未命中 {counters['misses']} 次，"
+                     f"作废 {counters['stale']} 次")
+    if counters and counters.get('watch_changes'):
+        lines.append(f"  监视区域: 内容变化 {counters['watch_changes']} 次（已重新识别）")
+    if memory:
+        lines.append(f"  常驻内存（最近一次截图）: 截图前 {memory['before'] / 2**20:.0f}MB → "
+                     f"截图后 {memory['after'] / 2**20:.0f}MB")
+    return '截图延迟：\n' + '\n'.join(lines) if lines else '截图延迟：暂无'
+
+
+def resident_memory():
+    """当前进程的常驻内存（字节），取不到时返回 None"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in (
+                        'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                        'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                        'PagefileUsage', 'PeakPagefileUsage')]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# 进程级默认统计
+capture_stats = CaptureStats()
+
+
+def screen_under_cursor():
+    """光标所在的屏幕，取不到时返回主屏幕"""
+    return QGuiApplication.screenAt(QCursor.pos()) or QGuiApplication.primaryScreen()
+
+
+def qimage_to_pil(image):
+    """QImage → PIL 图片，只复制像素，不经过 PNG 编码"""
+    image = image.convertToFormat(QImage.Format_RGB888)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    # 每行按 4 字节对齐，stride 取 bytesPerLine
+    return Image.frombuffer('RGB', (image.width(), image.height()), bytes(bits),
+                            'raw', 'RGB', image.bytesPerLine(), 1)
+
+
+class CapturedImage(ImagePayload):
+    """截图选区（QImage）：像素直接交给识别器，PNG 由后台线程写到 path
+
+    QImage 在第一次使用时（预编码线程或识别线程中）才转换为 PIL 图片。
+    frame_time 为监视区域抓到这一帧的时刻（time.time()），写入历史记录。
+    松开鼠标后 attach() 记下保存路径与时刻；之后第一次取预处理结果（随后即发出请求）时
+    记录「松开鼠标 → 请求发出」的耗时，松开鼠标前的预编码不计。
+    """
+
+    def __init__(self, image, path=None, captured_at=None, stats=None, frame_time=None):
+        super().__init__(image, name=path, measure_source=False)
+        self.path = path
+        self.captured_at = captured_at
+        self.frame_time = frame_time
+        self.dispatched_at = None
+        self._stats = stats or capture_stats
+
+    def attach(self, path, captured_at):
+        # 不取锁：预编码可能正持有锁，松开鼠标时不能等它
+        self.path = self._name = path
+        self.captured_at = captured_at
+
+    def precompute(self, options):
+        """预编码：结果留给之后的 prepare() 直接使用，不算作发出请求"""
+        return super().prepare(options)
+
+    def _decoded(self):
+        if self._image is None:
+            self._image = qimage_to_pil(self.source)
+            self.source = self._image
+        return self._image
+
+    def prepare(self, options):
+        prepared = super().prepare(options)
+        with self._lock:
+            first = self.captured_at is not None and self.dispatched_at is None
+            if first:
+                self.dispatched_at = time.perf_counter()
+        if first:
+            ms = (self.dispatched_at - self.captured_at) * 1000
+            self._stats.record('dispatch', ms)
+            print(f"截图 → 请求发出 {ms:.0f}ms")
+        return prepared
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(name):
+    """截图用的单线程后台执行器（按用途区分），不占用识别线程池"""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=name)
+        return _executors[name]
+
+
+def save_in_background(image, path, stats=None):
+    """在单独的线程中把 QImage 写成 PNG（QImage 可跨线程使用，QPixmap 不行），返回 Future
+
+    写盘再慢也不会推迟识别请求。
+    """
+    stats = stats or capture_stats
+
+    def save():
+        start = time.perf_counter()
+        if not image.save(path, 'PNG'):
+            print(f"截图保存失败: {path}")
+            return False
+        stats.record('save', (time.perf_counter() - start) * 1000)
+        return True
+
+    return _executor('capture-save').submit(save)
+
+
+class SpeculativeEncoder(QObject):
+    """拖动选区停顿 idle_ms 后在后台预先编码上传数据，松开鼠标时选区没变就直接使用
+
+    overlay 为 ScreenshotOverlay；options_provider() 返回当前模型的 PreprocessOptions，
+    返回 None 时不预编码。预编码在单独的线程中执行，与识别时的编码共用同一个
+    CapturedImage（按参数缓存），松开鼠标时还没编码完也不会重复编码。
+    """
+
+    def __init__(self, overlay, options_provider, idle_ms=SPECULATE_IDLE_MS, stats=None, parent=None):
+        super().__init__(parent)
+        self.overlay = overlay
+        self.options_provider = options_provider
+        self._stats = stats or capture_stats
+        self._selection = None
+        self._pending = None  # (选区, CapturedImage, Future)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(idle_ms)
+        self._timer.timeout.connect(self._speculate)
+        overlay.selection_changed.connect(self._on_selection_changed)
+
+    def _on_selection_changed(self, selection):
+        self._selection = QRect(selection) if selection.isValid() else None
+        self.discard()
+        if self._selection is not None:
+            self._timer.start()
+
+    def discard(self):
+        """选区变化或取消截图：作废之前的预编码（尚未开始的直接取消）"""
+        self._timer.stop()
+        if self._pending is not None:
+            self._pending[2].cancel()
+            self._pending = None
+            self._stats.count('stale')
+
+    def _speculate(self):
+        selection = self._selection
+        if selection is None or self.overlay.screen_pixmap is None:
+            return
+        options = self.options_provider()
+        if options is None:
+            return
+        payload = CapturedImage(self.overlay.crop(selection).toImage(), stats=self._stats)
+        future = _executor('capture-speculate').submit(payload.precompute, options)
+        self._pending = (selection, payload, future)
+
+    def take(self):
+        """松开鼠标：返回与最终选区一致的预编码 CapturedImage，没有时返回 None"""
+        self._timer.stop()
+        pending, self._pending = self._pending, None
+        if pending is not None and pending[0] == self._selection:
+            self._stats.count('hits')
+            return pending[1]
+        if pending is not None:
+            pending[2].cancel()
+            self._stats.count('stale')
+        self._stats.count('misses')
+        return None
+
+
+class ScreenCapture(QObject):
+    """隐藏 window → 抓取光标所在的屏幕 → 发出 grabbed(截图, 屏幕几何)
+
+    window 本来就不可见时立即抓屏；否则等窗口的 Hide 事件（超时则直接抓屏）。
+    """
+
+    grabbed = pyqtSignal(QPixmap, QRect)
+    failed = pyqtSignal(str)
+
+    def __init__(self, window, settle_ms=HIDE_SETTLE_MS, timeout_ms=HIDE_TIMEOUT_MS, stats=None, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.settle_ms = settle_ms
+        self._stats = stats or capture_stats
+        self._screen = None
+        self._started = None
+        self._waiting = False
+        self._timeout = QTimer(self)
+        self._timeout.setSingleShot(True)
+        self._timeout.setInterval(timeout_ms)
+        self._timeout.timeout.connect(self._on_hidden)
+
+    @property
+    def screen(self):
+        """最近一次抓取的屏幕"""
+        return self._screen
+
+    def start(self):
+        # 光标在隐藏窗口前后不会移动，先确定要抓哪块屏幕
+        self._screen = screen_under_cursor()
+        self._started = time.perf_counter()
+        if self.window is None or not self.window.isVisible() or self.window.isMinimized():
+            self._grab()
+            return
+        self._waiting = True
+        self.window.installEventFilter(self)
+        self._timeout.start()
+        self.window.hide()
+
+    def eventFilter(self, obj, event):
+        if obj is self.window and event.type() == QEvent.Hide and self._waiting:
+            self._on_hidden()
+        return False
+
+    def _on_hidden(self):
+        if not self._waiting:
+            return
+        self._waiting = False
+        self._timeout.stop()
+        self.window.removeEventFilter(self)
+        QTimer.singleShot(self.settle_ms, self._grab)
+
+    def _grab(self):
+        if self._started is not None:
+            self._stats.record('hide', (time.perf_counter() - self._started) * 1000)
+        screen = self._screen
+        if screen is None:
+            self.failed.emit("截图失败，无法获取屏幕")
+            return
+        start = time.perf_counter()
+        pixmap = screen.grabWindow(0)
+        self._stats.record('grab', (time.perf_counter() - start) * 1000)
+        if pixmap.isNull():
+            self.failed.emit("截图失败，无法获取屏幕内容")
+            return
+        self.grabbed.emit(pixmap, screen.geometry())
+
+
+def dimmed_pixmap(pixmap, color):
+    """pixmap 叠加一层半透明颜色后的副本，保留 devicePixelRatio"""
+    result = QPixmap(pixmap.size())
+    result.setDevicePixelRatio(pixmap.devicePixelRatio())
+    painter = QPainter(result)
+    painter.drawPixmap(0, 0, pixmap)
+    painter.fillRect(QRectF(0, 0, pixmap.width(), pixmap.height()), color)
+    painter.end()
+    return result
+
+
+class ScreenshotOverlay(QWidget):
+    """全屏半透明覆盖层，用户拖拽选区截取屏幕区域
+
+    选区外的暗化背景在第一次框选时画好一次；拖动时只重画新旧选区（含边框）的并集，
+    paintEvent 也只绘制 event.rect() 这一块。坐标为逻辑像素，取源图时乘以 devicePixelRatio。
+    同一个实例可以反复使用：begin() 显示新的截图，截图完成或取消后隐藏并释放截图。
+    """
+
+    captured = pyqtSignal(QPixmap)  # 选区截图完成信号
+    cancelled = pyqtSignal()        # ESC 取消截图信号
+    shown = pyqtSignal()            # begin() 之后第一帧绘制完成
+    selection_changed = pyqtSignal(QRect)  # 拖动中的选区，重新按下时为空矩形
+
+    def __init__(self, screen_pixmap=None, geometry=None, parent=None):
+        super().__init__(parent)
+        self.screen_pixmap = None
+        self.origin = None
+        self.selection = None
+        self.last_selection = None  # 最近一次完成截图的选区（逻辑坐标，相对屏幕）
+        self._dimmed = None
+        self._shown_pending = False
+
+        # 全屏、无边框、置顶
+        self.setWindowFlags(
+            Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool
+        )
+        self.setAttribute(Qt.WA_TranslucentBackground, False)
+        # 每次都画满 event.rect()，不需要 Qt 先擦除背景
+        self.setAttribute(Qt.WA_OpaquePaintEvent, True)
+        self.setCursor(Qt.CrossCursor)
+        if screen_pixmap is not None:
+            self.begin(screen_pixmap, geometry)
+
+    def prewarm(self):
+        """提前创建原生窗口并完成样式初始化，第一次截图时不必再创建"""
+        self.ensurePolished()
+        self.winId()
+
+    def begin(self, screen_pixmap, geometry=None):
+        """显示一张新的屏幕截图，等待用户框选"""
+        self.screen_pixmap = screen_pixmap
+        self.origin = None
+        self.selection = None
+        self._dimmed = None
+        self._shown_pending = True
+        self.setWindowState(Qt.WindowNoState)
+        if geometry is not None:
+            # 覆盖在截图所在的屏幕上
+            self.setGeometry(geometry)
+        self.setWindowState(Qt.WindowFullScreen)
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def release(self):
+        """隐藏覆盖层并释放整屏截图与暗化背景"""
+        self.hide()
+        self.screen_pixmap = None
+        self._dimmed = None
+        self.origin = None
+        self.selection = None
+
+    def source_rect(self, rect):
+        """逻辑坐标的矩形 → 截图中的像素矩形"""
+        dpr = self.screen_pixmap.devicePixelRatio()
+        return QRectF(rect.x() * dpr, rect.y() * dpr, rect.width() * dpr, rect.height() * dpr)
+
+    def dirty_rect(self, old, new):
+        """新旧选区（含虚线边框）的并集，拖动时只重画这一块"""
+        margin = SELECTION_PEN_WIDTH
+        return old.united(new).adjusted(-margin, -margin, margin, margin)
+
+    def paintEvent(self, event):
+        rect = event.rect()
+        painter = QPainter(self)
+        if self.screen_pixmap is None:
+            painter.fillRect(rect, Qt.black)
+            return
+        if self._shown_pending:
+            # 第一帧已开始绘制，随即出现在屏幕上
+            self._shown_pending = False
+            self.shown.emit()
+        if self.selection is None:
+            # 未选区时轻微暗化
+            painter.drawPixmap(QRectF(rect), self.screen_pixmap, self.source_rect(rect))
+            painter.fillRect(rect, IDLE_DIM)
+            return
+
+        if self._dimmed is None:
+            self._dimmed = dimmed_pixmap(self.screen_pixmap, SELECTION_DIM)
+        painter.drawPixmap(QRectF(rect), self._dimmed, self.source_rect(rect))
+        # 选区内显示原始截图
+        inner = self.selection.intersected(rect)
+        if not inner.isEmpty():
+            painter.drawPixmap(QRectF(inner), self.screen_pixmap, self.source_rect(inner))
+        # 选区边框
+        painter.setPen(QPen(QColor("#4f6ef7"), SELECTION_PEN_WIDTH, Qt.DashLine))
+        painter.drawRect(self.selection)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.origin = event.pos()
+            self.selection = None
+            self.update()
+            self.selection_changed.emit(QRect())
+        elif event.button() == Qt.RightButton:
+            # 右键取消截图
+            self.release()
+            self.cancelled.emit()
+
+    def mouseMoveEvent(self, event):
+        if self.origin:
+            old = self.selection
+            self.selection = QRect(self.origin, event.pos()).normalized()
+            if old is None:
+                # 从未框选切换到框选，整屏的暗化程度都变了
+                self.update()
+            else:
+                self.update(self.dirty_rect(old, self.selection))
+            if self.selection != old:
+                self.selection_changed.emit(self.selection)
+
+    def crop(self, selection):
+        """按选区裁剪原始截图（高分屏上为物理像素）"""
+        return self.screen_pixmap.copy(self.source_rect(selection).toAlignedRect())
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            cropped = None
+            if (self.selection and self.selection.width() > MIN_SELECTION
+                    and self.selection.height() > MIN_SELECTION):
+                cropped = self.crop(self.selection)
+                self.last_selection = QRect(self.selection)
+            # 先释放整屏截图再发信号，之后的识别流程只持有选区
+            self.release()
+            if cropped is not None:
+                self.captured.emit(cropped)
+            else:
+                # 选区过小，视为取消
+                self.cancelled.emit()
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_Escape:
+            self.release()
+            self.cancelled.emit()
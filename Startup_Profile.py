@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""启动耗时分析：python main_v108.py --profile-startup
+
+记录 main_v108 开始执行后每个模块的导入耗时（-X importtime 风格：自身 / 累计），
+以及创建 QApplication、构造主窗口、首次绘制、公式预览引擎就绪等时间点，
+启动完成后在控制台输出报告。未指定参数时不做任何记录。
+
+只统计主线程中的绝对导入；包内部的相对导入计入所在包的自身耗时。
+"""
+
+import sys
+import time
+import builtins
+import threading
+
+
+class StartupProfiler:
+    """替换 builtins.__import__ 记录导入耗时，并记录启动过程中的时间点"""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.active = False
+        self.started = None
+        self.imports = []  # [(模块名, 嵌套深度, 自身耗时 s, 累计耗时 s)]，按导入完成顺序
+        self.marks = []  # [(名称, 时间点)]
+        self._stack = []  # 每层正在进行的导入中，子模块导入累计耗时
+        self._thread = None
+        self._original_import = None
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        self.started = self._clock()
+        self._thread = threading.get_ident()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        """恢复原始的 __import__，已记录的数据保留"""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _new_modules(self, name, fromlist):
+        """本次导入可能新加载的模块名：未加载的模块本身，或 from 包 import 子模块"""
+        if name not in sys.modules:
+            return [name]
+        return [f"{name}.{item}" for item in fromlist or ()
+                if item != '*' and f"{name}.{item}" not in sys.modules]
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        if level or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+        candidates = self._new_modules(name, fromlist)
+        if not candidates:
+            return original(name, globals, locals, fromlist, level)
+
+        start = self._clock()
+        self._stack.append(0.0)
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            children = self._stack.pop()
+            cumulative = self._clock() - start
+            if self._stack:
+                self._stack[-1] += cumulative
+            # from 包 import 名称 中的名称可能只是属性而非子模块
+            loaded = [m for m in candidates if m in sys.modules]
+            if loaded:
+                self.imports.append((', '.join(loaded), len(self._stack), cumulative - children, cumulative))
+
+    def mark(self, label):
+        if self.active:
+            self.marks.append((label, self._clock()))
+
+    def report(self, top=15):
+        lines = ["启动耗时分析（从 main_v108 开始执行计时）："]
+        for label, t in self.marks:
+            lines.append(f"  {label}: {(t - self.started) * 1000:.0f} ms")
+        total = sum(cumulative for _, depth, _, cumulative in self.imports if depth == 0)
+        lines.append(f"  模块导入共 {total * 1000:.0f} ms，累计耗时最多的 {top} 项（单位 ms）：")
+        lines.append(f"  {'self':>8} {'cumulative':>10}  module")
+        slowest = sorted(self.imports, key=lambda row: row[3], reverse=True)[:top]
+        for name, depth, self_s, cumulative in slowest:
+            lines.append(f"  {self_s * 1000:8.1f} {cumulative * 1000:10.1f}  {'  ' * depth}{name}")
+        return '\n'.join(lines)
+
+    def finish(self, label=None):
+        """启动完成：记录最后一个时间点并输出报告（未启用时什么也不做）"""
+        if not self.active:
+            return
+        if label:
+            self.mark(label)
+        self.stop()
+        self.active = False
+        print(self.report())
+
+
+# 进程级实例，main_v108 在导入其他模块之前按 --profile-startup 启用
+startup_profiler = StartupProfiler()
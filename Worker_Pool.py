@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""常驻工作线程池：界面识别、API 连接测试等后台任务共用
+
+线程在进程生命周期内常驻（concurrent.futures.ThreadPoolExecutor），不再为每次识别
+创建、启动、销毁一个 QThread；识别器与 keep-alive 连接池由 OCR_Registry 按 section
+复用，异步请求在 OCR_Cancel 的后台事件循环中执行，线程之间共享同一份预热状态。
+
+submit(fn, *args) 返回 TaskFuture，任务结束后在主线程发出 succeeded / failed /
+finished 信号。线程池统计队列深度（已提交未开始的任务数）、等待时间、忙碌时间与利用率。
+"""
+
+import time
+import threading
+import concurrent.futures
+
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+
+DEFAULT_THREADS = 3
+
+
+class TaskFuture(QObject):
+    """submit() 返回的任务句柄，信号均在主线程发出"""
+
+    succeeded = pyqtSignal(object)  # 任务返回值
+    failed = pyqtSignal(object)  # 任务抛出的异常
+    finished = pyqtSignal()  # 成功、失败或开始前被取消后都会发出
+
+    def __init__(self, future, name=''):
+        super().__init__()
+        self.future = future
+        self.name = name
+
+    def cancel(self):
+        """取消尚未开始的任务；已在运行的任务需由其自身的取消令牌中止"""
+        return self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self.future.exception(timeout)
+
+
+class WorkerPool(QObject):
+    """常驻线程池 + Qt 信号桥接；线程在第一次提交任务时按需创建
+
+    clock 可替换，便于测试忙碌时间统计。
+    """
+
+    _completed = pyqtSignal(object)  # 工作线程 → 主线程，参数为 TaskFuture
+
+    def __init__(self, max_workers=DEFAULT_THREADS, name='ocr-worker', clock=time.monotonic, parent=None):
+        super().__init__(parent)
+        self.max_workers = max(1, max_workers)
+        self._name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._executor = None
+        self._tasks = set()  # 已提交、信号尚未发出的任务，保证 TaskFuture 存活到主线程收到信号
+        self._created = clock()
+        self._submitted = 0
+        self._completed_count = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._queued = 0
+        self._running = 0
+        self._peak_queued = 0
+        self._wait_total = 0.0
+        self._busy = 0.0
+        # 始终排队投递：任务在 submit() 返回前就已结束时，调用方仍来得及连接信号
+        self._completed.connect(self._deliver, Qt.QueuedConnection)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self._name)
+            return self._executor
+
+    def resize(self, max_workers):
+        """调整线程数；已创建的线程执行完手头的任务后退出，新任务使用新的线程"""
+        max_workers = max(1, max_workers)
+        with self._lock:
+            if max_workers == self.max_workers:
+                return
+            self.max_workers = max_workers
+            old, self._executor = self._executor, None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def submit(self, fn, *args, **kwargs):
+        """在常驻线程中执行 fn(*args, **kwargs)，返回 TaskFuture"""
+        submitted = self._clock()
+        with self._lock:
+            self._submitted += 1
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+        future = self._get_executor().submit(self._run, submitted, fn, args, kwargs)
+        task = TaskFuture(future, getattr(fn, '__qualname__', ''))
+        self._tasks.add(task)
+        future.add_done_callback(lambda _: self._on_done(task))
+        return task
+
+    def _run(self, submitted, fn, args, kwargs):
+        started = self._clock()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_total += started - submitted
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._busy += self._clock() - started
+
+    def _on_done(self, task):
+        # 在工作线程（或取消任务的线程）中调用，经排队连接转到主线程
+        with self._lock:
+            if task.future.cancelled():
+                self._queued -= 1
+                self._cancelled += 1
+            elif task.future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed_count += 1
+        self._completed.emit(task)
+
+    def _deliver(self, task):
+        self._tasks.discard(task)
+        if not task.future.cancelled():
+            error = task.future.exception()
+            if error is not None:
+                task.failed.emit(error)
+            else:
+                task.succeeded.emit(task.future.result())
+        task.finished.emit()
+
+    def pending(self):
+        """已提交但主线程尚未收到结束信号的任务数"""
+        return len(self._tasks)
+
+    def stats(self):
+        with self._lock:
+            started = self._submitted - self._queued - self._cancelled
+            uptime = max(self._clock() - self._created, 1e-9)
+            return {
+                'threads': self.max_workers,
+                'submitted': self._submitted,
+                'completed': self._completed_count,
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+                'queued': self._queued,
+                'running': self._running,
+                'peak_queued': self._peak_queued,
+                'avg_wait_ms': self._wait_total / started * 1000 if started else 0.0,
+                'busy_s': self._busy,
+                'utilization': self._busy / (uptime * self.max_workers),
+            }
+
+    def shutdown(self):
+        """退出时取消排队中的任务，不等待正在运行的任务"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def format_worker_stats(stats):
+    """线程池统计摘要，退出时输出"""
+    return (f"工作线程池：{stats['threads']} 个线程，完成 {stats['completed']} / 失败 {stats['failed']}"
+            f" / 取消 {stats['cancelled']}，排队 {stats['queued']}（峰值 {stats['peak_queued']}），"
+            f"平均等待 {stats['avg_wait_ms']:.0f}ms，忙碌 {stats['busy_s']:.1f}s，"
+            f"利用率 {stats['utilization']:.0%}")
+
+
+# 进程级常驻线程池，界面识别队列与 API 连接测试共用
+worker_pool = WorkerPool()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""截图松开鼠标到请求发出的延迟：拖动停顿时预编码 vs 松开鼠标后才编码
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_capture.py [--width 3840 --height 2160] [--pause 600] [--runs 10]
+
+在离屏平台上用一张带公式文字的大截图模拟框选：按下、拖动、停顿 --pause 毫秒后松开，
+随后像识别器一样对截图调用 prepare()（裁边、灰度、缩放、PNG 编码），
+计时从松开鼠标到拿到上传数据为止，即请求可以发出的时刻（不含网络）。
+停顿短于 SPECULATE_IDLE_MS + 编码耗时时，松开鼠标后只需等预编码剩下的部分。
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import Qt, QEvent, QPoint
+from PyQt5.QtGui import QColor, QFont, QMouseEvent, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from OCR_Preprocess import PreprocessOptions
+from Screen_Capture import ScreenshotOverlay, SpeculativeEncoder, CapturedImage, CaptureStats, SPECULATE_IDLE_MS
+
+
+def desktop_pixmap(width, height):
+    pixmap = QPixmap(width, height)
+    pixmap.fill(QColor('#ffffff'))
+    painter = QPainter(pixmap)
+    painter.setFont(QFont('Serif', 40))
+    for row in range(0, height, 120):
+        painter.drawText(40, row + 80, 'E = mc^2 + \\int_0^1 f(x) dx  ' * 4)
+    painter.end()
+    return pixmap
+
+
+def mouse(kind, pos, button=Qt.LeftButton):
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+    return QMouseEvent(kind, pos, button, buttons, Qt.NoModifier)
+
+
+def wait(app, ms):
+    deadline = time.perf_counter() + ms / 1000
+    while time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def release_to_dispatch(app, overlay, encoder, options, start, end, pause):
+    """一次框选：返回松开鼠标到上传数据就绪的毫秒数"""
+    captured = []
+    overlay.captured.connect(captured.append)
+    overlay.begin(overlay.screen_pixmap)
+    overlay.mousePressEvent(mouse(QEvent.MouseButtonPress, start))
+    overlay.mouseMoveEvent(mouse(QEvent.MouseMove, end, Qt.NoButton))
+    wait(app, pause)
+    pixmap = overlay.screen_pixmap
+    overlay.mouseReleaseEvent(mouse(QEvent.MouseButtonRelease, end))
+    released = time.perf_counter()
+    payload = encoder.take() if encoder is not None else None
+    if payload is None:
+        payload = CapturedImage(captured[0].toImage(), stats=CaptureStats())
+    payload.attach('bench.png', released)
+    with contextlib.redirect_stdout(None):
+        payload.prepare(options)
+    elapsed = (time.perf_counter() - released) * 1000
+    overlay.captured.disconnect()
+    overlay.screen_pixmap = pixmap  # 下一轮复用同一张截图
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=3840, help='截图宽度')
+    parser.add_argument('--height', type=int, default=2160, help='截图高度')
+    parser.add_argument('--pause', type=int, default=600,
+                        help=f'松开鼠标前的停顿（毫秒），预编码在停顿 {SPECULATE_IDLE_MS}ms 后开始')
+    parser.add_argument('--runs', type=int, default=10, help='每种方式的框选次数')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    overlay = ScreenshotOverlay(desktop_pixmap(args.width, args.height))
+    overlay.setWindowState(Qt.WindowNoState)
+    overlay.setGeometry(0, 0, args.width, args.height)
+    options = PreprocessOptions.for_provider('gemini')
+    start, end = QPoint(20, 20), QPoint(args.width * 3 // 4, args.height // 3)
+    print(f"截图 {args.width}x{args.height}，选区 {end.x() - start.x()}x{end.y() - start.y()}，"
+          f"停顿 {args.pause}ms，{args.runs} 次框选（松开鼠标 → 上传数据就绪）：")
+    results = {}
+    for name, speculate in (('松开后编码', False), ('停顿时预编码', True)):
+        stats = CaptureStats()
+        encoder = SpeculativeEncoder(overlay, lambda: options, stats=stats) if speculate else None
+        samples = [release_to_dispatch(app, overlay, encoder, options, start, end, args.pause)
+                   for _ in range(args.runs)]
+        if encoder is not None:
+            overlay.selection_changed.disconnect()
+        results[name] = sum(samples) / len(samples)
+        print(f"  {name:<6}  平均 {results[name]:8.1f}ms   最长 {max(samples):8.1f}ms")
+    print(f"  预编码后松开鼠标到请求发出的延迟为原来的 {results['停顿时预编码'] / results['松开后编码']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
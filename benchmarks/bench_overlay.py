@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""截图覆盖层拖动选区时每次鼠标移动的帧耗时：局部重画 vs 整屏重画
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_overlay.py [--width 7680 --height 2160] [--dpr 1] [--moves 200]
+
+在离屏平台上创建一张大截图的覆盖层，模拟从左上角向右下角拖动选区，每次移动后
+处理事件并计时，即 mouseMoveEvent + paintEvent 的耗时。对照组为原实现：
+每次移动 update() 整个窗口，paintEvent 重画整张截图并重新填充暗化遮罩。
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import Qt, QEvent, QPoint, QRect
+from PyQt5.QtGui import QColor, QLinearGradient, QMouseEvent, QPainter, QPen, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from Screen_Capture import ScreenshotOverlay
+
+
+class FullRepaintOverlay(ScreenshotOverlay):
+    """原实现：每次移动整屏重画"""
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.screen_pixmap)
+        if self.origin and self.selection:
+            painter.fillRect(self.rect(), QColor(0, 0, 0, 120))
+            painter.drawPixmap(self.selection, self.screen_pixmap, self.selection)
+            painter.setPen(QPen(QColor("#4f6ef7"), 2, Qt.DashLine))
+            painter.drawRect(self.selection)
+        else:
+            painter.fillRect(self.rect(), QColor(0, 0, 0, 80))
+
+    def mouseMoveEvent(self, event):
+        if self.origin:
+            self.selection = QRect(self.origin, event.pos()).normalized()
+            self.update()
+
+
+def desktop_pixmap(width, height, dpr):
+    """带渐变的大截图（逻辑尺寸 width x height）"""
+    pixmap = QPixmap(int(width * dpr), int(height * dpr))
+    pixmap.setDevicePixelRatio(dpr)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor('#fafafa'))
+    gradient.setColorAt(1, QColor('#3050a0'))
+    painter = QPainter(pixmap)
+    painter.fillRect(0, 0, width, height, gradient)
+    painter.end()
+    return pixmap
+
+
+def mouse(kind, pos, button=Qt.LeftButton):
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+    return QMouseEvent(kind, pos, button, buttons, Qt.NoModifier)
+
+
+def measure(app, overlay_class, pixmap, width, height, moves):
+    """返回每次移动的帧耗时列表（毫秒）"""
+    overlay = overlay_class(pixmap)
+    # 离屏平台的屏幕只有 800x600，取消全屏后手动放大到截图尺寸
+    overlay.setWindowState(Qt.WindowNoState)
+    overlay.setGeometry(0, 0, width, height)
+    app.processEvents()
+
+    start = QPoint(width // 8, height // 8)
+    overlay.mousePressEvent(mouse(QEvent.MouseButtonPress, start))
+    app.processEvents()
+    frames = []
+    for i in range(1, moves + 1):
+        # 选区逐步扩大到截图的一半左右
+        pos = start + QPoint(i * width // (2 * moves), i * height // (2 * moves))
+        t = time.perf_counter()
+        overlay.mouseMoveEvent(mouse(QEvent.MouseMove, pos, Qt.NoButton))
+        app.processEvents()
+        frames.append((time.perf_counter() - t) * 1000)
+    overlay.close()
+    return frames[1:]  # 第一帧从未框选切换到框选，两种实现都整屏重画
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=7680, help='截图逻辑宽度（默认两块 4K 横排）')
+    parser.add_argument('--height', type=int, default=2160, help='截图逻辑高度')
+    parser.add_argument('--dpr', type=float, default=1.0, help='devicePixelRatio')
+    parser.add_argument('--moves', type=int, default=200, help='鼠标移动次数')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    pixmap = desktop_pixmap(args.width, args.height, args.dpr)
+    print(f"截图 {pixmap.width()}x{pixmap.height()}（devicePixelRatio {args.dpr}），{args.moves} 次鼠标移动：")
+    results = {}
+    for name, overlay_class in (('整屏重画', FullRepaintOverlay), ('局部重画', ScreenshotOverlay)):
+        frames = measure(app, overlay_class, pixmap, args.width, args.height, args.moves)
+        results[name] = sum(frames) / len(frames)
+        print(f"  {name}  平均 {results[name]:7.2f}ms   p95 {percentile(frames, 95):7.2f}ms   "
+              f"最长 {max(frames):7.2f}ms")
+    print(f"  局部重画每帧耗时为整屏重画的 {results['局部重画'] / results['整屏重画']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
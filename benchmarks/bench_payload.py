@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""对比"每次重试都重新编码"与"ImagePayload 只编码一次"的 CPU 时间和内存分配
+
+    python benchmarks/bench_payload.py [图片路径] [--attempts 3] [--providers 2]
+
+不传图片时生成一张 3840x2160 的合成截图（四周留白 + 若干公式笔画）。
+模拟一次识别在 providers 个模型（备用链）上各重试 attempts 次的编码开销。
+峰值分配由 tracemalloc 统计，只包含 Python 堆（bytes / Base64 字符串），
+不含 PIL 内部的像素缓冲区。
+"""
+
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from OCR_Preprocess import ImagePayload, PreprocessOptions, preprocess_image
+
+PROVIDERS = ['glm', 'gemini', 'openai']
+
+
+def synthetic_screenshot(path):
+    img = Image.new('RGB', (3840, 2160), (248, 248, 248))
+    draw = ImageDraw.Draw(img)
+    for i in range(12):
+        x = 900 + i * 170
+        draw.line((x, 950, x + 120, 1150), fill=(30, 30, 30), width=6)
+        draw.arc((x, 1000, x + 140, 1140), 0, 270, fill=(40, 40, 40), width=5)
+    draw.line((880, 1200, 2980, 1200), fill=(20, 20, 20), width=4)
+    img.save(path)
+
+
+def per_attempt(path, options_list, attempts):
+    """旧做法：每个模型的每次尝试都重新打开、预处理、编码并 Base64"""
+    for options in options_list:
+        for _ in range(attempts):
+            data, _ = preprocess_image(path, options)
+            f"data:image/png;base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def prepared_once(path, options_list, attempts):
+    """新做法：同一 ImagePayload 按预处理参数只编码一次，重试直接复用"""
+    payload = ImagePayload(path)
+    for options in options_list:
+        for _ in range(attempts):
+            payload.prepare(options).data_url
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.process_time()
+    fn(*args)
+    cpu = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('image', nargs='?', help='待测图片（默认生成 4K 合成截图）')
+    parser.add_argument('--attempts', type=int, default=3, help='每个模型的尝试次数（含重试）')
+    parser.add_argument('--providers', type=int, default=2, help='备用链中的模型数（1-3）')
+    args = parser.parse_args(argv)
+
+    path = args.image
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), 'screenshot.png')
+        synthetic_screenshot(path)
+    options_list = [PreprocessOptions.for_provider(p) for p in PROVIDERS[:args.providers]]
+
+    with Image.open(path) as img:
+        print(f"图片 {img.width}x{img.height}，{os.path.getsize(path) / 1024:.1f}KB，"
+              f"{args.providers} 个模型 × {args.attempts} 次尝试")
+    rows = [
+        ('每次尝试重新编码', measure(per_attempt, path, options_list, args.attempts)),
+        ('ImagePayload 复用', measure(prepared_once, path, options_list, args.attempts)),
+    ]
+    for name, (cpu, peak) in rows:
+        print(f"{name:<18} CPU {cpu * 1000:8.1f}ms   Python 堆峰值 {peak / 1024 / 1024:7.1f}MB")
+    (cpu0, peak0), (cpu1, peak1) = rows[0][1], rows[1][1]
+    print(f"CPU 节省 {1 - cpu1 / cpu0:.0%}，Python 堆峰值节省 {1 - peak1 / peak0:.0%}")
+
+
+if __name__ == '__main__':
+    main()
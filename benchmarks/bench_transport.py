@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""对比 SDK 传输与轻量 raw 传输（OCR_Transport）的导入耗时和单次调用开销
+
+    python benchmarks/bench_transport.py [--calls 200] [--imports 3]
+
+导入耗时：在全新的子进程中分别导入 openai、google.genai 与 OCR_Transport，取多次的最小值。
+单次调用：识别器的 HTTP 客户端换成 httpx.MockTransport（返回固定响应，不走网络），
+测量每次 _recognize 的 CPU 时间与 Python 堆分配，即构造请求、解析响应这部分客户端开销。
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import httpx
+from PIL import Image, ImageDraw
+
+from OCR_Gemini import GeminiFormulaRecognizer, OpenAIVisionRecognizer
+from OCR_Preprocess import ImagePayload
+
+IMPORTS = [
+    ('openai', 'import openai'),
+    ('google.genai', 'from google import genai; from google.genai import types'),
+    ('OCR_Transport', 'import OCR_Transport'),
+]
+
+LATEX = 'E = mc^2 \\\\ \\frac{a}{b}'
+
+
+def import_time(statement, repeat):
+    """子进程中执行 statement 的最短耗时（秒），不含解释器启动"""
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, check=True,
+                             capture_output=True, text=True).stdout
+        value = float(out.strip().splitlines()[-1])
+        best = value if best is None else min(best, value)
+    return best
+
+
+def canned_response(request):
+    """按请求路径返回 chat/completions 或 generateContent 的固定响应"""
+    if request.url.path.endswith('/chat/completions'):
+        body = {'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': 'bench',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': LATEX}}]}
+    else:
+        body = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': LATEX}]},
+                                'finishReason': 'STOP', 'index': 0}]}
+    return httpx.Response(200, headers={'content-type': 'application/json'}, content=json.dumps(body))
+
+
+def make_recognizer(kind, transport):
+    if kind == 'gemini':
+        recognizer = GeminiFormulaRecognizer('bench-key', transport=transport)
+    else:
+        recognizer = OpenAIVisionRecognizer('bench-key', 'https://bench.invalid/v1', transport=transport)
+    recognizer._http_client.close()
+    recognizer._http_client = httpx.Client(transport=httpx.MockTransport(canned_response))
+    recognizer.client = recognizer._new_client()
+    recognizer.rate_limiter = None
+    # 图片已编码好（同一 payload 只编码一次），这里只计客户端开销，不输出预处理报告
+    recognizer._prepare_image = lambda payload: payload.prepare(recognizer.preprocess)
+    return recognizer
+
+
+def measure(recognizer, payload, calls):
+    """返回 (每次调用 CPU µs, 每次调用的 Python 堆峰值增量 KB)"""
+    recognizer._recognize(payload)  # 预热：SDK 首次调用会构建类型与校验器
+    start = time.process_time()
+    for _ in range(calls):
+        recognizer._recognize(payload)
+    cpu = (time.process_time() - start) / calls
+
+    tracemalloc.start()
+    traced_calls = max(1, calls // 10)
+    peak = 0
+    for _ in range(traced_calls):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        recognizer._recognize(payload)
+        peak += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return cpu * 1e6, peak / traced_calls / 1024
+
+
+def sample_payload():
+    path = os.path.join(tempfile.mkdtemp(), 'formula.png')
+    img = Image.new('RGB', (480, 120), (255, 255, 255))
+    ImageDraw.Draw(img).text((20, 50), 'E = mc^2', fill=(0, 0, 0))
+    img.save(path)
+    return ImagePayload(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200, help='每种传输的调用次数')
+    parser.add_argument('--imports', type=int, default=3, help='导入耗时的测量次数（取最小值）')
+    args = parser.parse_args(argv)
+
+    print("导入耗时（全新进程，取最小值）：")
+    for name, statement in IMPORTS:
+        print(f"  {name:<14} {import_time(statement, args.imports) * 1000:8.1f}ms")
+
+    payload = sample_payload()
+    print(f"\n单次调用客户端开销（MockTransport，{args.calls} 次）：")
+    for kind in ('openai', 'gemini'):
+        rows = {}
+        for transport in ('sdk', 'raw'):
+            recognizer = make_recognizer(kind, transport)
+            rows[transport] = measure(recognizer, payload, args.calls)
+            recognizer.close()
+            cpu, kb = rows[transport]
+            print(f"  {kind:<7} {transport:<4} CPU {cpu:8.0f}µs   堆峰值 {kb:8.1f}KB")
+        print(f"  {kind:<7} raw 相比 sdk：CPU 节省 {1 - rows['raw'][0] / rows['sdk'][0]:.0%}，"
+              f"堆峰值节省 {1 - rows['raw'][1] / rows['sdk'][1]:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""监视区域每次检查的耗时：抓取选区 + 缩略图比较，能否以每秒数次的频率运行
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_watch.py [--width 1200 --height 400] [--ticks 200]
+    python benchmarks/bench_watch.py --grab      # 在真实桌面上抓取主屏幕左上角的区域
+
+离屏平台上无法抓屏，RegionWatcher 的 screen 换成每次返回一张公式截图的替身，
+计时包括 QPixmap → QImage、缩略图与两次比较，即除系统抓屏调用外每次检查的全部开销；
+每隔 --change-every 次检查换一张内容不同的图，同时统计触发识别的次数。
+--grab 时使用真实屏幕，计时额外包括 grabWindow 本身。
+"""
+
+import os
+import sys
+import time
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+if '--grab' not in sys.argv:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QColor, QFont, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from Region_Watch import RegionWatcher
+from Screen_Capture import CaptureStats
+
+
+def formula_pixmap(width, height, text):
+    """白底黑字的「公式」区域"""
+    pixmap = QPixmap(width, height)
+    pixmap.fill(QColor('white'))
+    painter = QPainter(pixmap)
+    painter.setFont(QFont('Serif', max(12, height // 6)))
+    painter.drawText(QRect(0, 0, width, height), Qt.AlignCenter, text)
+    painter.end()
+    return pixmap
+
+
+class FakeScreen:
+    """按顺序返回预先画好的区域截图"""
+
+    def __init__(self, frames, change_every):
+        self.frames = frames
+        self.change_every = change_every
+        self.calls = 0
+
+    def grabWindow(self, window, x, y, width, height):
+        frame = self.frames[(self.calls // self.change_every) % len(self.frames)]
+        self.calls += 1
+        return frame
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1200, help='监视区域宽度（像素）')
+    parser.add_argument('--height', type=int, default=400, help='监视区域高度（像素）')
+    parser.add_argument('--ticks', type=int, default=200, help='检查次数')
+    parser.add_argument('--change-every', type=int, default=20, help='离屏时每隔多少次检查换一张图')
+    parser.add_argument('--grab', action='store_true', help='抓取真实屏幕（不能在离屏平台上使用）')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    rect = QRect(0, 0, args.width, args.height)
+    if args.grab:
+        screen = app.primaryScreen()
+        source = '真实屏幕'
+    else:
+        frames = [formula_pixmap(args.width, args.height, text)
+                  for text in ('E = mc^2', 'E = mc^3', 'a^2 + b^2 = c^2')]
+        screen = FakeScreen(frames, args.change_every)
+        source = '离屏替身（不含系统抓屏调用）'
+
+    stats = CaptureStats()
+    watcher = RegionWatcher(screen, rect, stats=stats)
+    watcher.start()
+    ticks = []
+    changes = 0
+    for _ in range(args.ticks):
+        t = time.perf_counter()
+        changes += watcher.check()
+        ticks.append((time.perf_counter() - t) * 1000)
+    watcher.stop()
+
+    if not stats.stats():
+        print("抓屏失败（离屏平台无法使用 --grab）")
+        return
+    avg = sum(ticks) / len(ticks)
+    print(f"监视区域 {args.width}x{args.height}，{source}，{args.ticks} 次检查：")
+    print(f"  每次检查  平均 {avg:6.2f}ms   p95 {percentile(ticks, 95):6.2f}ms   最长 {max(ticks):6.2f}ms")
+    print(f"  单线程每秒最多约 {1000 / avg:.0f} 次，默认每 {watcher.interval_ms}ms 检查一次占用 "
+          f"{avg / watcher.interval_ms:.1%} 的主线程时间")
+    print(f"  触发识别 {changes} 次")
+
+
+if __name__ == '__main__':
+    main()
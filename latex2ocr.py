@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""latex2ocr 命令行入口（无界面，不导入 Qt / QtWebEngine）
+
+批量识别整个目录或通配符匹配的公式图片：
+
+    python -m latex2ocr batch scans/ -m API_GLM -j 8 -o results.jsonl
+    python -m latex2ocr batch "scans/**/*.png" --format csv -o results.csv
+
+识别结果边识别边写出（JSONL / CSV），结束后在 stderr 打印吞吐量、
+p50/p95 延迟和错误分类统计。
+
+只运行上传前的图片预处理（不调用 API），用于按模型调整 [Preprocess] 参数：
+
+    python -m latex2ocr preprocess scans/ -m API_GLM --save-dir out/
+"""
+
+import sys
+import os
+import csv
+import glob
+import json
+import math
+import time
+import asyncio
+import argparse
+import contextlib
+from collections import Counter
+
+from OCR_Gemini import load_config
+from OCR_Cache import cache_from_config
+from OCR_Registry import registry, format_pool_stats
+from OCR_RateLimit import rate_limiter_from_config, store_from_config
+from OCR_Preprocess import options_from_config, preprocess_image
+from OCR_Hedge import hedge_from_config, hedge_stats, format_hedge_stats
+from OCR_Failover import failover_from_config, breakers, format_breaker_stats
+
+# PyInstaller --onefile 兼容：优先使用 exe 所在目录，否则用脚本目录
+if getattr(sys, 'frozen', False):
+    BASE_DIR = os.path.dirname(sys.executable)
+else:
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+CSV_FIELDS = ['path', 'status', 'latex', 'source', 'latency_ms', 'error']
+
+
+def collect_images(pattern, recursive=False):
+    """展开目录或通配符为图片路径列表（按路径排序）"""
+    if os.path.isdir(pattern):
+        if recursive:
+            paths = [
+                os.path.join(root, name)
+                for root, _, files in os.walk(pattern)
+                for name in files
+            ]
+        else:
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def resolve_section(conf, name):
+    """按 section 名或 DisplayName 查找模型配置；未指定时取第一个配置了 API Key 的模型"""
+    sections = [s for s in conf.sections() if s.startswith('API_')]
+    if name:
+        for section in sections:
+            if name in (section, conf.get(section, 'DisplayName', fallback='')):
+                return section
+        raise ValueError(f"config.ini 中没有名为「{name}」的模型")
+    for section in sections:
+        if conf.get(section, 'APIKey', fallback=''):
+            return section
+    raise ValueError("config.ini 中没有已配置 API Key 的模型")
+
+
+def classify_error(message):
+    """把错误信息归类，用于结束时的错误统计"""
+    lower = message.lower()
+    if 'timeout' in lower or 'timed out' in lower:
+        return 'timeout'
+    if '429' in lower or 'rate_limit' in lower or 'resource_exhausted' in lower:
+        return 'rate_limited'
+    if '401' in lower or '403' in lower or 'api key' in lower or 'authentication' in lower:
+        return 'auth'
+    if any(code in lower for code in ('500', '502', '503', '504', 'overloaded')):
+        return 'server_error'
+    if 'connection' in lower or 'network' in lower:
+        return 'connection'
+    if 'invalid' in lower:
+        return 'invalid_response'
+    return 'other'
+
+
+def percentile(values, q):
+    """最近秩法百分位数（values 为空时返回 0）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class ResultWriter:
+    """边识别边写出结果，每条记录写完立即 flush"""
+
+    def __init__(self, stream, fmt='jsonl'):
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv:
+            self._csv.writerow({k: record.get(k, '') for k in CSV_FIELDS})
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+
+async def run_batch(paths, recognizer, writer, concurrency=4):
+    """用 concurrency 个协程并发识别 paths，返回每张图片的结果记录列表
+
+    限速由识别器自带的令牌桶（recognizer.rate_limiter）负责，与 GUI 共享同一额度。
+    """
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    records = []
+
+    async def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                latex = await recognizer.arecognize_formula(path)
+                record = {
+                    'path': path, 'status': 'ok', 'latex': str(latex),
+                    'source': getattr(latex, 'source', 'api'),
+                }
+                if getattr(latex, 'winner', None):
+                    record['winner'] = latex.winner
+            except Exception as e:
+                record = {'path': path, 'status': 'error', 'error': str(e)}
+            record['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            records.append(record)
+            writer.write(record)
+
+    await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    return records
+
+
+async def _run_and_close(coro, recognizer):
+    """异步连接池绑定在本次事件循环上，循环结束前关闭"""
+    try:
+        return await coro
+    finally:
+        await recognizer.aclose()
+
+
+def summarize(records, elapsed):
+    """统计吞吐量、延迟分位数与错误分类（延迟只统计实际请求了 API 的图片）"""
+    ok = [r for r in records if r['status'] == 'ok']
+    latencies = [r['latency_ms'] for r in records if r.get('source') not in ('cache', 'reused')]
+    errors = Counter(classify_error(r['error']) for r in records if r['status'] == 'error')
+    return {
+        'total': len(records),
+        'ok': len(ok),
+        'failed': len(records) - len(ok),
+        'cached': sum(1 for r in ok if r.get('source') in ('cache', 'reused')),
+        'elapsed_s': elapsed,
+        'throughput': len(records) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'errors': dict(errors),
+    }
+
+
+def format_summary(summary):
+    lines = [
+        f"完成 {summary['total']} 张：成功 {summary['ok']}（其中缓存 {summary['cached']}），失败 {summary['failed']}",
+        f"耗时 {summary['elapsed_s']:.1f}s，吞吐量 {summary['throughput']:.2f} 张/s",
+        f"延迟 p50 {summary['p50_ms']:.0f}ms，p95 {summary['p95_ms']:.0f}ms",
+    ]
+    if summary['errors']:
+        breakdown = '，'.join(f"{kind} {count}" for kind, count in
+                             sorted(summary['errors'].items(), key=lambda kv: -kv[1]))
+        lines.append(f"错误分类: {breakdown}")
+    return '\n'.join(lines)
+
+
+def cmd_batch(args):
+    conf = load_config(args.config)
+    section = resolve_section(conf, args.model)
+    cache = None if args.no_cache else cache_from_config(conf, BASE_DIR)
+    store = store_from_config(conf, BASE_DIR)
+    recognizer = registry.get(conf, section, cache=cache, limiter_store=store)
+    if args.hedge:
+        if not conf.has_section('Hedge'):
+            conf.add_section('Hedge')
+        conf.set('Hedge', 'Enabled', 'true')
+        conf.set('Hedge', 'Secondary', resolve_section(conf, args.hedge))
+
+    paths = collect_images(args.pattern, recursive=args.recursive)
+    if not paths:
+        print(f"没有找到图片: {args.pattern}", file=sys.stderr)
+        return 1
+
+    if args.rate is not None:
+        recognizer.rate_limiter = rate_limiter_from_config(conf, section, store=store, rate=args.rate)
+    rate = recognizer.rate_limiter.rate
+
+    def get_recognizer(s):
+        return registry.get(conf, s, cache=cache, limiter_store=store)
+
+    hedged = hedge_from_config(conf, section, get_recognizer)
+    failover = failover_from_config(
+        conf, section, lambda s: hedge_from_config(conf, s, get_recognizer) or get_recognizer(s))
+    recognizer = failover or hedged or recognizer
+
+    display_name = conf.get(section, 'DisplayName', fallback=section)
+    print(f"使用 {display_name} 识别 {len(paths)} 张图片，并发 {args.jobs}"
+          + (f"，限速 {rate * 60:g} 次/分钟" if rate else "")
+          + (f"，对冲备用 {hedged.names[1]}" if hedged else "")
+          + (f"，切换链 {' → '.join(failover.sections)}" if failover else ""), file=sys.stderr)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        writer = ResultWriter(out, args.format)
+        start = time.perf_counter()
+        # 识别器的调试输出改写到 stderr，保证 stdout 上只有结果记录
+        with contextlib.redirect_stdout(sys.stderr):
+            records = asyncio.run(_run_and_close(
+                run_batch(paths, recognizer, writer, args.jobs), recognizer))
+        elapsed = time.perf_counter() - start
+    finally:
+        if args.output:
+            out.close()
+
+    summary = summarize(records, elapsed)
+    print(format_summary(summary), file=sys.stderr)
+    print(format_pool_stats(registry.stats()), file=sys.stderr)
+    if hedged:
+        print(format_hedge_stats(hedge_stats.snapshot()), file=sys.stderr)
+    if failover:
+        print(format_breaker_stats(breakers.snapshot()), file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 2
+
+
+def cmd_preprocess(args):
+    conf = load_config(args.config)
+    section = resolve_section(conf, args.model)
+    recognizer_type = conf.get(section, 'Recognizer', fallback='openai').lower()
+    options = options_from_config(conf, section, recognizer_type)
+    paths = collect_images(args.pattern, recursive=args.recursive)
+    if not paths:
+        print(f"没有找到图片: {args.pattern}", file=sys.stderr)
+        return 1
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    print(f"{section}: {options}", file=sys.stderr)
+    total_before = total_after = total_ms = 0
+    for path in paths:
+        data, report = preprocess_image(path, options)
+        total_before += report.bytes_before
+        total_after += report.bytes_after
+        total_ms += report.elapsed_ms
+        print(f"{path}: {report}")
+        if args.save_dir:
+            name = os.path.splitext(os.path.basename(path))[0] + '.png'
+            with open(os.path.join(args.save_dir, name), 'wb') as f:
+                f.write(data)
+
+    ratio = total_after / total_before if total_before else 0.0
+    print(f"共 {len(paths)} 张：{total_before / 1024:.1f}KB → {total_after / 1024:.1f}KB"
+          f"（{ratio:.0%}），平均耗时 {total_ms / len(paths):.0f}ms", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='latex2ocr', description='latex2ocr 命令行工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    batch = sub.add_parser('batch', help='批量识别目录或通配符匹配的图片')
+    batch.add_argument('pattern', help='图片目录或通配符，如 scans/ 或 "scans/**/*.png"')
+    batch.add_argument('-m', '--model', default='', help='config.ini 中的 section 名或显示名称')
+    batch.add_argument('-c', '--config', default=os.path.join(BASE_DIR, 'config.ini'), help='配置文件路径')
+    batch.add_argument('-j', '--jobs', type=int, default=4, help='并发识别数（默认 4）')
+    batch.add_argument('--rate', default=None,
+                       help="速率限制 '次数/秒数'，如 10/60；默认读取 section 的 RateLimit")
+    batch.add_argument('-o', '--output', default='', help='结果输出文件（默认 stdout）')
+    batch.add_argument('-f', '--format', choices=['jsonl', 'csv'], default='jsonl', help='输出格式')
+    batch.add_argument('-r', '--recursive', action='store_true', help='递归扫描子目录')
+    batch.add_argument('--no-cache', action='store_true', help='不使用识别结果缓存')
+    batch.add_argument('--hedge', default='', help='对冲请求的备用模型（section 名或显示名称），默认读取 [Hedge]')
+    batch.set_defaults(func=cmd_batch)
+
+    pre = sub.add_parser('preprocess', help='只运行图片预处理，报告上传体积与耗时（不调用 API）')
+    pre.add_argument('pattern', help='图片目录或通配符')
+    pre.add_argument('-m', '--model', default='', help='按该模型的预处理参数处理')
+    pre.add_argument('-c', '--config', default=os.path.join(BASE_DIR, 'config.ini'), help='配置文件路径')
+    pre.add_argument('-r', '--recursive', action='store_true', help='递归扫描子目录')
+    pre.add_argument('--save-dir', default='', help='保存预处理后的 PNG，便于人工检查')
+    pre.set_defaults(func=cmd_preprocess)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ValueError, NotImplementedError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
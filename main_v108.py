@@ -1,14 +1,20 @@
 import sys
+from Startup_Profile import startup_profiler
+
+# --profile-startup：记录之后每个模块的导入耗时与首个窗口出现的时间，启动完成后输出报告
+if '--profile-startup' in sys.argv:
+    startup_profiler.start()
+
 import os
 import re
 import json
-import configparser
+import time
 import shutil
 from datetime import datetime
 
 import pyperclip
 from PyQt5 import QtCore
-from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 from PyQt5.QtGui import QPixmap
@@ -20,7 +26,25 @@ from PyQt5.QtWidgets import (
 
 from PIL import Image as PILImage
 from Init_Window_v105 import MainWindowUI
-from OCR_Gemini import GeminiFormulaRecognizer, OpenAIVisionRecognizer, GLMFormulaRecognizer
+from OCR_Gemini import (
+    create_recognizer, load_config, preprocess_from_config, cache_scope_from_config
+)
+from OCR_Registry import registry, format_pool_stats
+from OCR_RateLimit import store_from_config
+from OCR_Hedge import hedge_from_config, hedge_stats, format_hedge_stats
+from OCR_Failover import failover_from_config, breakers, format_breaker_stats
+from OCR_Cancel import CancelToken, RecognitionCancelled, run_cancellable
+from OCR_Cache import cache_from_config, image_signatures
+from Job_Queue import JobQueue, DEFAULT_WORKERS, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from Worker_Pool import worker_pool, format_worker_stats
+from Preview_Engine import PreviewEngine, mathjax_source, normalize_latex, format_preview_stats
+from Render_Cache import svg_cache_from_config, format_svg_cache_stats
+from Screen_Capture import (
+    ScreenCapture, ScreenshotOverlay, SpeculativeEncoder, CapturedImage, save_in_background,
+    capture_stats, format_capture_stats, resident_memory
+)
+from Global_Hotkey import hotkey_from_config
+from Region_Watch import watch_from_config
 
 # PyInstaller --onefile 兼容：优先使用 exe 所在目录，否则用脚本目录
 if getattr(sys, 'frozen', False):
@@ -28,123 +52,68 @@ if getattr(sys, 'frozen', False):
 else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-
-class ScreenshotOverlay(QtWidgets.QWidget):
-    """全屏半透明覆盖层，用户拖拽选区截取屏幕区域"""
-
-    captured = pyqtSignal(QtGui.QPixmap)  # 选区截图完成信号
-    cancelled = pyqtSignal()              # ESC 取消截图信号
-
-    def __init__(self, screen_pixmap, parent=None):
-        super().__init__(parent)
-        self.screen_pixmap = screen_pixmap
-        self.origin = None
-        self.selection = None
-
-        # 全屏、无边框、置顶
-        self.setWindowFlags(
-            Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool
-        )
-        self.setAttribute(Qt.WA_TranslucentBackground, False)
-        self.setWindowState(Qt.WindowFullScreen)
-        self.setCursor(Qt.CrossCursor)
-        self.show()
-
-    def paintEvent(self, event):
-        painter = QtGui.QPainter(self)
-        # 画屏幕截图
-        painter.drawPixmap(0, 0, self.screen_pixmap)
-
-        if self.origin and self.selection:
-            # 暗化非选区
-            painter.fillRect(self.rect(), QtGui.QColor(0, 0, 0, 120))
-            # 选区内显示原始截图
-            painter.drawPixmap(self.selection, self.screen_pixmap, self.selection)
-            # 选区边框
-            pen = QtGui.QPen(QtGui.QColor("#4f6ef7"), 2, Qt.DashLine)
-            painter.setPen(pen)
-            painter.drawRect(self.selection)
-        else:
-            # 未选区时轻微暗化
-            painter.fillRect(self.rect(), QtGui.QColor(0, 0, 0, 80))
-
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.origin = event.pos()
-            self.selection = None
-            self.update()
-        elif event.button() == Qt.RightButton:
-            # 右键取消截图
-            self.cancelled.emit()
-            self.close()
-
-    def mouseMoveEvent(self, event):
-        if self.origin:
-            self.selection = QtCore.QRect(self.origin, event.pos()).normalized()
-            self.update()
-
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            if self.selection and self.selection.width() > 10 and self.selection.height() > 10:
-                # 选区足够大，裁剪并发出截图信号
-                cropped = self.screen_pixmap.copy(self.selection)
-                self.captured.emit(cropped)
-            else:
-                # 选区过小，视为取消
-                self.cancelled.emit()
-            self.close()
-
-    def keyPressEvent(self, event):
-        if event.key() == Qt.Key_Escape:
-            self.cancelled.emit()
-            self.close()
-
-
-def create_recognizer(recognizer_type, api_key, api_base=None, model_name=None):
-    """工厂方法：根据识别器类型创建对应的识别器实例"""
-    recognizer_type = recognizer_type.lower()
-    if recognizer_type == 'gemini':
-        return GeminiFormulaRecognizer(api_key, model_name=model_name)
-    elif recognizer_type in ('openai', 'gpt'):
-        return OpenAIVisionRecognizer(api_key, api_base, model_name=model_name)
-    elif recognizer_type == 'ifly':
-        raise NotImplementedError("讯飞API识别尚未实现")
-    elif recognizer_type == 'glm':
-        return GLMFormulaRecognizer(api_key, api_base, model_name=model_name)
-    else:
-        raise ValueError(f"未知的识别器类型: {recognizer_type}")
+# 流式识别时公式预览的最短刷新间隔（毫秒）
+STREAM_PREVIEW_INTERVAL_MS = 800
+# 手动编辑 LaTeX 时的实时预览：停止输入后多久渲染，连续输入时最长多久渲染一次（毫秒）
+EDIT_PREVIEW_DEBOUNCE_MS = 250
+EDIT_PREVIEW_MAX_WAIT_MS = 1000
 
 
 class OcrWorker(QObject):
     """OCR 工作线程，负责在后台执行耗时的网络请求"""
-    success = pyqtSignal(str)
+    success = pyqtSignal(str, str)  # (LaTeX, 结果来源 'api' / 'cache' / 'reused')
+    chunk = pyqtSignal(str)  # 流式识别收到的增量文本
+    timing = pyqtSignal(float, float)  # (首个文本块耗时 ms，-1 表示非流式；总耗时 ms)
+    provider = pyqtSignal(str)  # 对冲 / 故障切换时实际返回结果的 section
     error = pyqtSignal(str)
+    cancelled = pyqtSignal()  # 识别被取消（用户取消或被新的截图取代）
 
-    def __init__(self, img_path, section_name, conf):
+    def __init__(self, img_path, section_name, conf, cache=None, limiter_store=None):
         super().__init__()
         self.img_path = img_path
         self.section_name = section_name
         self.conf = conf
+        self.cache = cache
+        self.limiter_store = limiter_store
+        # 可从主线程调用 cancel_token.cancel()，正在进行的请求与重试等待立即中止
+        self.cancel_token = CancelToken()
 
     def run_ocr(self):
         """在工作线程中执行的函数 — 根据 config.ini section 动态选择识别器"""
         try:
-            section = self.section_name
-            recognizer_type = self.conf.get(section, 'Recognizer', fallback='openai')
-            api_key = self.conf.get(section, 'APIKey', fallback='')
-            api_base = self.conf.get(section, 'APIBase', fallback='')
-            model_name = self.conf.get(section, 'ModelName', fallback='')
-            display_name = self.conf.get(section, 'DisplayName', fallback=section)
-
-            if not api_key:
-                raise ValueError(f"请先配置 {display_name} 的 API Key")
-
-            recognizer = create_recognizer(recognizer_type, api_key, api_base, model_name)
-            result = recognizer.recognize_formula(self.img_path)
-            self.success.emit(result)
-
+            # 从注册表取长生命周期的识别器，连接池在多次识别间复用
+            def get_recognizer(section):
+                return registry.get(self.conf, section, cache=self.cache,
+                                    limiter_store=self.limiter_store)
+
+            # 配置了 [Hedge] 时主模型超时会同时请求备用模型
+            def resolve(section):
+                return hedge_from_config(self.conf, section, get_recognizer) or get_recognizer(section)
+
+            # 配置了 [Failover] 时按切换链依次尝试，跳过熔断中的模型
+            recognizer = (failover_from_config(self.conf, self.section_name, resolve)
+                          or resolve(self.section_name))
+            on_chunk = self.chunk.emit if recognizer.stream else None
+            # 在后台事件循环中执行异步识别，本线程只等待结果，取消时立即返回
+            result = run_cancellable(recognizer, self.img_path, on_chunk, self.cancel_token)
+            if self.cancel_token.cancelled:
+                # 取消前刚好完成的迟到结果直接丢弃
+                raise RecognitionCancelled("识别已取消")
+            if getattr(result, 'total_ms', None) is not None:
+                ttft = result.ttft_ms if result.ttft_ms is not None else -1.0
+                self.timing.emit(ttft, result.total_ms)
+            if getattr(result, 'winner', None):
+                print(f"识别结果由 {result.winner} 返回")
+                self.provider.emit(result.winner)
+            self.success.emit(result, getattr(result, 'source', 'api'))
+
+        except RecognitionCancelled:
+            self.cancelled.emit()
         except Exception as e:
-            self.error.emit(f"识别错误: {str(e)}")
+            if self.cancel_token.cancelled:
+                self.cancelled.emit()
+            else:
+                self.error.emit(f"识别错误: {str(e)}")
 
 
 class ApiTestWorker(QObject):
@@ -163,7 +132,10 @@ class ApiTestWorker(QObject):
     def run_test(self):
         try:
             recognizer = create_recognizer(self.recognizer_type, self.api_key, self.api_base, self.model_name)
-            recognizer.test_connection()
+            try:
+                recognizer.test_connection()
+            finally:
+                recognizer.close()
             self.finished.emit("API连接测试成功!")
 
         except NotImplementedError:
@@ -258,8 +230,8 @@ class SettingsDialog(QDialog):
         self.setMinimumWidth(560)
         self.setStyleSheet(self.DIALOG_STYLE)
 
-        self.thread = None
         self.worker = None
+        self.test_task = None
 
         layout = QVBoxLayout()
         form_layout = QFormLayout()
@@ -480,7 +452,6 @@ class SettingsDialog(QDialog):
         self.save_btn.setEnabled(False)
         self.status_label.setText(f"状态: 正在测试 {display_name} 连接...")
 
-        self.thread = QThread()
         self.worker = ApiTestWorker(
             recognizer_type=recognizer_type,
             api_key=api_key,
@@ -488,15 +459,11 @@ class SettingsDialog(QDialog):
             model_name=self.model_name_edit.text(),
             display_name=display_name
         )
-        self.worker.moveToThread(self.thread)
-
-        self.thread.started.connect(self.worker.run_test)
         self.worker.finished.connect(self.on_test_success)
         self.worker.error.connect(self.on_test_error)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.error.connect(self.thread.quit)
-        self.thread.finished.connect(self.on_thread_finished)
-        self.thread.start()
+        # 在常驻线程池中执行，不再为每次测试创建 QThread
+        self.test_task = worker_pool.submit(self.worker.run_test)
+        self.test_task.finished.connect(self.on_test_finished)
 
     def on_test_success(self, message):
         self.status_label.setText(f"状态: {message}")
@@ -510,21 +477,20 @@ class SettingsDialog(QDialog):
         self.test_btn.setEnabled(True)
         self.save_btn.setEnabled(True)
 
-    def on_thread_finished(self):
-        print("线程已完成，正在清理引用...")
+    def on_test_finished(self):
+        print("连接测试已完成，正在清理引用...")
         if self.worker:
             self.worker.deleteLater()
             self.worker = None
-
-        if self.thread:
-            self.thread.deleteLater()
-            self.thread = None
+        self.test_task = None
 
     def reject(self):
-        if self.thread and self.thread.isRunning():
-            print("用户取消，正在尝试退出线程...")
-            self.thread.quit()
-            self.thread.wait(500)
+        if self.test_task is not None and not self.test_task.done():
+            print("用户取消，忽略尚未返回的连接测试结果...")
+            self.test_task.cancel()
+            # 测试请求无法中断，断开信号使迟到的结果不再回到已关闭的对话框
+            self.worker.finished.disconnect()
+            self.worker.error.disconnect()
         super().reject()
 
 
@@ -542,13 +508,11 @@ class MainWindow(QMainWindow):
         # 绑定按钮事件
         self.ui.uploadButton.clicked.connect(self.upload_image)
         self.ui.screenshotButton.clicked.connect(self.capture_screenshot)
+        self.ui.watchButton.clicked.connect(self.toggle_watch)
         self.ui.settingsButton.clicked.connect(self.open_settings)
-        self.ui.recognize_button.clicked.connect(self.recognize_formula)
+        self.ui.recognize_button.clicked.connect(self._on_recognize_clicked)
         self.ui.copy_button.clicked.connect(self.copy_text)
 
-        # 双击公式预览区复制 LaTeX
-        self.ui.latexWebView.installEventFilter(self)
-
         # 绑定关于菜单事件
         self.ui.helpAction.triggered.connect(self.show_help)
         self.ui.contactAction.triggered.connect(self.show_contact)
@@ -558,25 +522,70 @@ class MainWindow(QMainWindow):
         self.ui.clear_history_btn.clicked.connect(self._clear_history)
 
         # 初始化配置（optionxform=str 保持键名大小写，确保 TitleCase 键名正确读写）
-        self.conf = configparser.ConfigParser()
-        self.conf.optionxform = str
-        self.conf.read(os.path.join(BASE_DIR, 'config.ini'), encoding="utf-8-sig")
+        self.conf = load_config(os.path.join(BASE_DIR, 'config.ini'))
 
         # 动态加载模型下拉框 — 只显示有 API Key 的模型
         self._load_models_from_config()
 
+        # 识别结果缓存（同一张图片重复识别时不再调用 API）
+        self.result_cache = cache_from_config(self.conf, BASE_DIR)
+        # 令牌桶限速状态，与命令行批量识别共享同一额度
+        self.rate_store = store_from_config(self.conf, BASE_DIR)
+
         self.img_path = None
+        # 截图：抓屏器与覆盖层在首次绘制后创建，之后每次截图复用
+        self._screen_capture = None
+        self._overlay = None
+        self._encoder = None
+        self._hotkey = None
+        self._capture_started = None  # (触发方式 'button' / 'hotkey' / 'watch', 触发时刻 perf_counter)
+        self._memory_before_capture = None
+        self._watcher = None  # 监视区域（RegionWatcher），未监视时为 None
+
+        # 识别任务队列：截图 / 粘贴 / 拖拽的图片依次入队，最多 [Queue] Workers 个同时识别；
+        # 常驻线程池多留一个线程给 API 连接测试等其他后台任务
+        workers = max(1, self.conf.getint('Queue', 'Workers', fallback=DEFAULT_WORKERS))
+        worker_pool.resize(workers + 1)
+        self.job_queue = JobQueue(self._create_worker, max_workers=workers, pool=worker_pool, parent=self)
+        self.job_queue.job_added.connect(self._on_job_added)
+        self.job_queue.job_updated.connect(self._on_job_updated)
+        self.job_queue.job_chunk.connect(self._on_job_chunk)
+        self._current_job_id = None  # 编辑框与预览区正在显示的任务（最新提交或在列表中点选的）
+        self._job_items = {}  # 任务 id -> 结果列表项
+        self.ui.job_list.itemClicked.connect(self._on_job_item_clicked)
+        self.ui.job_list.customContextMenuRequested.connect(self._show_job_menu)
+
+        # 流式识别：当前任务累积的增量文本，预览按固定间隔节流刷新
+        self._stream_text = ''
+        self._stream_preview_timer = QtCore.QTimer(self)
+        self._stream_preview_timer.setSingleShot(True)
+        self._stream_preview_timer.setInterval(STREAM_PREVIEW_INTERVAL_MS)
+        self._stream_preview_timer.timeout.connect(self._render_stream_preview)
+
+        # 手动修改编辑框中的 LaTeX 时实时刷新预览：合并连续输入，语法错误时保留上一次正确的公式
+        self._edit_preview_timer = QtCore.QTimer(self)
+        self._edit_preview_timer.setSingleShot(True)
+        self._edit_preview_timer.timeout.connect(self._render_edit_preview)
+        self._edit_first_change = QtCore.QElapsedTimer()
+        self._edit_preview_seq = None
+        self._edit_error_shown = False
+        self.ui.plain_text_edit.textChanged.connect(self._on_text_edited)
 
         # 用于存储原始的高清 Pixmap（图片预览用）
         self.source_pixmap = None
 
-        # 初始公式预览占位
+        # 公式预览（QtWebEngine）在窗口首次绘制后才创建；预览页常驻，MathJax 只加载一次，
+        # 之前的渲染请求由 PreviewEngine 暂存
+        self._first_paint_done = False
+        # 排版结果的 SVG 缓存（内存 + history.json 旁的磁盘文件），浏览历史记录时直接显示
+        self.svg_cache = svg_cache_from_config(self.conf, BASE_DIR)
+        self.preview = PreviewEngine(mathjax_source(BASE_DIR), QtCore.QUrl.fromLocalFile(BASE_DIR + os.sep),
+                                     font_size=self._formula_font_size(), cache=self.svg_cache,
+                                     submit=worker_pool.submit, parent=self)
+        self.preview.rendered.connect(self._on_preview_rendered)
+        self.preview.failed.connect(self._on_preview_failed)
         self.render_latex_preview("")
 
-        # 持有对 OCR 线程的引用
-        self.ocr_thread = None
-        self.ocr_worker = None
-
         # 启用拖拽
         self.setAcceptDrops(True)
 
@@ -596,18 +605,18 @@ class MainWindow(QMainWindow):
             event.acceptProposedAction()
 
     def dropEvent(self, event):
-        """拖拽释放时，加载图片并自动识别"""
+        """拖拽释放时，加载图片并自动识别；一次拖入多个文件时全部加入识别队列"""
         if event.mimeData().hasUrls():
-            for url in event.mimeData().urls():
-                path = url.toLocalFile()
-                if path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                    self._load_image_file(path, auto_recognize=True)
-                    return
+            paths = [url.toLocalFile() for url in event.mimeData().urls()]
+            paths = [p for p in paths if p.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
+            for path in paths:
+                self._load_image_file(path, auto_recognize=True)
+            if paths:
+                return
         if event.mimeData().hasImage():
             pixmap = QtGui.QPixmap.fromImage(event.mimeData().imageData())
             if not pixmap.isNull():
-                self.img_path = os.path.join(BASE_DIR, "clipboard_paste.png")
-                pixmap.save(self.img_path, "PNG")
+                self.img_path = self._save_capture(pixmap, "paste")
                 self.load_image(self.img_path)
                 self.recognize_formula()
 
@@ -619,8 +628,7 @@ class MainWindow(QMainWindow):
             if mime.hasImage():
                 pixmap = QtGui.QPixmap.fromImage(mime.imageData())
                 if not pixmap.isNull():
-                    self.img_path = os.path.join(BASE_DIR, "clipboard_paste.png")
-                    pixmap.save(self.img_path, "PNG")
+                    self.img_path = self._save_capture(pixmap, "paste")
                     self.load_image(self.img_path)
                     self.recognize_formula()
                     return
@@ -755,80 +763,79 @@ class MainWindow(QMainWindow):
         label_font.setPointSize(label_size)
         self.ui.imageLabel.setFont(label_font)
 
-    def _build_mathjax_html(self, latex_str):
-        """生成包含 MathJax 渲染的 HTML 页面（优先本地，离线可用）"""
-        # 转义 HTML 特殊字符
-        escaped = latex_str.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        # 公式预览字号（CSS 变量，不重新排版）
+        if hasattr(self, 'preview'):
+            self.preview.set_font_size(self._formula_font_size())
 
-        # 响应式公式字号
+    def _formula_font_size(self):
+        """响应式公式字号（px）"""
         scale = max(0.8, min(1.6, self.width() / 960))
-        formula_size = max(18, int(28 * scale))
+        return max(18, int(28 * scale))
 
-        # 优先使用本地 MathJax，离线也能渲染
-        local_mathjax = os.path.join(BASE_DIR, 'mathjax', 'tex-svg.js')
-        if os.path.isfile(local_mathjax):
-            mathjax_src = f'file:///{local_mathjax.replace(os.sep, "/")}'
-        else:
-            mathjax_src = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-svg.js'
-
-        return f"""<!DOCTYPE html>
-<html>
-<head>
-<meta charset="utf-8">
-<style>
-  body {{
-    margin: 0; padding: 20px;
-    background: #ffffff;
-    display: flex; align-items: center; justify-content: center;
-    min-height: 100vh;
-    font-family: "Times New Roman", serif;
-  }}
-  .formula {{
-    font-size: {formula_size}px;
-    color: #1a1a2e;
-    text-align: center;
-    padding: 10px;
-  }}
-  .placeholder {{
-    color: #a0a0b8;
-    font-size: 18px;
-    font-family: sans-serif;
-  }}
-</style>
-<script>
-window.MathJax = {{
-  tex: {{
-    inlineMath: [['$', '$']],
-    displayMath: [['$$', '$$']],
-    processEscapes: true
-  }},
-  svg: {{ fontCache: 'global' }},
-  startup: {{
-    ready: () => {{
-      MathJax.startup.defaultReady();
-    }}
-  }}
-}};
-</script>
-<script src="{mathjax_src}" async></script>
-</head>
-<body>
-<div class="formula">${escaped}$</div>
-</body>
-</html>"""
-
-    def render_latex_preview(self, latex_str):
-        """用 MathJax 渲染公式到 WebEngineView"""
-        if not latex_str or not latex_str.strip():
-            self.ui.latexWebView.setHtml(
-                '<html><body style="margin:0;padding:20px;background:#fff;'
-                'display:flex;align-items:center;justify-content:center;min-height:100vh;">'
-                '<div style="color:#a0a0b8;font-size:18px;font-family:sans-serif;">识别结果将在此渲染</div>'
-                '</body></html>'
-            )
+    def render_latex_preview(self, latex_str, draft=False):
+        """在常驻预览页中渲染公式（预览引擎尚未就绪时暂存最新的一个，就绪后再显示）
+
+        draft=True 为流式识别的中间结果，不写入公式 SVG 缓存。
+        """
+        # 识别结果、历史记录等取代编辑框中尚未渲染的修改
+        self._edit_preview_timer.stop()
+        self.preview.render(latex_str, draft=draft)
+
+    def _on_text_edited(self, *args):
+        """编辑框内容变化：只处理用户输入，按 EDIT_PREVIEW_DEBOUNCE_MS 合并后渲染"""
+        # 识别结果、历史记录等由程序写入的文本由各自的流程渲染
+        if not self.ui.plain_text_edit.hasFocus():
+            return
+        job = self._current_job()
+        if job is not None and job.active:
             return
-        html = self._build_mathjax_html(latex_str.strip().strip('$'))
-        self.ui.latexWebView.setHtml(html)
+        if not self._edit_preview_timer.isActive():
+            self._edit_first_change.start()
+            self._edit_preview_timer.start(EDIT_PREVIEW_DEBOUNCE_MS)
+        elif self._edit_first_change.elapsed() < EDIT_PREVIEW_MAX_WAIT_MS - EDIT_PREVIEW_DEBOUNCE_MS:
+            # 重新计时；连续输入超过 EDIT_PREVIEW_MAX_WAIT_MS 时不再推迟，保证预览持续更新
+            self._edit_preview_timer.start(EDIT_PREVIEW_DEBOUNCE_MS)
+
+    def _render_edit_preview(self):
+        self._edit_preview_seq = self.preview.render(self.ui.plain_text_edit.toPlainText(), keep_on_error=True)
+
+    def _on_preview_rendered(self, seq, elapsed_ms):
+        if seq == self._edit_preview_seq and self._edit_error_shown:
+            self._edit_error_shown = False
+            self.ui.Copy_Status_Label.setText("")
+
+    def _on_preview_failed(self, seq, message):
+        """实时预览遇到 LaTeX 语法错误：预览保留上一次的公式，在状态栏提示"""
+        if seq == self._edit_preview_seq:
+            self._edit_error_shown = True
+            self.ui.Copy_Status_Label.setText(f"LaTeX 语法错误：{message}（预览保留上一次的公式）")
+
+    def paintEvent(self, event):
+        """首次绘制之后再初始化公式预览引擎，窗口先显示出来"""
+        super().paintEvent(event)
+        if not self._first_paint_done:
+            self._first_paint_done = True
+            startup_profiler.mark('首次绘制')
+            QtCore.QTimer.singleShot(0, self._init_preview)
+            QtCore.QTimer.singleShot(0, self._init_capture)
+
+    def _init_preview(self):
+        """导入 QtWebEngine 并创建公式预览，加载常驻预览页，就绪后显示暂存的内容"""
+        view = self.ui.init_preview()
+        # 双击公式预览区复制 LaTeX
+        view.installEventFilter(self)
+        self.preview.attach(view)
+        self._prewarm_previews()
+        startup_profiler.finish('公式预览引擎就绪')
+
+    def _prewarm_previews(self):
+        """后台把最近历史记录的公式 SVG 从磁盘读入内存，磁盘上也没有的由预览页空闲时排版"""
+        if self.svg_cache is None:
+            return
+        count = self.conf.getint('Preview', 'Prewarm', fallback=20)
+        latexes = list(dict.fromkeys(normalize_latex(entry['latex']) for entry in self._history[:count]))
+        task = worker_pool.submit(self.svg_cache.preload, latexes)
+        task.succeeded.connect(self.preview.prewarm)
 
     def upload_image(self):
         """处理用户上传图片操作（上传后自动识别）"""
@@ -836,74 +843,170 @@ window.MathJax = {{
         if path:
             self._load_image_file(path, auto_recognize=True)
 
-    def capture_screenshot(self):
-        """截图：抓取所有屏幕拼接为虚拟桌面 → 弹出选区覆盖层 → 用户框选 → 获取截图"""
-        try:
-            # 先最小化窗口，避免截到自身
-            self.setWindowState(QtCore.Qt.WindowMinimized)
-            QtCore.QCoreApplication.processEvents()
-            # 等待窗口最小化完成
-            QtCore.QThread.msleep(200)
-
-            # 拼接所有屏幕为一张完整虚拟桌面截图
-            screens = QApplication.screens()
-            if not screens:
-                self.show()
-                QMessageBox.warning(self, "提示", "截图失败，无法获取屏幕内容")
-                return
+    def _init_capture(self):
+        """创建抓屏器与隐藏待命的覆盖层，注册全局截图热键"""
+        if self._screen_capture is not None:
+            return
+        self._screen_capture = ScreenCapture(self, parent=self)
+        self._screen_capture.grabbed.connect(self._on_screen_grabbed)
+        self._screen_capture.failed.connect(self._on_screen_grab_failed)
+        self._overlay = ScreenshotOverlay()
+        self._overlay.captured.connect(self._on_screenshot_captured)
+        self._overlay.cancelled.connect(self._on_screenshot_cancelled)
+        self._overlay.shown.connect(self._on_overlay_shown)
+        self._overlay.prewarm()
+        # 拖动选区停顿时预先编码上传数据
+        if self.conf.getboolean('Capture', 'Speculate', fallback=True):
+            self._encoder = SpeculativeEncoder(self._overlay, self._speculative_options, parent=self)
+        if self._hotkey is None:
+            self._hotkey = hotkey_from_config(self.conf, self)
+            if self._hotkey is not None:
+                self._hotkey.activated.connect(self._on_capture_hotkey)
+                print(f"全局截图热键: {self._hotkey.sequence}")
+
+    def _speculative_options(self):
+        """当前选中模型的预处理参数，供预编码使用；没有可用模型时不预编码"""
+        section = self._model_sections.get(self.ui.model_selector.currentText(), '')
+        if not section or not self.conf.has_section(section):
+            return None
+        return preprocess_from_config(self.conf, section)
+
+    def _on_capture_hotkey(self):
+        if self._capture_started is None:
+            self._start_capture('hotkey')
 
-            # 计算虚拟桌面总范围
-            min_x = min(s.geometry().x() for s in screens)
-            min_y = min(s.geometry().y() for s in screens)
-            max_x = max(s.geometry().x() + s.geometry().width() for s in screens)
-            max_y = max(s.geometry().y() + s.geometry().height() for s in screens)
-            total_w = max_x - min_x
-            total_h = max_y - min_y
-
-            # 创建空白画布，逐屏绘制
-            self._full_screenshot = QtGui.QPixmap(total_w, total_h)
-            self._full_screenshot.fill(Qt.black)
-            painter = QtGui.QPainter(self._full_screenshot)
-            for screen in screens:
-                geo = screen.geometry()
-                grab = screen.grabWindow(0)
-                # 坐标转换到虚拟桌面
-                painter.drawPixmap(geo.x() - min_x, geo.y() - min_y, grab)
-            painter.end()
-
-            if self._full_screenshot.isNull():
-                self.show()
-                QMessageBox.warning(self, "提示", "截图失败，无法获取屏幕内容")
-                return
+    def capture_screenshot(self):
+        """截图：隐藏窗口 → 抓取光标所在的屏幕 → 弹出选区覆盖层 → 用户框选 → 获取截图"""
+        self._start_capture('button')
 
-            # 弹出选区覆盖层
-            self._overlay = ScreenshotOverlay(self._full_screenshot)
-            self._overlay.captured.connect(self._on_screenshot_captured)
-            self._overlay.cancelled.connect(self._on_screenshot_cancelled)
+    def toggle_watch(self):
+        """监视区域：框选一块屏幕区域，之后内容变化时自动重新识别；监视中再次点击停止"""
+        if self._watcher is not None:
+            self._stop_watch()
+        else:
+            self._start_capture('watch')
 
+    def _start_capture(self, trigger):
+        if self._watcher is not None:
+            # 覆盖层显示期间不检查监视区域
+            self._watcher.pause()
+        try:
+            self._init_capture()
+            self._capture_started = (trigger, time.perf_counter())
+            self._memory_before_capture = resident_memory()
+            # 窗口隐藏后（Hide 事件）再抓屏，避免截到自身
+            self._screen_capture.start()
         except Exception as e:
+            self._capture_started = None
             self.show()
             QMessageBox.critical(self, "错误", f"截图失败: {str(e)}")
 
+    def _on_screen_grabbed(self, pixmap, geometry):
+        """屏幕已抓取：在预先创建好的覆盖层上显示"""
+        self._overlay.begin(pixmap, geometry)
+
+    def _on_overlay_shown(self):
+        """记录从点击按钮 / 按下热键到覆盖层出现的延迟"""
+        if self._capture_started is None:
+            return
+        trigger, started = self._capture_started
+        ms = (time.perf_counter() - started) * 1000
+        capture_stats.record('overlay', ms)
+        if trigger == 'hotkey':
+            capture_stats.record('hotkey', ms)
+            print(f"热键 → 截图覆盖层显示 {ms:.0f}ms")
+
+    def _on_screen_grab_failed(self, message):
+        self._capture_started = None
+        self._resume_watch()
+        self.show()
+        QMessageBox.warning(self, "提示", message)
+
+    def _record_capture_memory(self):
+        """覆盖层已释放整屏截图，记录截图前后的常驻内存"""
+        self._capture_started = None
+        before, after = self._memory_before_capture, resident_memory()
+        capture_stats.record_memory(before, after)
+        if before is not None and after is not None:
+            print(f"常驻内存：截图前 {before / 2**20:.0f}MB → 截图后 {after / 2**20:.0f}MB")
+
     def _on_screenshot_captured(self, pixmap):
-        """选区截图完成回调"""
+        """选区截图完成回调：像素直接在内存中入队识别，PNG 在后台写入历史图片目录"""
+        captured_at = time.perf_counter()
+        watch = self._capture_started is not None and self._capture_started[0] == 'watch'
         self.show()
         self.activateWindow()
         self.setWindowState(QtCore.Qt.WindowActive)
 
-        # 保存到历史图片目录（不会被覆盖，历史记录缩略图可持久化）
+        self.img_path = self._capture_path("watch" if watch else "screenshot")
+        image = pixmap.toImage()
+        # 选区没变时直接使用拖动停顿期间预编码好的上传数据
+        payload = self._encoder.take() if self._encoder is not None else None
+        if payload is None:
+            payload = CapturedImage(image)
+        payload.attach(self.img_path, captured_at)
+        if watch:
+            payload.frame_time = time.time()
+        save_in_background(image, self.img_path)
+        self.source_pixmap = pixmap
+        self.ui.imageLabel.setAlignment(Qt.AlignCenter)
+        self.update_pixmaps()
+        self.recognize_formula(payload)
+        capture_stats.record('handoff', (time.perf_counter() - captured_at) * 1000)
+        self._record_capture_memory()
+        if watch:
+            self._start_watch(image, self._overlay.last_selection)
+        else:
+            self._resume_watch()
+
+    def _start_watch(self, first_frame, rect):
+        """第一帧已入队识别，之后定时只抓取这块区域，内容变化时再识别"""
+        self._watcher = watch_from_config(self.conf, self._screen_capture.screen, rect, parent=self)
+        self._watcher.changed.connect(self._on_watch_changed)
+        self._watcher.start(first_frame)
+        self.ui.watchButton.setText("  ⏹ 停止监视")
+        print(f"开始监视屏幕区域 {rect.width()}x{rect.height()}，每 {self._watcher.interval_ms}ms 检查一次")
+
+    def _stop_watch(self):
+        self._watcher.stop()
+        self._watcher.deleteLater()
+        self._watcher = None
+        self.ui.watchButton.setText("  👁 监视区域")
+        self.ui.Copy_Status_Label.setText("已停止监视区域")
+
+    def _resume_watch(self):
+        if self._watcher is not None:
+            self._watcher.resume()
+
+    def _on_watch_changed(self, image, frame_time):
+        """监视区域内容变化：这一帧直接在内存中入队识别，结果连同帧时间写入历史"""
+        self.img_path = self._capture_path("watch")
+        payload = CapturedImage(image, frame_time=frame_time)
+        payload.attach(self.img_path, None)
+        save_in_background(image, self.img_path)
+        self.source_pixmap = QPixmap.fromImage(image)
+        self.update_pixmaps()
+        self.recognize_formula(payload)
+
+    def _capture_path(self, prefix):
+        """截图 / 粘贴的图片在历史图片目录中的路径，每张一个文件（排队中的任务不会被后来的图片覆盖）"""
         history_dir = os.path.join(BASE_DIR, "history_images")
         os.makedirs(history_dir, exist_ok=True)
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.img_path = os.path.join(history_dir, f"screenshot_{ts}.png")
-        pixmap.save(self.img_path, "PNG")
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(history_dir, f"{prefix}_{ts}.png")
 
-        self.load_image(self.img_path)
-        print(f"截图已保存到: {self.img_path}")
-        self.recognize_formula()
+    def _save_capture(self, pixmap, prefix):
+        """把图片同步保存到历史图片目录，返回路径"""
+        path = self._capture_path(prefix)
+        pixmap.save(path, "PNG")
+        return path
 
     def _on_screenshot_cancelled(self):
         """ESC 取消截图回调 — 恢复窗口"""
+        if self._encoder is not None:
+            self._encoder.discard()
+        self._record_capture_memory()
+        self._resume_watch()
         self.show()
         self.activateWindow()
         self.setWindowState(QtCore.Qt.WindowActive)
@@ -933,95 +1036,281 @@ window.MathJax = {{
         """打开设置对话框，配置API参数和模型选择"""
         dialog = SettingsDialog(self)
         result = dialog.exec_()
+        # 配置改变的模型关闭旧连接池，下次识别时重建
+        registry.invalidate(self.conf)
         # 设置关闭后刷新模型下拉框
         self._load_models_from_config()
 
-    def recognize_formula(self):
-        """根据选择的模型识别公式（启动工作线程）"""
+    def closeEvent(self, event):
+        """退出时关闭所有识别器的连接池并输出复用统计"""
+        print(format_pool_stats(registry.stats()))
+        print(format_hedge_stats(hedge_stats.snapshot()))
+        print(format_breaker_stats(breakers.snapshot()))
+        print(format_worker_stats(worker_pool.stats()))
+        print(format_preview_stats(self.preview.stats()))
+        if self.svg_cache is not None:
+            print(format_svg_cache_stats(self.svg_cache.stats()))
+        print(format_capture_stats(capture_stats.stats(), capture_stats.memory(), capture_stats.counters()))
+        if self._watcher is not None:
+            self._watcher.stop()
+        if self._hotkey is not None:
+            self._hotkey.unregister()
+        if self._overlay is not None:
+            self._overlay.close()
+        self.job_queue.cancel_all()
+        worker_pool.shutdown()
+        registry.close_all()
+        super().closeEvent(event)
+
+    def recognize_formula(self, image=None):
+        """把当前图片加入识别队列（不会打断正在进行的识别）
+
+        image 为内存中的截图（CapturedImage）时直接识别，不等 img_path 写盘。
+        """
         if not self.img_path:
             QMessageBox.warning(self, "提示", "请先上传图片或截图")
             return
 
-        if self.ocr_thread and self.ocr_thread.isRunning():
-            QMessageBox.warning(self, "提示", "正在识别中，请稍候...")
-            return
-
-        self.set_ui_enabled(False)
         model_display = self.ui.model_selector.currentText()
         section_name = self._model_sections.get(model_display, '')
         if not section_name:
             QMessageBox.warning(self, "提示", "请先配置有效的模型 API Key")
-            self.set_ui_enabled(True)
             return
 
-        self.ui.plain_text_edit.setPlainText(f"正在使用 {model_display} 识别...")
-        QApplication.processEvents()
+        # 最新提交的任务接管编辑框与预览区，之前的任务继续在后台完成
+        job = self.job_queue.submit(self.img_path, section_name, model_display, image=image)
+        self._show_job(job)
 
-        self.ocr_thread = QThread()
-        self.ocr_worker = OcrWorker(
-            img_path=self.img_path,
+    def _create_worker(self, img_path, section_name):
+        """JobQueue 的工作对象工厂；img_path 也可以是内存中的图片（ImagePayload）"""
+        return OcrWorker(
+            img_path=img_path,
             section_name=section_name,
-            conf=self.conf
+            conf=self.conf,
+            cache=self.result_cache,
+            limiter_store=self.rate_store
         )
-        self.ocr_worker.moveToThread(self.ocr_thread)
-
-        self.ocr_thread.started.connect(self.ocr_worker.run_ocr)
-        self.ocr_worker.success.connect(self.on_ocr_success)
-        self.ocr_worker.error.connect(self.on_ocr_error)
-
-        self.ocr_worker.success.connect(self.ocr_thread.quit)
-        self.ocr_worker.error.connect(self.ocr_thread.quit)
-        self.ocr_thread.finished.connect(self.on_ocr_finished)
 
-        self.ocr_thread.start()
-
-    def set_ui_enabled(self, enabled: bool):
-        """启用或禁用所有交互式UI元素"""
-        self.ui.uploadButton.setEnabled(enabled)
-        self.ui.screenshotButton.setEnabled(enabled)
-        self.ui.settingsButton.setEnabled(enabled)
-        self.ui.recognize_button.setEnabled(enabled)
-        self.ui.copy_button.setEnabled(enabled)
-        self.ui.model_selector.setEnabled(enabled)
+    def _current_job(self):
+        if self._current_job_id is None:
+            return None
+        return self.job_queue.job(self._current_job_id)
+
+    def _show_job(self, job):
+        """在编辑框、预览区与状态栏显示任务（进行中的任务显示已收到的流式文本）"""
+        self._current_job_id = job.id
+        self._stream_preview_timer.stop()
+        self._stream_text = job.partial if job.status == RUNNING else ''
+        item = self._job_items.get(job.id)
+        if item is not None:
+            self.ui.job_list.setCurrentItem(item)
+
+        if job.status == DONE:
+            self.ui.plain_text_edit.setPlainText(job.result)
+            self.render_latex_preview(job.result)
+        elif job.status == FAILED:
+            self.ui.plain_text_edit.setPlainText(job.error)
+            self.ui.Copy_Status_Label.setText(self._breaker_text().strip())
+        elif job.status == CANCELLED:
+            self.ui.plain_text_edit.setPlainText("识别已取消")
+            self.ui.Copy_Status_Label.setText("识别已取消")
+        elif self._stream_text:
+            self.ui.plain_text_edit.setPlainText(self._stream_text)
+            self._render_stream_preview()
+        else:
+            self.ui.plain_text_edit.setPlainText(f"正在使用 {job.display_name} 识别...")
+            if job.status == QUEUED:
+                ahead = sum(1 for j in self.job_queue.jobs() if j.status == QUEUED and j.id < job.id)
+                self.ui.Copy_Status_Label.setText(
+                    f"已加入识别队列（{self.job_queue.running_count()} 个识别中，前面还有 {ahead} 个排队）")
+        self._update_controls()
+
+    def _on_recognize_clicked(self):
+        """识别按钮：当前任务进行中时用作「取消」"""
+        job = self._current_job()
+        if job is not None and job.active:
+            self._stream_preview_timer.stop()
+            self.job_queue.cancel(job.id)
+        else:
+            self.recognize_formula()
 
-    def on_ocr_success(self, result_latex):
-        """在OCR成功时由信号调用（在主线程上）"""
+    def _update_controls(self):
+        """有任务未结束时禁用设置；上传 / 截图保持可用（新的图片加入队列），当前任务进行中时识别按钮变为取消"""
+        job = self._current_job()
+        busy = job is not None and job.active
+        self.ui.settingsButton.setEnabled(self.job_queue.active_count() == 0)
+        self.ui.copy_button.setEnabled(not busy)
+        self.ui.recognize_button.setText("⏹ 取消识别" if busy else "🚀 识别公式")
+
+    # ====== 识别队列 ======
+
+    def _on_job_added(self, job_id):
+        job = self.job_queue.job(job_id)
+        item = QtWidgets.QListWidgetItem(job.summary())
+        item.setData(Qt.UserRole, job_id)
+        item.setToolTip(job.img_path)
+        self._job_items[job_id] = item
+        # 最新的任务显示在最上面，与历史记录顺序一致
+        self.ui.job_list.insertItem(0, item)
+
+    def _on_job_updated(self, job_id):
+        """任务状态变化：刷新列表项；完成的任务写入历史，当前任务同时更新编辑框与预览"""
+        job = self.job_queue.job(job_id)
+        if job is None:
+            return
+        item = self._job_items.get(job_id)
+        if item is not None:
+            item.setText(job.summary())
+
+        if job.status == DONE:
+            self._add_history(job.result, self._provider_display(job), job.img_path, job.image,
+                              self._similarity_scope(job))
+        if not job.active:
+            # 识别已结束，释放内存中的截图（PNG 已在后台写入 img_path）
+            job.image = None
+
+        if job_id == self._current_job_id:
+            if job.status == DONE:
+                self.on_ocr_success(job)
+            elif job.status == FAILED:
+                self.on_ocr_error(job)
+            elif job.status == CANCELLED:
+                print("识别已取消")
+                self._show_job(job)
+            elif job.status == RUNNING:
+                self.ui.Copy_Status_Label.setText(f"正在使用 {job.display_name} 识别...")
+        elif job.status == FAILED:
+            print(f"任务 #{job.id} 识别失败: {job.error}")
+        self._update_controls()
+
+    def _on_job_chunk(self, job_id, text):
+        """流式识别收到增量文本：只有当前任务追加到编辑框，预览按间隔节流刷新"""
+        if job_id != self._current_job_id:
+            return
+        if not self._stream_text:
+            self.ui.plain_text_edit.clear()
+        self._stream_text += text
+        cursor = self.ui.plain_text_edit.textCursor()
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
+        self.ui.plain_text_edit.setTextCursor(cursor)
+        if not self._stream_preview_timer.isActive():
+            self._stream_preview_timer.start()
+
+    def _on_job_item_clicked(self, item):
+        """点选列表中的任务：显示它的图片与结果，完成的结果同时复制"""
+        job = self.job_queue.job(item.data(Qt.UserRole))
+        if job is None:
+            return
+        if os.path.isfile(job.img_path):
+            self.img_path = job.img_path
+            self.load_image(job.img_path)
+        self._show_job(job)
+        if job.status == DONE:
+            pyperclip.copy(job.result)
+            self.ui.Copy_Status_Label.setText(f"已显示任务 #{job.id} 的结果并复制")
+
+    def _show_job_menu(self, pos):
+        """结果列表右键菜单：复制结果 / 取消任务 / 清除已结束的任务"""
+        item = self.ui.job_list.itemAt(pos)
+        job = self.job_queue.job(item.data(Qt.UserRole)) if item is not None else None
+        menu = QtWidgets.QMenu(self)
+        copy_action = cancel_action = None
+        if job is not None and job.status == DONE:
+            copy_action = menu.addAction("📋 复制结果")
+        if job is not None and job.active:
+            cancel_action = menu.addAction("⏹ 取消任务")
+        clear_action = menu.addAction("🧹 清除已结束的任务")
+        chosen = menu.exec_(self.ui.job_list.mapToGlobal(pos))
+        if chosen is None:
+            return
+        if chosen is copy_action:
+            pyperclip.copy(job.result)
+            self.ui.Copy_Status_Label.setText(f"任务 #{job.id} 的结果已复制")
+        elif chosen is cancel_action:
+            self.job_queue.cancel(job.id)
+        elif chosen is clear_action:
+            self._clear_finished_jobs()
+
+    def _clear_finished_jobs(self):
+        for job_id in self.job_queue.discard_finished():
+            item = self._job_items.pop(job_id, None)
+            if item is not None:
+                self.ui.job_list.takeItem(self.ui.job_list.row(item))
+            if job_id == self._current_job_id:
+                self._current_job_id = None
+        self._update_controls()
+
+    def _render_stream_preview(self):
+        """节流后的中间预览（去掉模型可能输出的 ```latex 代码块标记）"""
+        partial = self._stream_text.replace('```latex', '').replace('```', '').strip()
+        if partial:
+            self.render_latex_preview(partial, draft=True)
+
+    def _provider_display(self, job):
+        """实际返回结果的模型显示名称（未发生切换时为提交任务时选择的模型）"""
+        for display_name, section in self._model_sections.items():
+            if section == job.provider:
+                return display_name
+        return job.display_name
+
+    @staticmethod
+    def _timing_text(job):
+        if job.total_ms is None:
+            return ''
+        if job.ttft_ms is not None:
+            return f"（首字 {job.ttft_ms / 1000:.1f}s，共 {job.total_ms / 1000:.1f}s）"
+        return f"（{job.total_ms / 1000:.1f}s）"
+
+    def on_ocr_success(self, job):
+        """当前任务识别成功（在主线程上）"""
         print("识别成功！")
+        # 最终结果到达后不再需要中间预览
+        self._stream_preview_timer.stop()
+        self._stream_text = ''
+        result_latex = job.result
         self.ui.plain_text_edit.setPlainText(result_latex)
 
         pyperclip.copy(result_latex)
-        self.ui.Copy_Status_Label.setText("识别成功，结果已自动复制！")
+        if job.source in ('cache', 'reused'):
+            if job.source == 'cache':
+                self.ui.Copy_Status_Label.setText("命中缓存，结果已自动复制！")
+            else:
+                self.ui.Copy_Status_Label.setText("相似截图已识别过，已复用结果并复制！")
+            if self.result_cache:
+                stats = self.result_cache.stats()
+                print(f"识别缓存: 命中 {stats['hits']} / 复用 {stats['reused']} / 未命中 {stats['misses']}，"
+                      f"累计节省 {stats['total_hits'] + stats['total_reused']} 次 API 调用")
+        else:
+            provider = self._provider_display(job)
+            switched = f"已切换到 {provider}，" if provider != job.display_name else ''
+            self.ui.Copy_Status_Label.setText(
+                f"{switched}识别成功{self._timing_text(job)}，结果已自动复制！{self._breaker_text()}")
 
         print("正在渲染 LaTeX 公式预览...")
         self.render_latex_preview(result_latex)
-
-        # 保存到历史记录
-        model_display = self.ui.model_selector.currentText()
-        self._add_history(result_latex, model_display, self.img_path or '')
-
-        self.set_ui_enabled(True)
-        self.activateWindow()
-
-    def on_ocr_error(self, error_message):
-        """在OCR失败时由信号调用（在主线程上）"""
-        print(f"识别失败: {error_message}")
-        self.ui.plain_text_edit.setPlainText(error_message)
-        QMessageBox.critical(self, "识别错误", error_message)
-
-        self.set_ui_enabled(True)
+        if self._watcher is None:
+            # 监视区域时不抢焦点，用户可能正在操作被监视的窗口
+            self.activateWindow()
+
+    def _breaker_text(self):
+        """状态栏附加的熔断信息：只列出熔断中或熔断过的模型"""
+        text = format_breaker_stats(breakers.snapshot(), only_tripped=True)
+        return f" [{text}]" if text else ''
+
+    def on_ocr_error(self, job):
+        """当前任务识别失败（在主线程上）；后台任务的失败只显示在结果列表中"""
+        print(f"识别失败: {job.error}")
+        self._stream_preview_timer.stop()
+        self._stream_text = ''
+        self.ui.plain_text_edit.setPlainText(job.error)
+        self.ui.Copy_Status_Label.setText(self._breaker_text().strip())
+        if self._watcher is not None:
+            # 监视区域时不弹出错误框，失败只显示在编辑框与结果列表中
+            return
+        QMessageBox.critical(self, "识别错误", job.error)
         self.activateWindow()
 
-    def on_ocr_finished(self):
-        """在 QThread.finished() 信号发出时调用"""
-        print("OCR 线程已完成，正在清理引用...")
-        if self.ocr_worker:
-            self.ocr_worker.deleteLater()
-            self.ocr_worker = None
-
-        if self.ocr_thread:
-            self.ocr_thread.deleteLater()
-            self.ocr_thread = None
-
     def copy_text(self):
         """复制识别结果到剪贴板"""
         pyperclip.copy(self.ui.plain_text_edit.toPlainText())
@@ -1043,6 +1332,20 @@ window.MathJax = {{
         except Exception:
             self._history = []
         self._refresh_history_combo()
+        self._index_history()
+
+    def _index_history(self):
+        """把带感知哈希的历史记录加入近似图片索引，重新截图同一公式时可直接复用"""
+        if not self.result_cache:
+            return
+        for entry in self._history:
+            # 没有复核缩略图或作用域的旧记录无法确认近似命中，不加入索引
+            if entry.get('phash') and entry.get('aspect') and entry.get('thumb') and entry.get('scope'):
+                try:
+                    self.result_cache.add_similar(int(entry['phash'], 16), entry['aspect'],
+                                                  bytes.fromhex(entry['thumb']), entry['latex'], entry['scope'])
+                except (ValueError, TypeError):
+                    continue
 
     def _save_history(self):
         """持久化历史记录到磁盘（最多保留 100 条）"""
@@ -1053,14 +1356,39 @@ window.MathJax = {{
         except Exception:
             pass
 
-    def _add_history(self, latex, model_name, image_path=''):
-        """添加一条历史记录并刷新下拉框"""
+    def _similarity_scope(self, job):
+        """任务结果在近似索引中的作用域（实际返回结果的模型）；复用近似图片得到的结果不再加入索引"""
+        section = job.provider or job.section
+        if job.source == 'reused' or not self.conf.has_section(section):
+            return None
+        return cache_scope_from_config(self.conf, section)
+
+    def _add_history(self, latex, model_name, image_path='', image=None, scope=None):
+        """添加一条历史记录并刷新下拉框；image 为内存中的截图时直接用它计算感知哈希
+
+        scope 为近似索引的作用域（cache_scope），为 None 时不加入近似索引。
+        监视区域识别的帧另外记下抓到这一帧的时刻 frame_time。
+        """
         entry = {
             'time': datetime.now().strftime('%m-%d %H:%M'),
             'latex': latex,
             'model': model_name,
             'image': image_path
         }
+        frame_time = getattr(image, 'frame_time', None)
+        if frame_time is not None:
+            entry['frame_time'] = datetime.fromtimestamp(frame_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        if scope is not None and (image is not None or (image_path and os.path.isfile(image_path))):
+            try:
+                _, phash, aspect, thumb = image_signatures(image.image() if image is not None else image_path)
+                entry['phash'] = format(phash, 'x')
+                entry['aspect'] = round(aspect, 4)
+                entry['thumb'] = thumb.hex()
+                entry['scope'] = scope
+                if self.result_cache:
+                    self.result_cache.add_similar(phash, aspect, thumb, latex, scope)
+            except Exception:
+                pass
         self._history.insert(0, entry)
         self._save_history()
         self._refresh_history_combo()
@@ -1084,6 +1412,11 @@ window.MathJax = {{
             return
         self._last_history_index = index - 1
         entry = self._history[index - 1]
+        # 编辑框改为显示历史条目，正在进行的任务只在结果列表中更新
+        self._current_job_id = None
+        self._stream_preview_timer.stop()
+        self.ui.job_list.clearSelection()
+        self._update_controls()
         latex = entry['latex']
         self.ui.plain_text_edit.setPlainText(latex)
         self.render_latex_preview(latex)
@@ -1133,12 +1466,18 @@ window.MathJax = {{
             self._cleanup_orphan_history_images()
 
     def _cleanup_orphan_history_images(self):
-        """清理 history_images 目录中不被任何历史记录引用的图片"""
+        """清理 history_images 目录中不被任何历史记录引用的图片
+
+        排队中 / 识别中任务的输入图片与当前显示的图片也在这个目录中，不能删除。
+        """
         history_dir = os.path.join(BASE_DIR, "history_images")
         if not os.path.isdir(history_dir):
             return
-        # 收集历史记录中仍在引用的图片路径
-        referenced = {os.path.normpath(e.get('image', '')) for e in self._history if e.get('image')}
+        # 收集历史记录、未结束的任务与当前图片仍在引用的路径
+        paths = [e.get('image', '') for e in self._history]
+        paths += [job.img_path for job in self.job_queue.jobs() if job.active]
+        paths.append(self.img_path)
+        referenced = {os.path.normpath(path) for path in paths if path}
         try:
             for f in os.listdir(history_dir):
                 fpath = os.path.normpath(os.path.join(history_dir, f))
@@ -1149,7 +1488,13 @@ window.MathJax = {{
 
 
 if __name__ == '__main__':
+    startup_profiler.mark('模块导入完成')
+    # QtWebEngine 在 QApplication 创建之后才导入，需要提前共享 OpenGL 上下文
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
+    startup_profiler.mark('QApplication 创建')
     MainInterface = MainWindow()
+    startup_profiler.mark('主窗口构造完成')
     MainInterface.show()
+    startup_profiler.mark('主窗口显示')
     sys.exit(app.exec_())
@@ -274,7 +274,7 @@ class TestMathJaxHtml(unittest.TestCase):
 
     def test_formula_size_responsive(self):
         """公式字号应根据窗口宽度缩放"""
-        # 模拟 _build_mathjax_html 中的计算
+        # 模拟 MainWindow._formula_font_size 中的计算
         for width, expected_range in [(600, (18, 28)), (960, (22, 36)), (1500, (28, 46))]:
             scale = max(0.8, min(1.6, width / 960))
             formula_size = max(18, int(28 * scale))
@@ -328,6 +328,9 @@ class TestSetupIss(unittest.TestCase):
         # 应有 history 相关清理
         self.assertIn('history.json', content)
         self.assertIn('history_images', content)
+        # 运行时生成的 SQLite 缓存（含 -wal / -shm）
+        for name in ('ocr_cache', 'ratelimit', 'svg_cache'):
+            self.assertIn(f'{{app}}\\{name}.sqlite3*', content)
 
     def test_version_matches(self):
         """setup.iss 版本号应存在"""
@@ -386,5 +389,2621 @@ class TestResponsiveFonts(unittest.TestCase):
         self.assertGreater(action_size, btn_size)
 
 
+class TestResultCache(unittest.TestCase):
+    """验证识别结果持久缓存"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'cache.sqlite3')
+        self.now = [1000.0]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _cache(self, **kwargs):
+        from OCR_Cache import ResultCache
+        return ResultCache(self.db_path, clock=lambda: self.now[0], **kwargs)
+
+    def _save_image(self, name, fmt='PNG', color=(255, 255, 255)):
+        from PIL import Image
+        path = os.path.join(self.tmp_dir, name)
+        img = Image.new('RGB', (40, 20), color)
+        img.putpixel((5, 5), (0, 0, 0))
+        img.save(path, fmt)
+        return path
+
+    def test_hit_and_miss_counters(self):
+        cache = self._cache()
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', r'\frac{1}{2}', 'openai', 'gpt-4o-mini')
+        self.assertEqual(cache.get('k'), r'\frac{1}{2}')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['entries'], 1)
+
+    def test_counters_shared_between_instances(self):
+        """累计统计保存在缓存文件中，多个实例（进程）共享"""
+        a = self._cache()
+        b = self._cache()
+        a.put('k', 'x^2')
+        self.assertEqual(b.get('k'), 'x^2')
+        self.assertEqual(a.stats()['total_hits'], 1)
+        self.assertEqual(a.stats()['hits'], 0)
+
+    def test_age_eviction(self):
+        cache = self._cache(max_age=60)
+        cache.put('k', 'x^2')
+        self.now[0] += 61
+        self.assertIsNone(cache.get('k'))
+
+    def test_entry_limit_evicts_least_recently_used(self):
+        cache = self._cache(max_entries=2)
+        cache.put('a', 'a')
+        self.now[0] += 1
+        cache.put('b', 'b')
+        self.now[0] += 1
+        cache.get('a')  # a 变为最近访问
+        self.now[0] += 1
+        cache.put('c', 'c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a')
+        self.assertEqual(cache.get('c'), 'c')
+
+    def test_size_limit(self):
+        cache = self._cache(max_bytes=10)
+        cache.put('a', 'x' * 8)
+        self.now[0] += 1
+        cache.put('b', 'y' * 8)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'y' * 8)
+
+    def test_fingerprint_ignores_file_format(self):
+        """同一像素内容的 PNG / BMP 应得到相同指纹"""
+        from OCR_Cache import image_fingerprint
+        png = self._save_image('a.png', 'PNG')
+        bmp = self._save_image('a.bmp', 'BMP')
+        other = self._save_image('b.png', 'PNG', color=(250, 250, 250))
+        self.assertEqual(image_fingerprint(png), image_fingerprint(bmp))
+        self.assertNotEqual(image_fingerprint(png), image_fingerprint(other))
+
+    def test_key_depends_on_model_and_prompt(self):
+        from OCR_Cache import make_cache_key
+        base = make_cache_key('fp', 'openai', 'm1', 'prompt')
+        self.assertNotEqual(base, make_cache_key('fp', 'openai', 'm2', 'prompt'))
+        self.assertNotEqual(base, make_cache_key('fp', 'glm', 'm1', 'prompt'))
+        self.assertNotEqual(base, make_cache_key('fp', 'openai', 'm1', 'prompt2'))
+
+    def test_recognizer_hit_skips_api(self):
+        """缓存命中时不应调用 _recognize"""
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('fake-key')
+        r.cache = self._cache()
+        path = self._save_image('f.png')
+        with patch.object(r, '_recognize', return_value=r'E=mc^2') as api:
+            first = r.recognize_formula(path)
+            second = r.recognize_formula(path)
+        self.assertEqual(api.call_count, 1)
+        self.assertEqual(first.source, 'api')
+        self.assertEqual(second.source, 'cache')
+        self.assertEqual(second, r'E=mc^2')
+
+    def test_invalid_result_not_cached(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('fake-key')
+        r.cache = self._cache()
+        path = self._save_image('f.png')
+        with patch.object(r, '_recognize', return_value='ERROR: Non-math content detected') as api:
+            r.recognize_formula(path)
+            r.recognize_formula(path)
+        self.assertEqual(api.call_count, 2)
+
+    def test_cache_disabled_by_config(self):
+        from OCR_Cache import cache_from_config
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'Cache': {'Enabled': 'false'}})
+        self.assertIsNone(cache_from_config(conf, self.tmp_dir))
+        conf.set('Cache', 'Enabled', 'true')
+        self.assertIsNotNone(cache_from_config(conf, self.tmp_dir))
+
+
+class TestPerceptualIndex(unittest.TestCase):
+    """验证感知哈希近似图片复用"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _formula(self, text, offset=(10, 10), bg=255, size=(300, 60)):
+        from PIL import Image, ImageDraw
+        img = Image.new('L', size, bg)
+        ImageDraw.Draw(img).text(offset, text, fill=0)
+        return img
+
+    def test_reselection_and_background_match(self):
+        """选区偏移、背景色变化后哈希应几乎不变"""
+        from OCR_Cache import perceptual_hash, hamming_distance
+        base, aspect = perceptual_hash(self._formula('E = mc^2 + x_1'))
+        shifted, aspect2 = perceptual_hash(self._formula('E = mc^2 + x_1', offset=(13, 8), size=(310, 64)))
+        grey, _ = perceptual_hash(self._formula('E = mc^2 + x_1', bg=225))
+        other, _ = perceptual_hash(self._formula('F = ma + y_2'))
+        self.assertLessEqual(hamming_distance(base, shifted), 4)
+        self.assertLessEqual(hamming_distance(base, grey), 4)
+        self.assertGreater(hamming_distance(base, other), 16)
+        self.assertAlmostEqual(aspect, aspect2, delta=0.1)
+
+    def test_bktree_matches_linear_scan(self):
+        import random
+        from OCR_Cache import BKTree, hamming_distance
+        rng = random.Random(0)
+        keys = [rng.getrandbits(64) for _ in range(500)]
+        tree = BKTree()
+        for i, k in enumerate(keys):
+            tree.add(k, i)
+        probe = keys[7] ^ 0b1011
+        expected = sorted(i for i, k in enumerate(keys) if hamming_distance(k, probe) <= 12)
+        self.assertEqual(sorted(v for _, v in tree.search(probe, 12)), expected)
+        self.assertEqual(len(tree), 500)
+
+    def test_aspect_ratio_guard(self):
+        from OCR_Cache import PerceptualIndex
+        index = PerceptualIndex()
+        index.add(0b1111, 5.0, b'\x0f', 'wide')
+        self.assertEqual(index.find(0b1110, 5.2, b'\x0f', 2), ('wide', 1))
+        self.assertIsNone(index.find(0b1110, 2.0, b'\x0f', 2))
+
+    def _signatures(self, img):
+        from OCR_Cache import image_signatures
+        return image_signatures(img)[1:]
+
+    def test_one_glyph_difference_is_not_reused(self):
+        """感知哈希相近但差一个字符的公式：缩略图复核拒绝近似命中"""
+        from PIL import ImageFont
+        from OCR_Cache import PerceptualIndex, hamming_distance
+        font = ImageFont.load_default(size=28)
+
+        def render(text, offset=(10, 10), bg=255):
+            from PIL import Image, ImageDraw
+            img = Image.new('L', (520, 60), bg)
+            ImageDraw.Draw(img).text(offset, text, fill=0, font=font)
+            return img
+
+        for text, other in (('E = mc^2 + ab + cd + ef', 'E = mc^3 + ab + cd + ef'),
+                            ('x_1+x_2+x_3+x_4+x_5+x_6', 'x_1+x_2+x_3+x_4+x_5+x_8')):
+            index = PerceptualIndex()
+            phash, aspect, thumb = self._signatures(render(text))
+            index.add(phash, aspect, thumb, text, 'openai/m')
+            other_hash, other_aspect, other_thumb = self._signatures(render(other))
+            # 不限制汉明距离：只靠缩略图区分
+            self.assertIsNone(index.find(other_hash, other_aspect, other_thumb, 256, 'openai/m'))
+            # 同一公式重新截图（选区偏移、背景变浅）仍然复用
+            again = self._signatures(render(text, offset=(13, 7), bg=235))
+            self.assertLessEqual(hamming_distance(phash, again[0]), 4)
+            self.assertEqual(index.find(*again, 4, 'openai/m'), (text, hamming_distance(phash, again[0])))
+
+    def test_recognizer_reuses_near_duplicate(self):
+        from OCR_Cache import ResultCache
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        first = os.path.join(self.tmp_dir, 'a.png')
+        second = os.path.join(self.tmp_dir, 'b.png')
+        self._formula('E = mc^2 + x_1').save(first)
+        self._formula('E = mc^2 + x_1', offset=(12, 9), bg=240).save(second)
+
+        r = OpenAICompatibleRecognizer('fake-key')
+        r.cache = ResultCache(os.path.join(self.tmp_dir, 'c.sqlite3'))
+        with patch.object(r, '_recognize', return_value=r'E = mc^2 + x_1') as api:
+            r.recognize_formula(first)
+            reused = r.recognize_formula(second)
+        self.assertEqual(api.call_count, 1)
+        self.assertEqual(reused.source, 'reused')
+        stats = r.cache.stats()
+        self.assertEqual(stats['reused'], 1)
+        # 近似结果不写回精确键
+        self.assertEqual(stats['entries'], 1)
+
+        # 近似索引只在同一模型内查找
+        other = OpenAICompatibleRecognizer('fake-key', model_name='other-model')
+        other.cache = r.cache
+        with patch.object(other, '_recognize', return_value=r'E = mc^2 + x_1') as api:
+            self.assertEqual(other.recognize_formula(second).source, 'api')
+        self.assertEqual(api.call_count, 1)
+
+    def test_threshold_zero_disables_reuse(self):
+        from OCR_Cache import ResultCache
+        cache = ResultCache(os.path.join(self.tmp_dir, 'c.sqlite3'), phash_threshold=0)
+        cache.add_similar(0b1, 1.0, b'\x01', 'x')
+        self.assertIsNone(cache.find_similar(0b1, 1.0, b'\x01'))
+
+    def test_index_loaded_from_disk(self):
+        """新实例应从缓存文件加载感知哈希与缩略图"""
+        from OCR_Cache import ResultCache, cache_scope
+        path = os.path.join(self.tmp_dir, 'c.sqlite3')
+        ResultCache(path).put('k', 'x^2', 'openai', 'm', phash=0xff, aspect=3.0, thumb=b'\xf0')
+        self.assertEqual(ResultCache(path).find_similar(0xfe, 3.0, b'\xf0', cache_scope('openai', 'm')), ('x^2', 1))
+
+    def test_eviction_and_clear_prune_index(self):
+        from OCR_Cache import ResultCache, cache_scope
+        scope = cache_scope('openai', 'm')
+        cache = ResultCache(os.path.join(self.tmp_dir, 'c.sqlite3'), max_entries=1)
+        cache.put('a', 'a', 'openai', 'm', phash=0xf0, aspect=1.0, thumb=b'\x0f')
+        self.assertEqual(cache.find_similar(0xf0, 1.0, b'\x0f', scope), ('a', 0))
+        # 超出数量上限淘汰 a，索引同时删除
+        cache.put('b', 'b', 'openai', 'm', phash=0x0f, aspect=1.0, thumb=b'\xf0')
+        self.assertIsNone(cache.find_similar(0xf0, 1.0, b'\x0f', scope))
+        self.assertEqual(cache.find_similar(0x0f, 1.0, b'\xf0', scope), ('b', 0))
+        cache.clear()
+        self.assertIsNone(cache.find_similar(0x0f, 1.0, b'\xf0', scope))
+
+
+class TestAsyncRecognizer(unittest.TestCase):
+    """验证异步识别接口 arecognize_formula"""
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _completion(content):
+        return {
+            "id": "x", "object": "chat.completion", "created": 0, "model": "m",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+        }
+
+    def _recognizer(self, handler, cls=None):
+        import httpx
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = (cls or OpenAICompatibleRecognizer)('fake.key', base_url='https://api.example.com/v1')
+        r._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return r
+
+    def test_many_concurrent_requests_one_loop(self):
+        """单个事件循环应能并发驱动大量请求（总耗时接近单次请求）"""
+        import asyncio, time, httpx
+
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json=self._completion(r'\alpha'))
+
+        r = self._recognizer(handler)
+
+        async def run():
+            return await asyncio.gather(*[r.arecognize_formula(self.img_path) for _ in range(100)])
+
+        start = time.perf_counter()
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 100)
+        self.assertTrue(all(x == r'\alpha' for x in results))
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_param_downgrade(self):
+        import asyncio, httpx
+        seen = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            seen.append('temperature' in body)
+            if 'temperature' in body:
+                return httpx.Response(400, json={"error": {"message": "unsupported_parameter: temperature"}})
+            return httpx.Response(200, json=self._completion('x^2'))
+
+        r = self._recognizer(handler)
+        self.assertEqual(asyncio.run(r.arecognize_formula(self.img_path)), 'x^2')
+        self.assertEqual(seen, [True, False])
+        self.assertTrue(r._skip_extra_params)
+
+    def test_retry_uses_async_sleep(self):
+        import asyncio, httpx
+        calls = []
+
+        def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                return httpx.Response(503, json={"error": {"message": "upstream overloaded"}})
+            return httpx.Response(200, json=self._completion('y'))
+
+        r = self._recognizer(handler)
+        sleeps = []
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+
+        r.retry_policy.asleep = fake_sleep
+        r.retry_policy.rand = lambda: 0.5
+        self.assertEqual(asyncio.run(r.arecognize_formula(self.img_path)), 'y')
+        self.assertEqual(sleeps, [0.5])
+
+    def test_glm_refreshes_token_for_async_client(self):
+        import asyncio, httpx
+        from OCR_Gemini import GLMFormulaRecognizer
+        auth = []
+
+        def handler(request):
+            auth.append(request.headers['authorization'])
+            return httpx.Response(200, json=self._completion('z'))
+
+        import time
+        r = self._recognizer(handler, GLMFormulaRecognizer)
+        asyncio.run(r.arecognize_formula(self.img_path))
+        r._token_cache = {'token': 'old', 'exp': 0}
+        with patch('OCR_Gemini.time.time', return_value=time.time() + 120):
+            asyncio.run(r.arecognize_formula(self.img_path))
+        self.assertEqual(len(auth), 2)
+        self.assertNotEqual(auth[0], auth[1])
+
+    def test_async_cache_hit(self):
+        import asyncio
+        from OCR_Cache import ResultCache
+        r = self._recognizer(lambda request: None)
+        r.cache = ResultCache(os.path.join(self.tmp_dir, 'c.sqlite3'))
+
+        async def fake(image_path):
+            return 'w'
+
+        with patch.object(r, '_arecognize', side_effect=fake) as api:
+            asyncio.run(r.arecognize_formula(self.img_path))
+            hit = asyncio.run(r.arecognize_formula(self.img_path))
+        self.assertEqual(api.call_count, 1)
+        self.assertEqual(hit.source, 'cache')
+
+
+class TestBatchCli(unittest.TestCase):
+    """验证 python -m latex2ocr batch 命令行批量识别"""
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'sub'))
+        for name in ('a.png', 'b.jpg', 'sub/c.bmp', 'notes.txt'):
+            path = os.path.join(self.tmp_dir, name)
+            if name.endswith('.txt'):
+                open(path, 'w').close()
+            else:
+                Image.new('RGB', (10, 10), 'white').save(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_no_qt_import(self):
+        """命令行入口不应导入 PyQt5"""
+        import subprocess
+        code = "import sys, latex2ocr; print(any(m.startswith('PyQt5') for m in sys.modules))"
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.stdout.strip(), 'False', out.stderr)
+
+    def test_collect_images(self):
+        from latex2ocr import collect_images
+        self.assertEqual(len(collect_images(self.tmp_dir)), 2)
+        self.assertEqual(len(collect_images(self.tmp_dir, recursive=True)), 3)
+        self.assertEqual(len(collect_images(os.path.join(self.tmp_dir, '**', '*.bmp'))), 1)
+
+    def test_percentile(self):
+        from latex2ocr import percentile
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_run_batch_bounded_concurrency(self):
+        import asyncio, io
+        from latex2ocr import run_batch, ResultWriter, summarize
+        state = {'active': 0, 'peak': 0}
+
+        class FakeRecognizer:
+            async def arecognize_formula(self, path):
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+                await asyncio.sleep(0.01)
+                state['active'] -= 1
+                if path.endswith('bad'):
+                    raise RuntimeError('HTTP 429 rate_limit')
+                return 'x^2'
+
+        out = io.StringIO()
+        paths = [f'img{i}' for i in range(20)] + ['img.bad']
+        records = asyncio.run(run_batch(paths, FakeRecognizer(), ResultWriter(out), concurrency=3))
+        self.assertEqual(state['peak'], 3)
+        self.assertEqual(len(out.getvalue().splitlines()), 21)
+        summary = summarize(records, 1.0)
+        self.assertEqual(summary['ok'], 20)
+        self.assertEqual(summary['errors'], {'rate_limited': 1})
+        self.assertEqual(summary['throughput'], 21.0)
+
+    def test_batch_with_hedge_only(self):
+        """--hedge 且未开启故障切换：对冲识别器直接交给 run_batch，结束时同样能关闭"""
+        from latex2ocr import main
+        conf_path = os.path.join(self.tmp_dir, 'config.ini')
+        with open(conf_path, 'w', encoding='utf-8') as f:
+            f.write('[API_A]\nAPIKey = k\n[API_B]\nAPIKey = k\n[Cache]\nEnabled = false\n'
+                    '[RateLimit]\nShared = false\n')
+        out_path = os.path.join(self.tmp_dir, 'out.jsonl')
+
+        from OCR_Gemini import PoolStats
+        from OCR_Registry import RecognizerRegistry
+        from OCR_RateLimit import RateLimiter
+        closed = []
+
+        class FakeRecognizer:
+            pool_stats = PoolStats()
+            rate_limiter = RateLimiter()
+
+            def __init__(self, section):
+                self.model_name = section
+
+            async def arecognize_formula(self, path):
+                return 'z'
+
+            async def aclose(self):
+                closed.append(self.model_name)
+
+        registry = RecognizerRegistry(factory=lambda conf, section, **kwargs: FakeRecognizer(section))
+        with patch('latex2ocr.registry', registry):
+            rc = main(['batch', self.tmp_dir, '-c', conf_path, '-o', out_path, '--model', 'API_A',
+                       '--hedge', 'API_B'])
+        self.assertEqual(rc, 0)
+        with open(out_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['winner'] for r in records], ['API_A', 'API_A'])
+        self.assertEqual(sorted(closed), ['API_A', 'API_B'])
+
+    def test_csv_output(self):
+        import io, csv as csv_mod
+        from latex2ocr import ResultWriter
+        out = io.StringIO()
+        ResultWriter(out, 'csv').write({'path': 'a.png', 'status': 'ok', 'latex': 'a,b', 'latency_ms': 1})
+        rows = list(csv_mod.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(rows[0]['latex'], 'a,b')
+
+    def test_rate_option(self):
+        """--rate 覆盖 section 配置的限速"""
+        import configparser
+        from OCR_RateLimit import rate_limiter_from_config
+        conf = configparser.ConfigParser()
+        conf.read_dict({'API_Test': {'APIKey': 'k', 'RateLimit': '2/10'}})
+        self.assertAlmostEqual(rate_limiter_from_config(conf, 'API_Test').rate, 0.2)
+        self.assertAlmostEqual(rate_limiter_from_config(conf, 'API_Test', rate='60/60').rate, 1.0)
+
+    def test_invalid_rate(self):
+        """RateLimit / --rate 格式错误时给出带配置项名称的 ValueError，命令行以退出码 1 结束"""
+        import configparser, io, contextlib
+        from OCR_RateLimit import parse_rate, rate_limiter_from_config
+        from latex2ocr import main
+        self.assertEqual(parse_rate(' 10 / 60 '), (10, 60.0))
+        self.assertIsNone(parse_rate(''))
+        conf = configparser.ConfigParser()
+        for bad in ('10', '10/0', 'abc', '0/60', '-1/60'):
+            conf.read_dict({'API_Test': {'APIKey': 'k', 'RateLimit': bad}})
+            with self.assertRaisesRegex(ValueError, r'\[API_Test\] RateLimit'):
+                rate_limiter_from_config(conf, 'API_Test')
+        with self.assertRaisesRegex(ValueError, '--rate'):
+            rate_limiter_from_config(conf, 'API_Test', rate='x/y')
+
+        conf_path = os.path.join(self.tmp_dir, 'config.ini')
+        with open(conf_path, 'w', encoding='utf-8') as f:
+            f.write('[API_Test]\nAPIKey = k\nRateLimit = 10/0\n[Cache]\nEnabled = false\n'
+                    '[RateLimit]\nShared = false\n')
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            rc = main(['batch', self.tmp_dir, '-c', conf_path])
+        self.assertEqual(rc, 1)
+        self.assertIn('[API_Test] RateLimit = 10/0', err.getvalue())
+
+    def test_main_writes_jsonl(self):
+        from latex2ocr import main
+        conf_path = os.path.join(self.tmp_dir, 'config.ini')
+        with open(conf_path, 'w', encoding='utf-8') as f:
+            # 限速状态文件放在临时目录，不写到仓库根目录
+            f.write('[API_Test]\nAPIKey = k\nRecognizer = openai\n[Cache]\nEnabled = false\n'
+                    f'[RateLimit]\nPath = {os.path.join(self.tmp_dir, "ratelimit.sqlite3")}\n')
+        out_path = os.path.join(self.tmp_dir, 'out.jsonl')
+
+        from OCR_Gemini import PoolStats
+        from OCR_Registry import RecognizerRegistry
+        from OCR_RateLimit import RateLimiter
+
+        class FakeRecognizer:
+            pool_stats = PoolStats()
+            rate_limiter = RateLimiter()
+
+            async def arecognize_formula(self, path):
+                return 'y'
+
+            async def aclose(self):
+                pass
+
+        registry = RecognizerRegistry(factory=lambda conf, section, **kwargs: FakeRecognizer())
+        with patch('latex2ocr.registry', registry):
+            rc = main(['batch', self.tmp_dir, '-c', conf_path, '-o', out_path])
+        self.assertEqual(rc, 0)
+        with open(out_path, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([r['latex'] for r in lines], ['y', 'y'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'ratelimit.sqlite3')))
+
+
+class TestConnectionPool(unittest.TestCase):
+    """验证识别器连接池复用与注册表生命周期"""
+
+    @classmethod
+    def setUpClass(cls):
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        body = json.dumps(TestAsyncRecognizer._completion(r'\beta')).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}/v1'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _conf(self, model='m1'):
+        import configparser
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'API_Test': {'Recognizer': 'openai', 'APIKey': 'k',
+                                     'APIBase': self.base_url, 'ModelName': model}})
+        return conf
+
+    def test_sync_requests_reuse_connection(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('k', base_url=self.base_url)
+        for _ in range(5):
+            self.assertEqual(r.recognize_formula(self.img_path), r'\beta')
+        stats = r.pool_stats.snapshot()
+        r.close()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertAlmostEqual(stats['reuse_rate'], 0.8)
+
+    def test_async_requests_reuse_connection(self):
+        import asyncio
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('k', base_url=self.base_url)
+
+        async def run():
+            for _ in range(4):
+                await r.arecognize_formula(self.img_path)
+            await r.aclose()
+
+        asyncio.run(run())
+        stats = r.pool_stats.snapshot()
+        self.assertEqual((stats['requests'], stats['connections']), (4, 1))
+
+    def test_glm_token_refresh_keeps_pool(self):
+        from OCR_Gemini import GLMFormulaRecognizer
+        r = GLMFormulaRecognizer('id.secret', base_url=self.base_url)
+        r.recognize_formula(self.img_path)
+        r._token_cache['exp'] = 0
+        r.recognize_formula(self.img_path)
+        stats = r.pool_stats.snapshot()
+        r.close()
+        self.assertEqual((stats['requests'], stats['connections']), (2, 1))
+
+    def test_registry_reuse_and_invalidate(self):
+        from OCR_Registry import RecognizerRegistry
+        registry = RecognizerRegistry()
+        conf = self._conf()
+        first = registry.get(conf, 'API_Test')
+        self.assertIs(registry.get(conf, 'API_Test'), first)
+        self.assertEqual(registry.invalidate(conf), [])
+
+        changed = self._conf('m2')
+        self.assertEqual(registry.invalidate(changed), ['API_Test'])
+        second = registry.get(changed, 'API_Test')
+        self.assertIsNot(second, first)
+        self.assertTrue(first._http_client.is_closed)
+
+        stats = registry.stats()
+        self.assertEqual((stats['created'], stats['reused']), (2, 1))
+        registry.close_all()
+        self.assertTrue(second._http_client.is_closed)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """验证令牌桶限速、Retry-After 自适应与多进程共享状态"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.now = [1000.0]
+        self.sleeps = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _limiter(self, calls=2, period=10, store=None, key='API_Test:k'):
+        from OCR_RateLimit import RateLimiter
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now[0] += seconds
+
+        return RateLimiter(key, calls, period, store=store,
+                           clock=lambda: self.now[0], sleep=sleep)
+
+    def test_token_bucket(self):
+        limiter = self._limiter()
+        for _ in range(4):
+            limiter.acquire()
+        # 容量 2，之后每 5 秒补充一个令牌
+        self.assertEqual(self.sleeps, [5, 5])
+
+    def test_unlimited_honors_retry_after(self):
+        limiter = self._limiter(calls=None)
+        self.assertEqual(limiter.acquire(), 0)
+        limiter.penalize(retry_after=3)
+        self.assertEqual(limiter.acquire(), 3)
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_adaptive_scale(self):
+        from OCR_RateLimit import MIN_SCALE
+        limiter = self._limiter()
+        self.assertEqual(limiter.penalize(), 0.5)
+        limiter.acquire()
+        # 速率减半后补充一个令牌需要 10 秒
+        self.assertEqual(self.sleeps, [10])
+        for _ in range(10):
+            limiter.penalize()
+        self.assertEqual(limiter.snapshot()['scale'], MIN_SCALE)
+        for _ in range(20):
+            limiter.record_success()
+        self.assertEqual(limiter.snapshot()['scale'], 1.0)
+
+    def test_shared_sqlite_store(self):
+        """两个进程（两个独立的存储对象）共享同一个令牌桶"""
+        from OCR_RateLimit import SQLiteBucketStore
+        path = os.path.join(self.tmp_dir, 'ratelimit.sqlite3')
+        first = self._limiter(store=SQLiteBucketStore(path))
+        second = self._limiter(store=SQLiteBucketStore(path))
+        self.assertEqual(first.reserve(), 0)
+        self.assertEqual(second.reserve(), 0)
+        self.assertEqual(first.reserve(), 5)
+        second.penalize(retry_after=30)
+        self.assertEqual(first.snapshot()['blocked_for'], 30)
+        # 不同 API Key 使用独立的令牌桶
+        other = self._limiter(store=SQLiteBucketStore(path), key='API_Test:other')
+        self.assertEqual(other.reserve(), 0)
+
+    def test_async_wait(self):
+        import asyncio
+        from OCR_RateLimit import RateLimiter
+        waits = []
+
+        async def asleep(seconds):
+            waits.append(seconds)
+
+        # 三个协程同时预订：预支的令牌让等待时间依次排开，无需轮询
+        limiter = RateLimiter('k', 1, 2, clock=lambda: self.now[0], asleep=asleep)
+
+        async def run():
+            await asyncio.gather(*[limiter.aacquire() for _ in range(3)])
+
+        asyncio.run(run())
+        self.assertEqual(sorted(waits), [2, 4])
+
+    def test_acquire_respects_deadline(self):
+        """等待令牌会超过剩余时限时立即失败，且不占用令牌"""
+        import asyncio
+        from OCR_Retry import DeadlineExceeded
+        limiter = self._limiter()
+        limiter.penalize(retry_after=30)
+        with self.assertRaises(DeadlineExceeded):
+            limiter.acquire(timeout=10)
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(limiter.aacquire(timeout=10))
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(limiter.acquire(timeout=40), 30)
+
+    def test_recognizer_passes_deadline_to_limiter(self):
+        """限速等待计入识别总时限：Retry-After 超出剩余时间时不再等待，直接报错"""
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        from OCR_Retry import RetryPolicy, DeadlineExceeded
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r.rate_limiter = self._limiter()
+        r.rate_limiter.penalize(retry_after=60)
+        r.retry_policy = RetryPolicy(deadline=20, clock=lambda: self.now[0])
+        calls = []
+
+        def attempt(state):
+            calls.append(state)
+            yield 'x'
+
+        with self.assertRaises(RuntimeError) as ctx:
+            ''.join(r._retrying(attempt))
+        self.assertIsInstance(ctx.exception.__cause__, DeadlineExceeded)
+        self.assertEqual((calls, self.sleeps), ([], []))
+
+    def test_retry_after_parsing(self):
+        import httpx
+        import openai
+        from google.genai import errors
+        from OCR_RateLimit import retry_after_from_error, is_rate_limited
+        request = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+
+        response = httpx.Response(429, headers={'retry-after': '7'}, request=request)
+        err = openai.RateLimitError('rate limited', response=response, body=None)
+        self.assertTrue(is_rate_limited(err))
+        self.assertEqual(retry_after_from_error(err), 7)
+
+        response = httpx.Response(429, headers={'retry-after-ms': '1500'}, request=request)
+        self.assertEqual(retry_after_from_error(openai.RateLimitError('x', response=response, body=None)), 1.5)
+
+        response = httpx.Response(
+            429, headers={'retry-after': 'Wed, 21 Oct 2026 07:28:10 GMT'}, request=request)
+        err = openai.RateLimitError('x', response=response, body=None)
+        from email.utils import parsedate_to_datetime
+        now = parsedate_to_datetime('Wed, 21 Oct 2026 07:28:00 GMT').timestamp()
+        self.assertEqual(retry_after_from_error(err, now=now), 10)
+
+        err = errors.ClientError(429, {'error': {
+            'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'quota',
+            'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '17s'}],
+        }})
+        self.assertTrue(is_rate_limited(err))
+        self.assertEqual(retry_after_from_error(err), 17)
+        self.assertIsNone(retry_after_from_error(RuntimeError('boom')))
+
+    def test_recognizer_waits_for_retry_after(self):
+        """429 + Retry-After：由限速器等待，而不是固定退避"""
+        import asyncio, httpx
+        from PIL import Image
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        from OCR_RateLimit import RateLimiter
+        img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(img_path)
+        calls = []
+
+        def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                return httpx.Response(429, headers={'retry-after': '4'},
+                                      json={"error": {"message": "rate_limit"}})
+            return httpx.Response(200, json=TestAsyncRecognizer._completion('x^2'))
+
+        waits = []
+
+        async def asleep(seconds):
+            waits.append(seconds)
+            self.now[0] += seconds
+
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r.rate_limiter = RateLimiter('k', clock=lambda: self.now[0], asleep=asleep)
+        r._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            # 关闭 SDK 自带的重试，让 429 直接交给识别器处理
+            r._aclient = r._async_client().with_options(max_retries=0)
+            return await r.arecognize_formula(img_path)
+
+        self.assertEqual(asyncio.run(run()), 'x^2')
+        self.assertEqual(waits, [4])
+        self.assertEqual(r.rate_limiter.snapshot()['scale'], 0.6)
+
+
+class TestPreprocess(unittest.TestCase):
+    """验证上传前的图片预处理流程"""
+
+    def setUp(self):
+        from PIL import Image, ImageDraw
+        self.tmp_dir = tempfile.mkdtemp()
+        # 大片留白中间一小块公式
+        img = Image.new('RGB', (3840, 1600), (250, 250, 250))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((1800, 700, 2100, 760), fill=(20, 20, 20))
+        draw.line((1800, 800, 2100, 820), fill=(60, 60, 60), width=3)
+        self.img_path = os.path.join(self.tmp_dir, 'big.png')
+        img.save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _open(self, data):
+        from io import BytesIO
+        from PIL import Image
+        return Image.open(BytesIO(data))
+
+    def test_trim_and_margin(self):
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        data, report = preprocess_image(self.img_path, PreprocessOptions(margin=8))
+        img = self._open(data)
+        self.assertEqual(img.size, (301 + 16, 122 + 16))
+        # 默认不量化，保留 8 位灰度
+        self.assertEqual(img.mode, 'L')
+        self.assertEqual(report.size_before, (3840, 1600))
+        self.assertLess(report.bytes_after, report.bytes_before)
+        self.assertGreaterEqual(report.elapsed_ms, 0)
+
+    def test_palette_is_opt_in(self):
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        self.assertEqual(PreprocessOptions.for_provider('gemini').colors, 0)
+        data, _ = preprocess_image(self.img_path, PreprocessOptions(colors=16))
+        img = self._open(data)
+        self.assertEqual(img.mode, 'P')
+        self.assertLessEqual(len(img.getcolors()), 16)
+
+    def test_cap_longest_side(self):
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        data, _ = preprocess_image(self.img_path, PreprocessOptions(trim=False, max_side=1024, margin=0))
+        self.assertEqual(self._open(data).size, (1024, 427))
+
+    def test_threshold_one_bit(self):
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        data, _ = preprocess_image(self.img_path, PreprocessOptions(threshold=True))
+        img = self._open(data)
+        self.assertEqual(img.mode, '1')
+        # 四角为补充的白色边距
+        self.assertEqual(img.getpixel((0, 0)), 255)
+
+    def test_dark_background_inverted(self):
+        from PIL import Image, ImageDraw
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        img = Image.new('RGB', (400, 200), (30, 30, 30))
+        ImageDraw.Draw(img).line((100, 100, 300, 100), fill=(230, 230, 230), width=3)
+        data, _ = preprocess_image(img, PreprocessOptions(threshold=True, margin=4))
+        out = self._open(data).convert('L')
+        self.assertEqual(out.getpixel((0, 0)), 255)
+        self.assertEqual(out.getextrema(), (0, 255))
+
+    def test_disabled_keeps_image(self):
+        from OCR_Preprocess import preprocess_image, PreprocessOptions
+        data, report = preprocess_image(self.img_path, PreprocessOptions(enabled=False))
+        self.assertEqual(self._open(data).size, (3840, 1600))
+        self.assertEqual(report.size_after, (3840, 1600))
+
+    def test_options_from_config(self):
+        import configparser
+        from OCR_Preprocess import options_from_config
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'Preprocess': {'Colors': '0', 'Threshold': 'true'},
+                        'API_GLM': {'Threshold': 'false', 'MaxSide': '1000'}})
+        options = options_from_config(conf, 'API_GLM', 'glm')
+        self.assertEqual((options.colors, options.threshold, options.max_side), (0, False, 1000))
+        options = options_from_config(conf, 'API_Gemini', 'gemini')
+        self.assertEqual((options.threshold, options.max_side, options.sharpen), (True, 3072, True))
+
+    def test_recognizer_uploads_preprocessed_image(self):
+        import asyncio, base64, httpx
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        uploaded = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            url = body['messages'][0]['content'][1]['image_url']['url']
+            uploaded.append(base64.b64decode(url.split(',', 1)[1]))
+            return httpx.Response(200, json=TestAsyncRecognizer._completion('x'))
+
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        asyncio.run(r.arecognize_formula(self.img_path))
+        self.assertEqual(self._open(uploaded[0]).size, (317, 138))
+
+
+class TestImagePayload(unittest.TestCase):
+    """验证识别请求的图片只编码一次，重试与多个模型共用"""
+
+    def setUp(self):
+        from PIL import Image, ImageDraw
+        self.tmp_dir = tempfile.mkdtemp()
+        img = Image.new('RGB', (400, 200), 'white')
+        ImageDraw.Draw(img).line((50, 100, 350, 120), fill='black', width=4)
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        img.save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_prepared_image_immutable(self):
+        from OCR_Preprocess import ImagePayload, PreprocessOptions
+        prepared = ImagePayload(self.img_path).prepare(PreprocessOptions())
+        with self.assertRaises(AttributeError):
+            prepared.data = b''
+        self.assertIs(prepared.base64, prepared.base64)
+        self.assertTrue(prepared.data_url.startswith('data:image/png;base64,'))
+
+    def test_sources_equivalent(self):
+        from PIL import Image
+        from OCR_Preprocess import ImagePayload, PreprocessOptions
+        options = PreprocessOptions()
+        with open(self.img_path, 'rb') as f:
+            raw = f.read()
+        with Image.open(self.img_path) as img:
+            img.load()
+            results = {ImagePayload(s).prepare(options).data for s in (self.img_path, raw, img)}
+        self.assertEqual(len(results), 1)
+
+    def test_prepare_memoized_per_options(self):
+        import OCR_Preprocess
+        from OCR_Preprocess import ImagePayload, PreprocessOptions
+        payload = ImagePayload(self.img_path)
+        with patch('OCR_Preprocess._encode_prepared', wraps=OCR_Preprocess._encode_prepared) as enc:
+            first = payload.prepare(PreprocessOptions())
+            self.assertIs(payload.prepare(PreprocessOptions()), first)
+            payload.prepare(PreprocessOptions(threshold=True))
+        self.assertEqual(enc.call_count, 2)
+
+    def test_retries_reuse_payload(self):
+        """重试与参数降级不再重新编码图片，两个识别器共用同一 payload"""
+        import asyncio, httpx
+        import OCR_Preprocess
+        from OCR_Gemini import OpenAICompatibleRecognizer, GLMFormulaRecognizer
+        from OCR_Preprocess import ImagePayload
+        state = {'n': 0}
+        urls = set()
+
+        def handler(request):
+            state['n'] += 1
+            body = json.loads(request.content)
+            urls.add(body['messages'][0]['content'][1]['image_url']['url'])
+            if state['n'] == 1:
+                return httpx.Response(400, json={"error": {"message": "unsupported_parameter: temperature"}})
+            if state['n'] == 2:
+                return httpx.Response(503, json={"error": {"message": "upstream overloaded"}})
+            return httpx.Response(200, json=TestAsyncRecognizer._completion('x'))
+
+        payload = ImagePayload(self.img_path)
+        recognizers = [cls('id.secret', base_url='https://api.example.com/v1')
+                       for cls in (OpenAICompatibleRecognizer, GLMFormulaRecognizer)]
+        async def no_sleep(seconds):
+            pass
+
+        for r in recognizers:
+            r._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            r.retry_policy.asleep = no_sleep
+
+        async def run():
+            return [await r.arecognize_formula(payload) for r in recognizers]
+
+        with patch('OCR_Preprocess._encode_prepared', wraps=OCR_Preprocess._encode_prepared) as enc:
+            self.assertEqual(asyncio.run(run()), ['x', 'x'])
+        self.assertEqual(enc.call_count, 1)
+        self.assertEqual(len(urls), 1)
+
+
+class TestStreaming(unittest.TestCase):
+    """验证流式识别：逐段回调、首字耗时与重试规则"""
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _sse(pieces):
+        lines = []
+        for piece in pieces:
+            chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            lines.append(f"data: {json.dumps(chunk)}\n\n")
+        # 部分服务商最后会发送不含 choices 的用量块
+        lines.append('data: {"id": "x", "object": "chat.completion.chunk", "created": 0, '
+                     '"model": "m", "choices": []}\n\n')
+        lines.append("data: [DONE]\n\n")
+        return ''.join(lines).encode()
+
+    def _handler(self, pieces, fail_first=False):
+        import httpx
+        state = {'n': 0}
+
+        def handler(request):
+            state['n'] += 1
+            body = json.loads(request.content)
+            self.assertTrue(body['stream'])
+            if fail_first and state['n'] == 1:
+                return httpx.Response(503, json={"error": {"message": "upstream overloaded"}})
+            return httpx.Response(200, content=self._sse(pieces),
+                                  headers={'content-type': 'text/event-stream'})
+        return handler, state
+
+    def _sync_recognizer(self, handler):
+        import httpx
+        from openai import OpenAI
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r.client = OpenAI(api_key='k', base_url=r.base_url, max_retries=0,
+                          http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+        return r
+
+    def test_sync_stream_chunks(self):
+        handler, state = self._handler(['E = ', 'mc^2', ' \\\\'], fail_first=True)
+        r = self._sync_recognizer(handler)
+        chunks = []
+        r.retry_policy.sleep = lambda seconds: None
+        result = r.recognize_formula(self.img_path, on_chunk=chunks.append)
+        self.assertEqual(chunks, ['E = ', 'mc^2', ' \\\\'])
+        self.assertEqual(result, 'E = mc^2 \\\\')
+        self.assertEqual(state['n'], 2)
+        self.assertIsNotNone(result.ttft_ms)
+        self.assertLessEqual(result.ttft_ms, result.total_ms)
+
+    def test_non_stream_records_total_time(self):
+        import httpx
+        r = self._sync_recognizer(
+            lambda request: httpx.Response(200, json=TestAsyncRecognizer._completion('x^2')))
+        result = r.recognize_formula(self.img_path)
+        self.assertEqual(result, 'x^2')
+        self.assertIsNone(result.ttft_ms)
+        self.assertGreater(result.total_ms, 0)
+
+    def test_no_retry_after_partial_output(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        attempts = []
+
+        class BrokenStream:
+            def __iter__(self):
+                from types import SimpleNamespace as NS
+                yield NS(choices=[NS(delta=NS(content='x'))])
+                raise ConnectionError('Connection reset')
+
+            def close(self):
+                pass
+
+        def create(**kwargs):
+            attempts.append(1)
+            return BrokenStream()
+
+        r.client = MagicMock()
+        r.client.chat.completions.create = create
+        chunks = []
+        with self.assertRaises(RuntimeError):
+            r.recognize_formula(self.img_path, on_chunk=chunks.append)
+        self.assertEqual((len(attempts), chunks), (1, ['x']))
+
+    def test_async_stream_chunks(self):
+        import asyncio, httpx
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        handler, _ = self._handler(['\\alpha', '+', '\\beta'])
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        chunks = []
+        result = asyncio.run(r.arecognize_formula(self.img_path, on_chunk=chunks.append))
+        self.assertEqual(chunks, ['\\alpha', '+', '\\beta'])
+        self.assertEqual(result, '\\alpha+\\beta')
+
+    def test_gemini_stream_strips_fences(self):
+        from types import SimpleNamespace as NS
+        from OCR_Gemini import GeminiFormulaRecognizer
+        r = GeminiFormulaRecognizer('k')
+        r.client = MagicMock()
+        r.client.models.generate_content_stream.return_value = iter(
+            [NS(text='```latex\n'), NS(text=None), NS(text='\\frac{a}{b}\n```')])
+        chunks = []
+        result = r.recognize_formula(self.img_path, on_chunk=chunks.append)
+        self.assertEqual(result, '\\frac{a}{b}')
+        self.assertEqual(len(chunks), 2)
+
+    def test_cache_hit_emits_single_chunk(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        from OCR_Cache import ResultCache
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r.cache = ResultCache(os.path.join(self.tmp_dir, 'c.sqlite3'))
+        r._stream = lambda payload: iter(['a', 'b'])
+        r.recognize_formula(self.img_path, on_chunk=lambda text: None)
+        chunks = []
+        result = r.recognize_formula(self.img_path, on_chunk=chunks.append)
+        self.assertEqual((result.source, chunks), ('cache', ['ab']))
+
+    def test_ocr_worker_forwards_chunks(self):
+        from main_v108 import OcrWorker
+        from OCR_Gemini import RecognitionResult
+
+        class FakeRecognizer:
+            stream = True
+
+            async def arecognize_formula(self, image, on_chunk=None):
+                for piece in ('a', 'b'):
+                    on_chunk(piece)
+                return RecognitionResult('ab', ttft_ms=5.0, total_ms=9.0)
+
+        from PyQt5.QtCore import Qt
+        worker = OcrWorker('x.png', 'API_Test', None)
+        chunks, timings, results = [], [], []
+        # 文本块在后台事件循环线程中发出
+        worker.chunk.connect(chunks.append, Qt.DirectConnection)
+        worker.timing.connect(lambda *t: timings.append(t))
+        worker.success.connect(lambda *r: results.append(r))
+        with patch('main_v108.registry.get', return_value=FakeRecognizer()):
+            worker.run_ocr()
+        self.assertEqual(chunks, ['a', 'b'])
+        self.assertEqual(timings, [(5.0, 9.0)])
+        self.assertEqual(results, [('ab', 'api')])
+
+
+class TestHedgedRecognizer(unittest.TestCase):
+    """验证对冲请求：超时发备用、先到有效结果胜出、失败方取消"""
+
+    class FakeRecognizer:
+        model_name = 'fake'
+        rate_limiter = None
+
+        def __init__(self, delay, result='x^2', error=None):
+            self.delay = delay
+            self.result = result
+            self.error = error
+            self.calls = 0
+            self.cancelled = False
+
+        async def arecognize_formula(self, image, on_chunk=None):
+            import asyncio
+            from OCR_Gemini import RecognitionResult
+            self.calls += 1
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+            if self.error:
+                raise RuntimeError(self.error)
+            return RecognitionResult(self.result)
+
+    def _hedged(self, primary, secondary, delay=0.05):
+        from OCR_Hedge import HedgedRecognizer, HedgeStats
+        return HedgedRecognizer(primary, secondary, 'A', 'B', delay=delay, stats=HedgeStats())
+
+    def _run(self, hedged):
+        import asyncio
+        return asyncio.run(hedged.arecognize_formula(b'unused'))
+
+    def test_fast_primary_no_hedge(self):
+        primary, secondary = self.FakeRecognizer(0.0, 'a'), self.FakeRecognizer(0.0, 'b')
+        hedged = self._hedged(primary, secondary)
+        result = self._run(hedged)
+        self.assertEqual((result, result.winner, secondary.calls), ('a', 'A', 0))
+
+    def test_slow_primary_hedged_and_cancelled(self):
+        import time
+        primary, secondary = self.FakeRecognizer(5.0, 'a'), self.FakeRecognizer(0.01, 'b')
+        hedged = self._hedged(primary, secondary)
+        start = time.perf_counter()
+        result = self._run(hedged)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual((result, result.winner), ('b', 'B'))
+        self.assertTrue(primary.cancelled)
+        stats = hedged.stats.snapshot()
+        self.assertEqual((stats['A']['wasted'], stats['A']['hedged']), (1, 1))
+        self.assertEqual((stats['B']['wins'], stats['B']['win_rate']), (1, 1.0))
+
+    def test_primary_failure_falls_back_immediately(self):
+        import time
+        primary = self.FakeRecognizer(0.0, error='HTTP 500')
+        secondary = self.FakeRecognizer(0.0, 'b')
+        start = time.perf_counter()
+        result = self._run(self._hedged(primary, secondary, delay=10))
+        self.assertEqual(result, 'b')
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_invalid_result_not_accepted(self):
+        primary = self.FakeRecognizer(0.0, 'ERROR: Non-math content detected')
+        secondary = self.FakeRecognizer(0.0, 'b')
+        self.assertEqual(self._run(self._hedged(primary, secondary)), 'b')
+
+    def test_all_fail(self):
+        primary = self.FakeRecognizer(0.0, error='boom')
+        secondary = self.FakeRecognizer(0.0, error='bang')
+        with self.assertRaises(RuntimeError) as ctx:
+            self._run(self._hedged(primary, secondary))
+        self.assertIn('boom', str(ctx.exception))
+        self.assertIn('bang', str(ctx.exception))
+
+    def test_p95_delay(self):
+        from OCR_Hedge import HedgedRecognizer, HedgeStats
+        stats = HedgeStats()
+        hedged = HedgedRecognizer(None, None, 'A', 'B', delay='p95', default_delay=8,
+                                  min_delay=0.5, stats=stats)
+        self.assertEqual(hedged.hedge_delay(), 8)
+        for seconds in (1, 2, 3, 4, 20):
+            stats.record_latency('A', seconds)
+        self.assertEqual(hedged.hedge_delay(), 20)
+        for _ in range(50):
+            stats.record_latency('A', 0.1)
+        self.assertEqual(hedged.hedge_delay(), 0.5)
+
+    def test_sync_interface(self):
+        primary, secondary = self.FakeRecognizer(5.0, 'a'), self.FakeRecognizer(0.0, 'b')
+        self.assertEqual(self._hedged(primary, secondary).recognize_formula(b'unused'), 'b')
+
+    def test_hedge_from_config(self):
+        from OCR_Hedge import hedge_from_config
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'API_A': {'APIKey': 'k'}, 'API_B': {'APIKey': 'k'},
+                        'Hedge': {'Enabled': 'true', 'Secondary': 'API_B', 'Delay': '2.5'}})
+        hedged = hedge_from_config(conf, 'API_A', lambda section: section)
+        self.assertEqual((hedged.primary, hedged.secondary, hedged.hedge_delay()), ('API_A', 'API_B', 2.5))
+        self.assertIsNone(hedge_from_config(conf, 'API_B', lambda section: section))
+        conf.set('Hedge', 'Enabled', 'false')
+        self.assertIsNone(hedge_from_config(conf, 'API_A', lambda section: section))
+
+
+class TestFailover(unittest.TestCase):
+    """验证熔断器状态转换与故障切换链"""
+
+    class FakeRecognizer:
+        model_name = 'fake'
+        rate_limiter = None
+        stream = False
+
+        def __init__(self, result='x', fail=False, error=None):
+            self.result = result
+            self.fail = fail
+            self.error = error
+            self.calls = 0
+
+        def recognize_formula(self, image, on_chunk=None):
+            self.calls += 1
+            if self.error is not None:
+                raise self.error
+            if self.fail:
+                # 与识别器一样包装原始异常
+                raise RuntimeError('(fake) 识别错误: timed out') from TimeoutError('timed out')
+            from OCR_Gemini import RecognitionResult
+            return RecognitionResult(self.result)
+
+        async def arecognize_formula(self, image, on_chunk=None):
+            return self.recognize_formula(image, on_chunk)
+
+        async def aclose(self):
+            pass
+
+    def setUp(self):
+        self.now = [0.0]
+
+    def _clock(self):
+        return self.now[0]
+
+    def _chain(self, recognizers, threshold=2, cooldown=30):
+        from OCR_Failover import BreakerRegistry, FailoverRecognizer
+        board = BreakerRegistry(clock=self._clock)
+        chain = [(name, board.get(name, threshold, cooldown)) for name in recognizers]
+        return FailoverRecognizer(chain, recognizers.__getitem__), board
+
+    def test_breaker_states(self):
+        from OCR_Failover import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+        breaker = CircuitBreaker('A', failure_threshold=2, cooldown=10, clock=self._clock)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual((breaker.state, breaker.trips), (OPEN, 1))
+        self.assertFalse(breaker.allow())
+        self.now[0] = 10
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # 只放行一个试探请求
+        breaker.record_failure()
+        self.assertEqual((breaker.state, breaker.trips), (OPEN, 2))
+        self.now[0] = 25
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_fails_over_and_skips_open(self):
+        down, backup = self.FakeRecognizer(fail=True), self.FakeRecognizer('b')
+        failover, board = self._chain({'A': down, 'B': backup})
+        for _ in range(2):
+            result = failover.recognize_formula(b'unused')
+            self.assertEqual((result, result.winner), ('b', 'B'))
+        self.assertEqual(board.snapshot()['A']['state'], 'open')
+        failover.recognize_formula(b'unused')
+        self.assertEqual(down.calls, 2)  # 熔断后不再请求
+        self.now[0] = 30
+        down.fail = False
+        down.result = 'a'
+        self.assertEqual(failover.recognize_formula(b'unused').winner, 'A')
+        self.assertEqual(board.snapshot()['A']['state'], 'closed')
+
+    def test_content_errors_do_not_trip_breaker(self):
+        """无效 LaTeX、鉴权失败等错误直接抛出，不计入熔断，也不切换模型"""
+        import asyncio
+        import httpx, openai
+        request = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+        unauthorized = openai.APIStatusError('unauthorized', response=httpx.Response(401, request=request), body=None)
+        for error in (ValueError('Invalid LaTeX format'), RuntimeError('识别错误: 401')):
+            if isinstance(error, RuntimeError):
+                error.__cause__ = unauthorized
+            bad, backup = self.FakeRecognizer(error=error), self.FakeRecognizer('b')
+            failover, board = self._chain({'A': bad, 'B': backup}, threshold=1)
+            for _ in range(3):
+                with self.assertRaises(type(error)):
+                    failover.recognize_formula(b'unused')
+                with self.assertRaises(type(error)):
+                    asyncio.run(failover.arecognize_formula(b'unused'))
+            self.assertEqual(board.snapshot()['A']['state'], 'closed')
+            self.assertEqual((bad.calls, backup.calls), (6, 0))
+
+    def test_all_unavailable(self):
+        import asyncio
+        failover, _ = self._chain({'A': self.FakeRecognizer(fail=True), 'B': self.FakeRecognizer(fail=True)},
+                                  threshold=1)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(failover.arecognize_formula(b'unused'))
+        with self.assertRaises(RuntimeError) as ctx:
+            failover.recognize_formula(b'unused')
+        self.assertIn('熔断中', str(ctx.exception))
+
+    def test_breaker_text(self):
+        from OCR_Failover import format_breaker_stats
+        failover, board = self._chain({'A': self.FakeRecognizer(fail=True), 'B': self.FakeRecognizer()},
+                                      threshold=1)
+        failover.recognize_formula(b'unused')
+        self.now[0] = 5
+        self.assertEqual(format_breaker_stats(board.snapshot(), only_tripped=True), 'A 熔断（25s 后重试），熔断 1 次')
+
+    def test_failover_from_config(self):
+        from OCR_Failover import failover_from_config, BreakerRegistry
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'API_A': {'APIKey': 'k'}, 'API_B': {'APIKey': ''}, 'API_C': {'APIKey': 'k', 'Cooldown': '5'},
+                        'Failover': {'Enabled': 'true', 'Chain': 'API_A, API_B, API_C', 'Cooldown': '90'}})
+        failover = failover_from_config(conf, 'API_C', str, registry=BreakerRegistry())
+        self.assertEqual(failover.sections, ['API_C', 'API_A'])
+        self.assertEqual([b.cooldown for _, b in failover.chain], [5.0, 90.0])
+        conf.set('Failover', 'Enabled', 'false')
+        self.assertIsNone(failover_from_config(conf, 'API_A', str))
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """验证结构化重试：按状态码 / 异常类型判定、full jitter 退避、服务端等待提示与总时限"""
+
+    def setUp(self):
+        self.now = [0.0]
+
+    def _policy(self, **kwargs):
+        from OCR_Retry import RetryPolicy
+        kwargs.setdefault('rand', lambda: 1.0)
+        return RetryPolicy(clock=lambda: self.now[0], **kwargs)
+
+    @staticmethod
+    def _status_error(status, headers=None, message='error'):
+        import httpx, openai
+        request = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+        response = httpx.Response(status, headers=headers or {}, request=request)
+        return openai.APIStatusError(message, response=response, body=None)
+
+    def test_classification_uses_status_not_message(self):
+        import httpx, openai
+        from google.genai import errors
+        from OCR_Retry import is_retryable, DeadlineExceeded
+        self.assertFalse(is_retryable(self._status_error(400, message='upstream 503 at 10.0.0.500')))
+        self.assertFalse(is_retryable(self._status_error(401)))
+        self.assertTrue(is_retryable(self._status_error(429)))
+        self.assertTrue(is_retryable(self._status_error(503)))
+        self.assertTrue(is_retryable(errors.ServerError(500, {'error': {'code': 500, 'message': 'x'}})))
+        self.assertFalse(is_retryable(errors.ClientError(404, {'error': {'code': 404, 'message': 'x'}})))
+        request = httpx.Request('POST', 'https://api.example.com')
+        self.assertTrue(is_retryable(httpx.ReadTimeout('slow', request=request)))
+        self.assertTrue(is_retryable(openai.APIConnectionError(request=request)))
+        self.assertFalse(is_retryable(ValueError('Invalid LaTeX format: timeout 500')))
+        self.assertFalse(is_retryable(DeadlineExceeded('x')))
+
+    def test_full_jitter_backoff(self):
+        draws = iter([1.0, 0.5, 1.0, 1.0])
+        policy = self._policy(retries=4, backoff_base=1, backoff_max=5, deadline=0, rand=lambda: next(draws))
+        state = policy.start()
+        error = self._status_error(503)
+        self.assertEqual([state.next_delay(error) for _ in range(5)], [1, 1, 4, 5, None])
+
+    def test_retry_after_and_deadline(self):
+        from OCR_Retry import DeadlineExceeded
+        state = self._policy(retries=5, deadline=30, read_timeout=60).start()
+        error = self._status_error(429)
+        self.assertEqual(state.next_delay(error, retry_after=12), 12)
+        self.now[0] = 20
+        self.assertEqual(state.timeout().read, 10)
+        self.assertEqual(state.timeout_seconds(), 10)
+        self.assertIsNone(state.next_delay(error, retry_after=12))  # 等待会超出总时限
+        self.now[0] = 30
+        with self.assertRaises(DeadlineExceeded):
+            state.timeout()
+
+    def test_separate_timeouts(self):
+        timeout = self._policy(connect_timeout=3, read_timeout=40, write_timeout=7, deadline=100).start().timeout()
+        self.assertEqual((timeout.connect, timeout.read, timeout.write), (3, 40, 7))
+
+    def test_ratelimit_reset_headers(self):
+        from OCR_RateLimit import retry_after_from_error, parse_reset
+        self.assertEqual(parse_reset('6m0s'), 360)
+        self.assertEqual(parse_reset('250ms'), 0.25)
+        self.assertEqual(parse_reset('1700000030', now=1700000000), 30)
+        self.assertIsNone(parse_reset('soon'))
+        error = self._status_error(429, {'x-ratelimit-reset-requests': '2s', 'x-ratelimit-reset-tokens': '1m30s'})
+        self.assertEqual(retry_after_from_error(error), 90)
+        # 非限流错误不看 x-ratelimit-reset
+        self.assertIsNone(retry_after_from_error(self._status_error(500, {'x-ratelimit-reset': '5'})))
+
+    def test_recognizer_gives_up_at_deadline(self):
+        """服务端一直 503：重试在总时限内结束，不可重试的 400 立即失败"""
+        import httpx
+        from openai import OpenAI
+        from PIL import Image
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        img_path = os.path.join(tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(img_path)
+        calls, sleeps, timeouts = [], [], []
+        status = [503]
+
+        def handler(request):
+            calls.append(1)
+            timeouts.append(request.extensions['timeout']['read'])
+            return httpx.Response(status[0], json={"error": {"message": "busy"}})
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            self.now[0] += seconds
+
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        r.client = OpenAI(api_key='k', base_url=r.base_url, max_retries=0,
+                          http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+        r.retry_policy = self._policy(retries=10, backoff_base=4, backoff_max=8, deadline=15,
+                                      read_timeout=60, sleep=sleep)
+        with self.assertRaises(RuntimeError):
+            r.recognize_formula(img_path)
+        self.assertEqual(sleeps, [4, 8])  # 第三次等待 8s 会超出 15s 总时限
+        self.assertEqual(timeouts, [15, 11, 3])
+
+        calls.clear()
+        status[0] = 400
+        self.now[0] = 0
+        with self.assertRaises(RuntimeError):
+            r.recognize_formula(img_path)
+        self.assertEqual(len(calls), 1)
+
+    def test_shared_retry_loop(self):
+        """_retrying / _aretrying：失败后按策略重试，已产出文本或不可重试时包装为识别器自己的错误"""
+        import asyncio
+        from OCR_Gemini import OpenAICompatibleRecognizer, GeminiFormulaRecognizer
+        r = OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1')
+        sleeps = []
+        r.retry_policy = self._policy(retries=3, backoff_base=1, deadline=0, sleep=sleeps.append)
+        outcomes = iter([self._status_error(503), None])
+
+        def attempt(state):
+            error = next(outcomes)
+            if error is not None:
+                raise error
+            yield 'a'
+            yield 'b'
+
+        self.assertEqual(''.join(r._retrying(attempt)), 'ab')
+        self.assertEqual(sleeps, [1])
+
+        def broken_stream(state):
+            yield 'a'
+            raise self._status_error(503)
+
+        pieces = []
+        with self.assertRaises(RuntimeError) as ctx:
+            pieces.extend(r._retrying(broken_stream))
+        self.assertEqual(pieces, ['a'])
+        self.assertIn('识别错误', str(ctx.exception))
+        self.assertEqual(sleeps, [1])  # 已经输出部分文本，不再重试
+
+        async def rejected(state):
+            raise self._status_error(400)
+            yield
+
+        async def collect(recognizer):
+            return [piece async for piece in recognizer._aretrying(rejected)]
+
+        g = GeminiFormulaRecognizer(None)
+        with self.assertRaises(RuntimeError) as ctx:
+            asyncio.run(collect(g))
+        self.assertIn('API request failed', str(ctx.exception))
+
+    def test_policy_from_config(self):
+        from OCR_Retry import policy_from_config
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'API_A': {'Deadline': '30'}, 'Retry': {'Retries': '4', 'Deadline': '90'}})
+        policy = policy_from_config(conf, 'API_A')
+        self.assertEqual((policy.retries, policy.deadline, policy.read_timeout), (4, 30, 60))
+
+
+class TestCancellation(unittest.TestCase):
+    """验证识别取消：中止进行中的 HTTP 请求与重试等待（延迟 < 100ms），丢弃迟到结果"""
+
+    @classmethod
+    def setUpClass(cls):
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        cls.received = threading.Event()
+        cls.release = threading.Event()
+        cls.mode = ['slow']
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                cls.received.set()
+                if cls.mode[0] == 'slow':
+                    # 模拟迟迟不返回的服务商
+                    cls.release.wait(10)
+                    status = 200
+                else:
+                    status = 503
+                body = json.dumps(TestAsyncRecognizer._completion('late')).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}/v1'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.release.set()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(self.img_path)
+        self.received.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _cancel_latency(self, recognizer, settle=0.0):
+        """后台识别开始请求后取消，返回从 cancel() 到调用方收到 RecognitionCancelled 的秒数"""
+        import threading, time
+        from OCR_Cancel import CancelToken, RecognitionCancelled, run_cancellable
+        token = CancelToken()
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = run_cancellable(recognizer, self.img_path, token=token)
+            except RecognitionCancelled:
+                outcome['cancelled_at'] = time.perf_counter()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.assertTrue(self.received.wait(5))
+        time.sleep(settle)
+        cancel_at = time.perf_counter()
+        token.cancel()
+        thread.join(2)
+        self.assertNotIn('result', outcome)
+        return outcome['cancelled_at'] - cancel_at
+
+    def test_cancel_in_flight_request(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        self.mode[0] = 'slow'
+        r = OpenAICompatibleRecognizer('k', base_url=self.base_url)
+        self.assertLess(self._cancel_latency(r), 0.1)
+
+    def test_cancel_retry_sleep(self):
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        from OCR_Retry import RetryPolicy
+        self.mode[0] = 'error'
+        r = OpenAICompatibleRecognizer('k', base_url=self.base_url)
+        r.retry_policy = RetryPolicy(backoff_base=30, backoff_max=30, deadline=0, rand=lambda: 1.0)
+        self.assertLess(self._cancel_latency(r, settle=0.1), 0.1)
+
+    def test_token_callbacks(self):
+        from OCR_Cancel import CancelToken, RecognitionCancelled
+        token = CancelToken()
+        calls = []
+        token.on_cancel(lambda: calls.append(1))
+        token.cancel()
+        token.cancel()
+        token.on_cancel(lambda: calls.append(2))  # 已取消时立即调用
+        self.assertEqual(calls, [1, 2])
+        with self.assertRaises(RecognitionCancelled):
+            token.raise_if_cancelled()
+
+    def test_worker_discards_late_result(self):
+        from main_v108 import OcrWorker
+
+        worker = OcrWorker('x.png', 'API_Test', None)
+
+        class FakeRecognizer:
+            stream = False
+
+            async def arecognize_formula(self, image, on_chunk=None):
+                # 结果返回前的一瞬间被新的截图取代
+                worker.cancel_token.cancel()
+                return 'late'
+
+        results, cancelled = [], []
+        worker.success.connect(lambda *r: results.append(r))
+        worker.cancelled.connect(lambda: cancelled.append(1))
+        with patch('main_v108.registry.get', return_value=FakeRecognizer()):
+            worker.run_ocr()
+        self.assertEqual((results, cancelled), ([], [1]))
+
+
+class TestJobQueue(unittest.TestCase):
+    """界面识别任务队列：并发上限、状态与耗时、取消、流式文本转发"""
+
+    @classmethod
+    def setUpClass(cls):
+        from PyQt5.QtWidgets import QApplication
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        import threading
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.release = threading.Event()
+
+    def _factory(self, img_path, section):
+        from PyQt5.QtCore import QObject, pyqtSignal
+        from OCR_Cancel import CancelToken
+        test = self
+
+        class FakeWorker(QObject):
+            success = pyqtSignal(str, str)
+            chunk = pyqtSignal(str)
+            timing = pyqtSignal(float, float)
+            provider = pyqtSignal(str)
+            error = pyqtSignal(str)
+            cancelled = pyqtSignal()
+
+            def __init__(self):
+                super().__init__()
+                self.cancel_token = CancelToken()
+                self.cancel_token.on_cancel(test.release.set)
+
+            def run_ocr(self):
+                with test.lock:
+                    test.running += 1
+                    test.peak = max(test.peak, test.running)
+                self.chunk.emit(img_path + ':')
+                test.release.wait(5)
+                with test.lock:
+                    test.running -= 1
+                if self.cancel_token.cancelled:
+                    self.cancelled.emit()
+                elif img_path.startswith('bad'):
+                    self.error.emit('识别错误: boom')
+                else:
+                    self.timing.emit(-1.0, 12.0)
+                    self.success.emit(img_path.upper(), 'api')
+
+        return FakeWorker()
+
+    def _wait(self, queue, timeout=5):
+        import time
+        deadline = time.time() + timeout
+        while (queue.active_count() or queue.running_count()) and time.time() < deadline:
+            self.app.processEvents()
+            time.sleep(0.005)
+        self.assertEqual(queue.active_count(), 0)
+
+    def test_concurrency_status_and_chunks(self):
+        from Job_Queue import JobQueue, DONE, FAILED, RUNNING, QUEUED
+        queue = JobQueue(self._factory, max_workers=2)
+        chunks = []
+        queue.job_chunk.connect(lambda job_id, text: chunks.append((job_id, text)))
+        jobs = [queue.submit(p, 'API_Test') for p in ('a', 'b', 'bad', 'c', 'd')]
+        self.assertEqual([j.status for j in jobs], [RUNNING, RUNNING, QUEUED, QUEUED, QUEUED])
+        self.assertEqual(queue.running_count(), 2)
+        self.release.set()
+        self._wait(queue)
+
+        self.assertLessEqual(self.peak, 2)
+        self.assertEqual([j.status for j in jobs], [DONE, DONE, FAILED, DONE, DONE])
+        self.assertEqual(jobs[0].result, 'A')
+        self.assertEqual(jobs[0].partial, 'a:')
+        self.assertEqual(jobs[0].total_ms, 12.0)
+        self.assertIsNone(jobs[0].ttft_ms)
+        self.assertIn('boom', jobs[2].error)
+        self.assertIn('boom', jobs[2].summary())
+        self.assertTrue(all(j.elapsed_s is not None and j.wait_s >= 0 for j in jobs))
+        self.assertEqual(sorted(chunks), [(j.id, j.img_path + ':') for j in jobs])
+
+    def test_cancel_queued_and_running(self):
+        from Job_Queue import JobQueue, CANCELLED, DONE
+        queue = JobQueue(self._factory, max_workers=1)
+        updates = []
+        queue.job_updated.connect(updates.append)
+        running = queue.submit('a', 'API_Test')
+        queued = queue.submit('b', 'API_Test')
+        self.assertTrue(queue.cancel(queued.id))
+        self.assertEqual(queued.status, CANCELLED)
+        self.assertIsNone(queued.elapsed_s)
+        self.assertTrue(queue.cancel(running.id))
+        self._wait(queue)
+        self.assertEqual(running.status, CANCELLED)
+        self.assertFalse(queue.cancel(running.id))
+        self.assertIn(queued.id, updates)
+
+        # 取消后队列继续处理新的任务；已结束的任务可以清除
+        later = queue.submit('c', 'API_Test')
+        self._wait(queue)
+        self.assertEqual(later.status, DONE)
+        self.assertEqual(sorted(queue.discard_finished()), [running.id, queued.id, later.id])
+        self.assertEqual(queue.jobs(), [])
+
+
+class TestWorkerPool(unittest.TestCase):
+    """常驻线程池：线程复用、主线程信号、排队 / 忙碌统计"""
+
+    @classmethod
+    def setUpClass(cls):
+        from PyQt5.QtWidgets import QApplication
+        cls.app = QApplication.instance() or QApplication([])
+
+    def _drain(self, pool, timeout=5):
+        import time
+        deadline = time.time() + timeout
+        while pool.pending() and time.time() < deadline:
+            self.app.processEvents()
+            time.sleep(0.005)
+        self.assertEqual(pool.pending(), 0)
+
+    def test_threads_are_reused(self):
+        import threading
+        from Worker_Pool import WorkerPool
+        pool = WorkerPool(max_workers=2)
+        idents, results, delivered_in = set(), [], set()
+
+        def task(i):
+            idents.add(threading.get_ident())
+            return i * 2
+
+        def on_result(value):
+            results.append(value)
+            delivered_in.add(threading.get_ident())
+
+        for i in range(20):
+            pool.submit(task, i).succeeded.connect(on_result)
+        self._drain(pool)
+        pool.shutdown()
+        self.assertEqual(sorted(results), [i * 2 for i in range(20)])
+        self.assertLessEqual(len(idents), 2)
+        self.assertEqual(delivered_in, {threading.get_ident()})
+        self.assertEqual(pool.stats()['completed'], 20)
+
+    def test_failure_cancel_and_stats(self):
+        import time
+        import threading
+        from Worker_Pool import WorkerPool, format_worker_stats
+        pool = WorkerPool(max_workers=1)
+        gate = threading.Event()
+        errors, finished = [], []
+
+        def boom():
+            gate.wait(5)
+            raise ValueError('boom')
+
+        first = pool.submit(boom)
+        first.failed.connect(errors.append)
+        while pool.stats()['running'] == 0:
+            time.sleep(0.001)
+        queued = pool.submit(lambda: 'never')
+        queued.finished.connect(lambda: finished.append('queued'))
+        self.assertEqual((pool.stats()['queued'], pool.stats()['peak_queued']), (1, 1))
+        self.assertTrue(queued.cancel())
+        gate.set()
+        self._drain(pool)
+        pool.shutdown()
+
+        stats = pool.stats()
+        self.assertEqual([str(e) for e in errors], ['boom'])
+        self.assertEqual(finished, ['queued'])
+        self.assertEqual((stats['failed'], stats['cancelled'], stats['queued'], stats['running']), (1, 1, 0, 0))
+        self.assertGreater(stats['busy_s'], 0)
+        self.assertIn('峰值 1', format_worker_stats(stats))
+
+    def test_signals_connected_after_fast_task(self):
+        import time
+        from Worker_Pool import WorkerPool
+        pool = WorkerPool(max_workers=1)
+        task = pool.submit(lambda: 'fast')
+        time.sleep(0.05)  # 任务在连接信号之前就已结束
+        got = []
+        task.succeeded.connect(got.append)
+        self._drain(pool)
+        pool.shutdown()
+        self.assertEqual(got, ['fast'])
+
+
+class TestLazyStartup(unittest.TestCase):
+    """冷启动：SDK 与 QtWebEngine 按需导入，--profile-startup 导入耗时统计"""
+
+    def _run(self, code):
+        import subprocess
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=60,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.returncode, 0, out.stderr)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    def test_sdks_imported_on_first_use(self):
+        loaded = self._run(
+            "import sys, json\n"
+            "heavy = ('openai', 'google.genai', 'PyQt5.QtWebEngineWidgets')\n"
+            "import main_v108\n"
+            "before = [m for m in heavy if m in sys.modules]\n"
+            "from OCR_Gemini import create_recognizer\n"
+            "create_recognizer('openai', 'k').close()\n"
+            "print(json.dumps([before, [m for m in heavy if m in sys.modules]]))\n")
+        self.assertEqual(loaded, [[], ['openai']])
+
+    def test_profiler_records_nested_imports(self):
+        from Startup_Profile import StartupProfiler
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        with open(os.path.join(tmp_dir, 'lazy_outer_mod.py'), 'w') as f:
+            f.write("import time\nimport lazy_inner_mod\ntime.sleep(0.01)\n")
+        with open(os.path.join(tmp_dir, 'lazy_inner_mod.py'), 'w') as f:
+            f.write("import time\ntime.sleep(0.02)\n")
+        sys.path.insert(0, tmp_dir)
+        self.addCleanup(sys.path.remove, tmp_dir)
+        self.addCleanup(lambda: [sys.modules.pop(m, None) for m in ('lazy_outer_mod', 'lazy_inner_mod')])
+
+        profiler = StartupProfiler()
+        profiler.start()
+        try:
+            import lazy_outer_mod  # noqa: F401
+            profiler.mark('窗口显示')
+        finally:
+            profiler.stop()
+        rows = {name: (depth, self_s, cumulative) for name, depth, self_s, cumulative in profiler.imports}
+        self.assertEqual(rows['lazy_outer_mod'][0], 0)
+        self.assertEqual(rows['lazy_inner_mod'][0], 1)
+        self.assertGreaterEqual(rows['lazy_inner_mod'][2], 0.02)
+        # 外层模块的自身耗时不含子模块
+        self.assertGreaterEqual(rows['lazy_outer_mod'][2], rows['lazy_inner_mod'][2] + 0.01)
+        self.assertLess(rows['lazy_outer_mod'][1], rows['lazy_outer_mod'][2] - 0.015)
+        report = profiler.report()
+        self.assertIn('窗口显示', report)
+        self.assertIn('lazy_inner_mod', report)
+        import builtins
+        self.assertIsNot(builtins.__import__, profiler._import)
+
+
+class TestRawTransport(unittest.TestCase):
+    """Transport = raw：不经 SDK 直接发送 chat/completions 与 generateContent 请求"""
+
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_path = os.path.join(self.tmp_dir, 'f.png')
+        Image.new('RGB', (20, 10), 'white').save(self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _mock(recognizer, handler):
+        import httpx
+        recognizer._http_client = httpx.Client(transport=httpx.MockTransport(handler))
+        recognizer.client = recognizer._new_client()
+        recognizer._new_async_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        recognizer.retry_policy.sleep = lambda seconds: None
+        return recognizer
+
+    def test_openai_request_and_param_downgrade(self):
+        import httpx
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        bodies = []
+
+        def handler(request):
+            bodies.append(json.loads(request.content))
+            self.assertEqual(str(request.url), 'https://api.example.com/v1/chat/completions')
+            self.assertEqual(request.headers['authorization'], 'Bearer k')
+            if 'temperature' in bodies[-1]:
+                return httpx.Response(400, json={"error": {"code": "unsupported_parameter"}})
+            return httpx.Response(200, json=TestAsyncRecognizer._completion('x^2'))
+
+        r = self._mock(OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1/chat/completions',
+                                                  transport='raw'), handler)
+        r.stream = False
+        self.assertEqual(r.recognize_formula(self.img_path), 'x^2')
+        self.assertEqual(len(bodies), 2)
+        self.assertNotIn('max_tokens', bodies[1])
+        content = bodies[1]['messages'][0]['content']
+        self.assertTrue(content[1]['image_url']['url'].startswith('data:image/png;base64,'))
+
+    def test_openai_stream_retries_429(self):
+        import asyncio, httpx
+        from OCR_Gemini import OpenAICompatibleRecognizer
+        calls = []
+
+        def handler(request):
+            calls.append(request.extensions['timeout']['read'])
+            if len(calls) % 2:
+                return httpx.Response(429, headers={'retry-after': '3'}, json={"error": {"message": "slow down"}})
+            return httpx.Response(200, content=TestStreaming._sse(['a', 'b']),
+                                  headers={'content-type': 'text/event-stream'})
+
+        r = self._mock(OpenAICompatibleRecognizer('k', base_url='https://api.example.com/v1', transport='raw'),
+                       handler)
+        r.rate_limiter = None
+        sleeps = []
+        r.retry_policy.sleep = sleeps.append
+        chunks = []
+        self.assertEqual(r.recognize_formula(self.img_path, on_chunk=chunks.append), 'ab')
+        self.assertEqual((chunks, sleeps, len(calls)), (['a', 'b'], [3.0], 2))
+        self.assertIsNotNone(calls[0])
+
+        async def asleep(seconds):
+            sleeps.append(seconds)
+        r.retry_policy.asleep = asleep
+        self.assertEqual(asyncio.run(r.arecognize_formula(self.img_path, on_chunk=lambda text: None)), 'ab')
+        self.assertEqual(len(calls), 4)
+
+    def test_gemini_request_and_stream(self):
+        import asyncio, httpx
+        from OCR_Gemini import GeminiFormulaRecognizer
+        requests = []
+
+        def event(*parts):
+            return {"candidates": [{"content": {"role": "model", "parts": [{"text": p} for p in parts]}}]}
+
+        def handler(request):
+            requests.append(request)
+            if request.url.params.get('alt') == 'sse':
+                lines = [f"data: {json.dumps(event(piece))}\n\n" for piece in ('\\frac{a}', '{b}')]
+                return httpx.Response(200, content=''.join(lines).encode(),
+                                      headers={'content-type': 'text/event-stream'})
+            thought = {"text": "thinking", "thought": True}
+            body = event('\\alpha')
+            body['candidates'][0]['content']['parts'].insert(0, thought)
+            return httpx.Response(200, json=body)
+
+        r = self._mock(GeminiFormulaRecognizer('gk', transport='raw'), handler)
+        r.rate_limiter = None
+        r.stream = False
+        self.assertEqual(r.recognize_formula(self.img_path), '\\alpha')
+        request = requests[0]
+        self.assertEqual(request.url.path, '/v1beta/models/gemini-2.0-flash:generateContent')
+        self.assertEqual(request.headers['x-goog-api-key'], 'gk')
+        body = json.loads(request.content)
+        parts = body['contents'][0]['parts']
+        self.assertEqual(parts[1]['inlineData']['mimeType'], 'image/png')
+        self.assertEqual(len(body['safetySettings']), 4)
+
+        r.stream = True
+        chunks = []
+        result = asyncio.run(r.arecognize_formula(self.img_path, on_chunk=chunks.append))
+        self.assertEqual((result, chunks), ('\\frac{a}{b}', ['\\frac{a}', '{b}']))
+        self.assertTrue(requests[-1].url.path.endswith(':streamGenerateContent'))
+
+    def test_config_and_no_sdk_import(self):
+        from OCR_Gemini import create_recognizer, recognizer_from_config
+        with self.assertRaises(ValueError):
+            create_recognizer('openai', 'k', transport='grpc')
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_dict({'API_G': {'Recognizer': 'glm', 'APIKey': 'id.secret', 'Transport': 'RAW'}})
+        r = recognizer_from_config(conf, 'API_G')
+        self.addCleanup(r.close)
+        self.assertEqual(r.transport, 'raw')
+        r._token_cache['exp'] = 0
+        r._ensure_token()
+        self.assertEqual(r.client.api_key, r.api_key)
+
+        import subprocess
+        code = ("import sys, json\n"
+                "from OCR_Gemini import create_recognizer\n"
+                "for kind in ('openai', 'gemini', 'glm'):\n"
+                "    create_recognizer(kind, 'k', transport='raw').close()\n"
+                "print(json.dumps([m for m in ('openai', 'google.genai') if m in sys.modules]))\n")
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=60,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(json.loads(out.stdout.strip().splitlines()[-1]), [])
+
+
+class TestPreviewEngine(unittest.TestCase):
+    """常驻 MathJax 预览页：只加载一次，通过 runJavaScript 更新公式并回报渲染耗时"""
+
+    class FakePage:
+        def __init__(self):
+            self.scripts = []
+
+        def runJavaScript(self, script):
+            self.scripts.append(script)
+
+    class FakeView:
+        def __init__(self):
+            self._page = TestPreviewEngine.FakePage()
+            self.loads = []
+
+        def page(self):
+            return self._page
+
+        def setHtml(self, html, base_url):
+            self.loads.append(html)
+
+    def _engine(self):
+        from PyQt5.QtWidgets import QApplication
+        from Preview_Engine import PreviewEngine
+        self.app = QApplication.instance() or QApplication([])
+        self.now = [0.0]
+        engine = PreviewEngine('file:///mathjax/tex-svg.js', clock=lambda: self.now[0])
+        view = self.FakeView()
+        # attach() 需要 QtWebEngine，这里直接接上假视图
+        engine._view = view
+        engine._load()
+        return engine, view
+
+    @staticmethod
+    def _message(**data):
+        from Preview_Engine import MESSAGE_PREFIX
+        return MESSAGE_PREFIX + json.dumps(data)
+
+    def test_renders_latest_after_ready_and_reports_latency(self):
+        engine, view = self._engine()
+        rendered = []
+        engine.rendered.connect(lambda seq, ms: rendered.append((seq, ms)))
+        engine.render('x^2')
+        seq = engine.render('$\\frac{a}{b} "q"$')
+        self.assertEqual(view.page().scripts, [])
+
+        self.now[0] = 0.5
+        self.assertTrue(engine._on_console_message(self._message(event='ready')))
+        self.assertEqual(engine.load_ms, 500)
+        # 就绪前的请求只渲染最新的一个；LaTeX 经 JSON 转义
+        self.assertEqual(view.page().scripts, [f'latex2ocr.render({seq}, "\\\\frac{{a}}{{b}} \\"q\\"", false)'])
+
+        self.now[0] = 0.6
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=40))
+        self.assertEqual(rendered, [(seq, 600)])
+
+        # 渲染中又来了新公式：页面只排版最新的，被跳过的计入 skipped
+        first = engine.render('a')
+        latest = engine.render('b')
+        self.assertEqual(len(view.page().scripts), 3)
+        self.now[0] = 0.65
+        engine._on_console_message(self._message(event='rendered', id=latest, ms=10))
+        self.assertEqual(rendered[-1][0], latest)
+        self.assertAlmostEqual(rendered[-1][1], 50)
+        stats = engine.stats()
+        self.assertEqual((stats['renders'], stats['skipped'], stats['max_ms']), (2, 2, 600))
+        self.assertNotIn(first, engine._sent)
+        self.assertEqual(len(view.loads), 1)
+
+    def test_font_size_errors_and_page(self):
+        engine, view = self._engine()
+        page_html = view.loads[0]
+        self.assertIn('--formula-size: 28px', page_html)
+        self.assertIn('MathJax.typesetPromise', page_html)
+        self.assertIn('file:///mathjax/tex-svg.js', page_html)
+
+        engine.set_font_size(30)  # 页面未就绪：加载完成前只记录字号
+        self.assertEqual(view.page().scripts, [])
+        engine._on_console_message(self._message(event='ready'))
+        engine.set_font_size(30)
+        engine.set_font_size(36)
+        self.assertEqual(view.page().scripts, ['latex2ocr.setFontSize(36)'])
+
+        failures = []
+        engine.failed.connect(lambda seq, message: failures.append((seq, message)))
+        seq = engine.render('\\frac{')
+        engine._on_console_message(self._message(event='error', id=seq, message='Missing close brace'))
+        self.assertEqual(failures, [(seq, 'Missing close brace')])
+        self.assertFalse(engine._on_console_message('Uncaught ReferenceError: foo'))
+
+        # 渲染进程崩溃：重新加载页面，就绪后重新渲染最后一个公式
+        engine._on_render_process_terminated(2, 1)
+        self.assertFalse(engine.is_ready)
+        self.assertEqual(len(view.loads), 2)
+        self.assertIn('--formula-size: 36px', view.loads[1])
+        engine._on_console_message(self._message(event='ready'))
+        self.assertEqual(view.page().scripts[-1], f'latex2ocr.render({seq}, "\\\\frac{{", false)')
+
+    def test_live_edit_keeps_last_good_formula(self):
+        engine, view = self._engine()
+        engine._on_console_message(self._message(event='ready'))
+        self.assertIn('data-mjx-error', view.loads[0])
+        seq = engine.render('\\begin{align} a &= b', keep_on_error=True)
+        self.assertTrue(view.page().scripts[-1].endswith(', true)'))
+        # 内容未变（如程序写回同样的文本）时不重复渲染
+        self.assertEqual(engine.render(' \\begin{align} a &= b ', keep_on_error=True), seq)
+        self.assertEqual(len(view.page().scripts), 1)
+        self.assertNotEqual(engine.render('\\begin{align} a &= b', keep_on_error=False), seq)
+
+    def test_preview_shows_cached_svg_and_prewarms(self):
+        from Render_Cache import SvgCache
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        path = os.path.join(tmp_dir, 'svg_cache.sqlite3')
+        engine, view = self._engine()
+        engine.cache = SvgCache(path)
+        engine.prewarm(['$x^2$', ''])  # 页面未就绪：就绪后再提交
+        self.assertEqual(view.page().scripts, [])
+        engine._on_console_message(self._message(event='ready'))
+        warm_script = view.page().scripts[-1]
+        self.assertTrue(warm_script.startswith('latex2ocr.warm('))
+        warm_id = int(warm_script[len('latex2ocr.warm('):].split(',')[0])
+        engine._on_console_message(self._message(event='warmed', id=warm_id, svg='<svg>x2</svg>'))
+
+        seq = engine.render('x^2')
+        self.assertEqual(view.page().scripts[-1], f'latex2ocr.show({seq}, "<svg>x2</svg>")')
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=0, cached=True))
+
+        # 未命中：排版完成后页面带回 SVG 写入缓存，再次显示时直接使用
+        seq = engine.render('y')
+        self.assertTrue(view.page().scripts[-1].startswith(f'latex2ocr.render({seq}, "y"'))
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=30, svg='<svg>y</svg>'))
+        engine.render('x^2')
+        seq = engine.render('y')
+        self.assertEqual(view.page().scripts[-1], f'latex2ocr.show({seq}, "<svg>y</svg>")')
+        self.assertEqual(SvgCache(path).get('y'), '<svg>y</svg>')
+
+        # 字号只在显示时通过 CSS 变量生效，调整后仍命中同一条缓存
+        engine.set_font_size(40)
+        engine.render('x^2')
+        self.assertEqual(view.page().scripts[-2], 'latex2ocr.setFontSize(40)')
+        self.assertTrue(view.page().scripts[-1].startswith('latex2ocr.show('))
+        stats = engine.stats()
+        self.assertEqual((stats['cached'], stats['warmed']), (1, 1))
+        self.assertEqual(engine.cache.stats()['misses'], 1)
+
+    def test_preview_reads_and_writes_disk_in_background(self):
+        """界面线程只查内存；磁盘读写经 submit 交给后台，读盘期间来了新公式时丢弃旧结果"""
+        from Render_Cache import SvgCache
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        path = os.path.join(tmp_dir, 'svg_cache.sqlite3')
+        SvgCache(path).put('x^2', '<svg>x2</svg>')
+        engine, view = self._engine()
+        engine.cache = SvgCache(path)
+        queued = []
+
+        class Task:
+            def __init__(self, fn, args):
+                self.fn, self.args, self.callbacks = fn, args, []
+                self.succeeded = self
+
+            def connect(self, callback):
+                self.callbacks.append(callback)
+
+            def run(self):
+                result = self.fn(*self.args)
+                for callback in self.callbacks:
+                    callback(result)
+
+        def submit(fn, *args):
+            queued.append(Task(fn, args))
+            return queued[-1]
+
+        engine._submit = submit
+        engine._on_console_message(self._message(event='ready'))
+        seq = engine.render('x^2')
+        self.assertEqual(view.page().scripts, [])  # 等待后台读盘
+        queued.pop(0).run()
+        self.assertEqual(view.page().scripts[-1], f'latex2ocr.show({seq}, "<svg>x2</svg>")')
+
+        first = engine.render('y')
+        second = engine.render('z')
+        queued.pop(0).run()  # 'y' 的读盘结果已过时
+        self.assertFalse(any(script.startswith(f'latex2ocr.render({first},') for script in view.page().scripts))
+        queued.pop(0).run()
+        self.assertTrue(view.page().scripts[-1].startswith(f'latex2ocr.render({second}, "z"'))
+        engine._on_console_message(self._message(event='rendered', id=second, ms=5, svg='<svg>z</svg>'))
+        self.assertEqual(engine.cache.cached('z'), '<svg>z</svg>')
+        self.assertIsNone(SvgCache(path).get('z'))  # 磁盘写入尚在队列中
+        self.assertEqual([task.fn.__name__ for task in queued], ['write'])
+        queued.pop(0).run()
+        self.assertEqual(SvgCache(path).get('z'), '<svg>z</svg>')
+
+    def test_only_final_renders_are_cached(self):
+        """编辑框实时预览与流式中间结果不写入缓存，直接显示的缓存 SVG 不重复写入"""
+        from Render_Cache import SvgCache
+        engine, view = self._engine()
+        engine.cache = SvgCache()
+        puts = []
+        remember = engine.cache.remember
+        engine.cache.remember = lambda latex, svg: (puts.append(latex), remember(latex, svg))
+        engine._on_console_message(self._message(event='ready'))
+
+        seq = engine.render('a+', keep_on_error=True)
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=5, svg='<svg>a+</svg>'))
+        seq = engine.render('a+b', draft=True)
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=5, svg='<svg>a+b</svg>'))
+        self.assertEqual(puts, [])
+
+        # 最终结果与最后一个中间结果相同：重新排版一次并写入缓存
+        seq = engine.render('a+b')
+        self.assertTrue(view.page().scripts[-1].startswith(f'latex2ocr.render({seq}, "a+b"'))
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=5, svg='<svg>a+b</svg>'))
+        self.assertEqual(puts, ['a+b'])
+
+        engine.render('c')
+        seq = engine.render('a+b')
+        self.assertTrue(view.page().scripts[-1].startswith(f'latex2ocr.show({seq}, '))
+        engine._on_console_message(self._message(event='rendered', id=seq, ms=0, cached=True,
+                                                 svg='<svg>a+b</svg>'))
+        self.assertEqual(puts, ['a+b'])
+
+
+class TestSvgCache(unittest.TestCase):
+    """公式预览 SVG 缓存：内存 LRU + 磁盘，命中时不再排版，历史记录预热"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'svg_cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_lru_disk_and_preload(self):
+        from Render_Cache import SvgCache
+        cache = SvgCache(self.path, memory_entries=2)
+        cache.put('a', '<svg>a</svg>')
+        cache.put('b', '<svg>b</svg>')
+        cache.put('c', '<svg>c</svg>')
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.get('c'), '<svg>c</svg>')
+        self.assertEqual(cache.get('a'), '<svg>a</svg>')  # 已被挤出内存，从磁盘读回
+        stats = cache.stats()
+        self.assertEqual((stats['memory_hits'], stats['disk_hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+        # 重启：preload 从磁盘读入内存，返回磁盘上也没有的公式
+        restarted = SvgCache(self.path)
+        self.assertEqual(restarted.preload(['b', 'x', 'c']), ['x'])
+        self.assertEqual(restarted.get('b'), '<svg>b</svg>')
+        self.assertEqual((restarted.stats()['preloaded'], restarted.stats()['memory_hits']), (2, 1))
+
+    def test_prune_every_interval(self):
+        from Render_Cache import SvgCache, PRUNE_INTERVAL
+        import sqlite3
+        cache = SvgCache(self.path, disk_entries=10)
+        for i in range(PRUNE_INTERVAL - 1):
+            cache.write(f'f{i}', '<svg/>')
+        count = lambda: sqlite3.connect(self.path).execute("SELECT COUNT(*) FROM svgs").fetchone()[0]
+        self.assertEqual(count(), PRUNE_INTERVAL - 1)  # 两次清理之间允许超出
+        cache.write('last', '<svg/>')
+        self.assertEqual(count(), 10)
+        self.assertEqual(cache.get('last'), '<svg/>')
+
+class TestScreenCapture(unittest.TestCase):
+    """低延迟截图：等窗口隐藏后只抓一块屏幕，选区在内存中交给识别，PNG 后台写盘"""
+
+    @classmethod
+    def setUpClass(cls):
+        from PyQt5.QtWidgets import QApplication
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _image(self, width=13, height=5):
+        from PyQt5.QtGui import QImage, QColor
+        image = QImage(width, height, QImage.Format_ARGB32)
+        image.fill(QColor(255, 255, 255))
+        image.setPixelColor(width - 1, height - 1, QColor(10, 20, 30))
+        return image
+
+    def test_in_memory_payload_and_background_save(self):
+        import time
+        from PIL import Image
+        from OCR_Preprocess import PreprocessOptions
+        from Screen_Capture import CaptureStats, CapturedImage, save_in_background
+        stats = CaptureStats()
+        path = os.path.join(self.tmp_dir, 'screenshot.png')
+        image = self._image()
+        saved = save_in_background(image, path, stats)
+        payload = CapturedImage(image, path, time.perf_counter(), stats)
+        # 宽度不是 4 的倍数时每行有填充字节，像素仍然对齐
+        self.assertEqual(payload.image().size, (13, 5))
+        self.assertEqual(payload.image().getpixel((12, 4)), (10, 20, 30))
+        self.assertEqual(payload.name, path)
+
+        prepared = payload.prepare(PreprocessOptions())
+        payload.prepare(PreprocessOptions(margin=0))
+        self.assertIn('内存图片', str(prepared.report))
+        self.assertEqual(stats.stats()['dispatch']['count'], 1)  # 只记录第一次发出请求
+
+        self.assertTrue(saved.result(5))
+        with Image.open(path) as img:
+            self.assertEqual(img.convert('RGB').getpixel((12, 4)), (10, 20, 30))
+        self.assertEqual(stats.stats()['save']['count'], 1)
+
+    def test_grabs_after_window_hidden(self):
+        import time
+        from PyQt5.QtWidgets import QWidget
+        from Screen_Capture import CaptureStats, ScreenCapture
+        window = QWidget()
+        window.show()
+        stats = CaptureStats()
+        capture = ScreenCapture(window, settle_ms=0, timeout_ms=5000, stats=stats)
+        grabbed = []
+        capture.grabbed.connect(lambda pixmap, geometry: grabbed.append(geometry))
+        capture.failed.connect(grabbed.append)
+        capture.start()
+        self.assertFalse(window.isVisible())
+        deadline = time.time() + 5
+        while not grabbed and time.time() < deadline:
+            self.app.processEvents()
+            time.sleep(0.005)
+        # 离屏平台抓到的可能是空图（发出 failed），这里只验证抓屏的时机
+        self.assertEqual(len(grabbed), 1)
+        self.assertEqual(stats.stats()['grab']['count'], 1)
+        self.assertEqual(stats.stats()['hide']['count'], 1)
+        self.assertFalse(capture._timeout.isActive())  # 由 Hide 事件触发，而非超时
+
+    def test_speculative_encoding(self):
+        import time
+        from PyQt5.QtCore import Qt, QEvent, QPoint
+        from PyQt5.QtGui import QMouseEvent, QPixmap, QColor
+        from OCR_Preprocess import PreprocessOptions
+        from Screen_Capture import CaptureStats, ScreenshotOverlay, SpeculativeEncoder
+        pixmap = QPixmap(200, 100)
+        pixmap.fill(QColor(255, 255, 255))
+        overlay = ScreenshotOverlay()
+        self.addCleanup(overlay.close)
+        stats = CaptureStats()
+        options = PreprocessOptions()
+        encoder = SpeculativeEncoder(overlay, lambda: options, idle_ms=0, stats=stats)
+
+        def drag(*points):
+            """每个点之后停顿到预编码开始；最后一个点之后立即松开"""
+            overlay.begin(pixmap)
+            overlay.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, QPoint(*points[0]),
+                                                Qt.LeftButton, Qt.LeftButton, Qt.NoModifier))
+            for i, point in enumerate(points[1:], 2):
+                overlay.mouseMoveEvent(QMouseEvent(QEvent.MouseMove, QPoint(*point),
+                                                   Qt.NoButton, Qt.LeftButton, Qt.NoModifier))
+                deadline = time.time() + 5
+                while i < len(points) and encoder._pending is None and time.time() < deadline:
+                    self.app.processEvents()
+            overlay.mouseReleaseEvent(QMouseEvent(QEvent.MouseButtonRelease, QPoint(*points[-1]),
+                                                  Qt.LeftButton, Qt.NoButton, Qt.NoModifier))
+
+        # 停顿后选区没变：松开时直接拿到预编码好的数据，识别时不再编码
+        drag((10, 10), (80, 60), (80, 60))
+        payload = encoder.take()
+        self.assertIsNotNone(payload)
+        speculated = payload.precompute(options)
+        self.assertNotIn('dispatch', stats.stats())  # 预编码不算发出请求
+        payload.attach('shot.png', time.perf_counter())
+        self.assertIs(payload.prepare(options), speculated)
+        self.assertEqual(payload.image().size, (71, 51))
+        self.assertEqual(stats.stats()['dispatch']['count'], 1)
+
+        # 预编码之后选区又变了：之前的结果作废，松开时需要重新编码
+        drag((10, 10), (80, 60), (90, 70))
+        self.assertIsNone(encoder.take())
+        self.assertEqual(stats.counters(), {'hits': 1, 'misses': 1, 'stale': 1, 'watch_changes': 0})
+
+    def test_preprocess_options_match_recognizer(self):
+        import configparser
+        from OCR_Gemini import recognizer_from_config, preprocess_from_config
+        conf = configparser.ConfigParser()
+        conf.optionxform = str
+        conf.read_string("[Preprocess]\nMargin = 4\n"
+                         "[API_G]\nRecognizer = gemini\nAPIKey = k\nTransport = raw\n"
+                         "[API_O]\nRecognizer = GPT\nAPIKey = k\nTransport = raw\nMaxSide = 1024\n")
+        for section in ('API_G', 'API_O'):
+            recognizer = recognizer_from_config(conf, section)
+            self.addCleanup(recognizer.close)
+            self.assertEqual(repr(preprocess_from_config(conf, section)), repr(recognizer.preprocess))
+
+
+class TestScreenshotOverlay(unittest.TestCase):
+    """截图覆盖层：拖动时只重画新旧选区的并集，高分屏按 devicePixelRatio 取原始像素"""
+
+    @classmethod
+    def setUpClass(cls):
+        from PyQt5.QtWidgets import QApplication
+        cls.app = QApplication.instance() or QApplication([])
+
+    def _overlay(self, dpr):
+        from PyQt5.QtCore import Qt
+        from PyQt5.QtGui import QPixmap, QColor
+        from Screen_Capture import ScreenshotOverlay
+        pixmap = QPixmap(int(200 * dpr), int(100 * dpr))
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(QColor(200, 200, 200))
+        overlay = ScreenshotOverlay(pixmap)
+        overlay.setWindowState(Qt.WindowNoState)
+        overlay.setGeometry(0, 0, 200, 100)
+        self.addCleanup(overlay.close)
+        return overlay
+
+    def _drag(self, overlay, *points):
+        from PyQt5.QtCore import Qt, QEvent, QPoint
+        from PyQt5.QtGui import QMouseEvent
+        updates = []
+        overlay.update = lambda *rect: updates.append(rect[0] if rect else None)
+        overlay.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, QPoint(*points[0]),
+                                            Qt.LeftButton, Qt.LeftButton, Qt.NoModifier))
+        for point in points[1:]:
+            overlay.mouseMoveEvent(QMouseEvent(QEvent.MouseMove, QPoint(*point),
+                                               Qt.NoButton, Qt.LeftButton, Qt.NoModifier))
+        del overlay.update
+        return updates
+
+    def test_moves_repaint_only_union_of_selections(self):
+        from PyQt5.QtCore import QRect
+        overlay = self._overlay(1.0)
+        updates = self._drag(overlay, (10, 10), (50, 40), (60, 45))
+        # 按下与第一次框选整屏重画，之后只重画新旧选区并集（外扩边框宽度）
+        self.assertEqual(updates[:2], [None, None])
+        self.assertEqual(updates[2], QRect(8, 8, 55, 40))
+
+        image = overlay.grab().toImage()
+        inside, outside = image.pixelColor(30, 30), image.pixelColor(150, 80)
+        self.assertEqual(inside.red(), 200)  # 选区内是原图
+        self.assertLess(outside.red(), 150)  # 选区外暗化
+
+    def test_crop_uses_device_pixels(self):
+        from PyQt5.QtCore import QRect, QRectF, QSize
+        overlay = self._overlay(2.0)
+        self.assertEqual(overlay.source_rect(QRect(10, 20, 30, 15)), QRectF(20, 40, 60, 30))
+        self.assertEqual(overlay.crop(QRect(10, 20, 30, 15)).size(), QSize(60, 30))
+
+    def test_reused_overlay_releases_screenshot(self):
+        import time
+        from PyQt5.QtCore import Qt, QEvent, QPoint
+        from PyQt5.QtGui import QMouseEvent
+        overlay = self._overlay(1.0)
+        pixmap = overlay.screen_pixmap
+        shown, captured = [], []
+        overlay.shown.connect(lambda: shown.append(True))
+        overlay.captured.connect(captured.append)
+        for _ in range(2):
+            overlay.begin(pixmap)
+            overlay.grab()
+            deadline = time.time() + 5
+            while len(shown) < len(captured) + 1 and time.time() < deadline:
+                self.app.processEvents()
+            self._drag(overlay, (10, 10), (60, 50))
+            overlay.mouseReleaseEvent(QMouseEvent(QEvent.MouseButtonRelease, QPoint(60, 50),
+                                                  Qt.LeftButton, Qt.NoButton, Qt.NoModifier))
+            # 裁剪后覆盖层隐藏并释放整屏截图，实例留待下次使用
+            self.assertIsNone(overlay.screen_pixmap)
+            self.assertFalse(overlay.isVisible())
+        self.assertEqual(len(shown), 2)
+        self.assertEqual([c.size().width() for c in captured], [51, 51])
+
+
+class TestGlobalHotkey(unittest.TestCase):
+    """全局截图热键：解析配置并换算为 RegisterHotKey / pynput 的写法"""
+
+    def test_parse_and_platform_keys(self):
+        from Global_Hotkey import parse_hotkey, windows_key, pynput_hotkey
+        mods, key = parse_hotkey(' alt + Control+F ')
+        self.assertEqual((mods, key), (('ctrl', 'alt'), 'f'))
+        self.assertEqual(windows_key(mods, key), (0x4000 | 0x0002 | 0x0001, ord('F')))
+        self.assertEqual(windows_key(('win',), 'f12'), (0x4000 | 0x0008, 0x7B))
+        self.assertEqual(pynput_hotkey(('ctrl', 'shift'), 'f1'), '<ctrl>+<shift>+<f1>')
+        for bad in ('F', 'Ctrl+', 'Hyper+F', 'Ctrl+Space', 'Ctrl+F25'):
+            with self.assertRaises(ValueError):
+                parse_hotkey(bad)
+
+    def test_disabled_or_invalid_config(self):
+        import configparser
+        from Global_Hotkey import hotkey_from_config
+        conf = configparser.ConfigParser()
+        conf.read_string("[Capture]\nHotkey =\n")
+        self.assertIsNone(hotkey_from_config(conf))
+        conf.set('Capture', 'Hotkey', 'Ctrl+Space')
+        self.assertIsNone(hotkey_from_config(conf))
+
+
+class TestRegionWatcher(unittest.TestCase):
+    """监视区域：只抓取选区，内容变化且画面稳定后才发出 changed"""
+
+    @classmethod
+    def setUpClass(cls):
+        from PyQt5.QtWidgets import QApplication
+        cls.app = QApplication.instance() or QApplication([])
+
+    class FakeScreen:
+        def __init__(self, pixmap):
+            self.pixmap = pixmap
+            self.grabs = []
+
+        def grabWindow(self, window, x, y, width, height):
+            self.grabs.append((window, x, y, width, height))
+            return self.pixmap
+
+    def _frame(self, mark_x=None):
+        from PyQt5.QtGui import QPixmap, QPainter, QColor
+        pixmap = QPixmap(600, 200)
+        pixmap.fill(QColor('white'))
+        if mark_x is not None:
+            # 一个字符大小的黑块
+            painter = QPainter(pixmap)
+            painter.fillRect(mark_x, 80, 20, 30, QColor('black'))
+            painter.end()
+        return pixmap
+
+    def test_enqueues_only_on_stable_change(self):
+        from PyQt5.QtCore import QRect
+        from Region_Watch import RegionWatcher
+        from Screen_Capture import CaptureStats
+        stats = CaptureStats()
+        screen = self.FakeScreen(self._frame())
+        watcher = RegionWatcher(screen, QRect(40, 30, 600, 200), stats=stats)
+        emitted = []
+        watcher.changed.connect(lambda image, t: emitted.append((image.size().width(), t)))
+        watcher.start(self._frame().toImage())
+        try:
+            # 内容与已识别的第一帧相同：不识别
+            self.assertFalse(watcher.check())
+            self.assertEqual(screen.grabs[-1], (0, 40, 30, 600, 200))
+            # 内容变化的第一帧还不稳定，下一次检查相同时才识别，且只识别一次
+            screen.pixmap = self._frame(100)
+            self.assertFalse(watcher.check())
+            self.assertTrue(watcher.check())
+            self.assertFalse(watcher.check())
+            # 持续变化（动画中）时不识别
+            for x in (200, 300, 400):
+                screen.pixmap = self._frame(x)
+                self.assertFalse(watcher.check())
+        finally:
+            watcher.stop()
+        self.assertEqual(len(emitted), 1)
+        self.assertEqual(emitted[0][0], 600)
+        self.assertGreater(emitted[0][1], 0)
+        self.assertEqual(stats.counters()['watch_changes'], 1)
+        self.assertEqual(stats.stats()['watch']['count'], 7)
+
+    def test_changed_fraction(self):
+        from Region_Watch import changed_fraction, frame_thumbnail, WATCH_THRESHOLD
+        blank = frame_thumbnail(self._frame().toImage())
+        marked = frame_thumbnail(self._frame(100).toImage())
+        self.assertEqual(max(blank.size), 256)
+        self.assertEqual(changed_fraction(blank, blank), 0)
+        self.assertGreater(changed_fraction(blank, marked), WATCH_THRESHOLD)
+        # 尺寸差一个像素时缩放后比较，不当作整帧变化
+        self.assertLess(changed_fraction(blank, blank.resize((255, 85))), WATCH_THRESHOLD)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)